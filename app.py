@@ -1,13 +1,10 @@
 import streamlit as st
-import time
-import base64
 from utils.animations import (create_particles, animate_title, create_medical_background, 
                             create_navigation_bar, create_advanced_loading_animation,
                             create_morphing_shapes, create_holographic_display,
                             create_quantum_effect, create_pulsating_orb)
-from utils.biomarkers import get_biomarker_info
-import plotly.graph_objects as go
-import plotly.express as px
+from utils.preload import start_inference_preload
+from utils.status_panel import status_panel
 
 st.set_page_config(
     page_title="Home - Breast Cancer AI",
@@ -273,10 +270,8 @@ def main():
         st.switch_page("pages/4_About.py")
     
     st.sidebar.markdown("---")
-    st.sidebar.markdown("### 📈 System Status")
-    st.sidebar.success("✅ AI Model: Online")
-    st.sidebar.info("🔄 Processing: Ready")
-    st.sidebar.warning("⚡ GPU Acceleration: Available")
+    with st.sidebar:
+        status_panel()
     
     create_enhanced_hero_section()
     
@@ -299,6 +294,9 @@ def main():
     """, unsafe_allow_html=True)
     
     st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Landing page is painted; load torch and the model while the user reads it
+    start_inference_preload()
 
 if __name__ == "__main__":
     main()
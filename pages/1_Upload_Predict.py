@@ -1,8 +1,6 @@
 import streamlit as st
-import time, base64, io, pickle
 from PIL import Image
 import pandas as pd
-import numpy as np
 import plotly.graph_objects as go
 
 # Your existing utils
@@ -13,77 +11,28 @@ from utils.animations import (
 )
 from utils.biomarkers import get_all_biomarkers, get_biomarker_details
 from utils.visualizations import create_biomarker_radar, create_prediction_gauge
+from utils.cache import content_hash
+from utils.preload import start_inference_preload
+from utils.jobs import get_job_manager
+from utils.history import remember_results
+from utils.thumbnails import get_thumbnail
+from utils.status_panel import status_panel
 
-import torch
-import torch.nn as nn
-from torchvision import transforms
-from transformers import AutoModel
+# Whole-slide scans run to 20k×20k; PIL's default bomb guard stops at ~179MP
+Image.MAX_IMAGE_PIXELS = 25000 * 25000
 
 # -----------------------------------------------------------------------------
-# 1) MODEL DEFINITION & LOADING
+# 1) MODEL LOADING
 # -----------------------------------------------------------------------------
 
-class DinoMLPFusion(nn.Module):
-    def __init__(self, num_classes, bio_dim):
-        super().__init__()
-        self.backbone = AutoModel.from_pretrained("1aurent/vit_small_patch16_256.tcga_brca_dino")
-        for p in self.backbone.parameters(): p.requires_grad = False
-        vit_out_dim = 384
-        self.bio_proj = nn.Linear(bio_dim, 128)
-        self.head = nn.Sequential(
-            nn.Linear(vit_out_dim + 128, 256),
-            nn.ReLU(), nn.Dropout(0.3),
-            nn.Linear(256, num_classes)
-        )
-    def forward(self, img, bio):
-        with torch.no_grad():
-            x_img = self.backbone(img).pooler_output
-        x_bio = self.bio_proj(bio)
-        return self.head(torch.cat([x_img, x_bio], dim=1))
-
-@st.cache_resource
-def load_model_and_mappings():
-    # 1.1 Load label mapping
-    with open("lbl_map.pkl","rb") as f: lbl_map = pickle.load(f)
-    idx_to_subtype = {v:k for k,v in lbl_map.items()}
-    # 1.2 Load biomarker feature columns order
-    with open("bm_feat_cols.pkl","rb") as f: bm_feat_cols = pickle.load(f)
-    # 1.3 Build model
-    model = DinoMLPFusion(num_classes=len(lbl_map), bio_dim=len(bm_feat_cols))
-    model.load_state_dict(torch.load("dino_model.pth", map_location="cpu"))
-    model.eval()
-    return model, bm_feat_cols, idx_to_subtype
-
-model, bm_feat_cols, idx_to_subtype = load_model_and_mappings()
+def get_inference():
+    # torch/transformers and the model are only loaded once a prediction needs
+    # them; start_inference_preload() usually has them ready by then
+    from utils import inference
+    return inference
 
 # -----------------------------------------------------------------------------
-# 2) PREPROCESSING HELPERS
-# -----------------------------------------------------------------------------
-
-normalize = transforms.Normalize(mean=[0.485,0.456,0.406], std=[0.229,0.224,0.225])
-transform_dino = transforms.Compose([
-    transforms.Resize((224,224)), transforms.ToTensor(), normalize
-])
-
-def process_biomarker_input(marker, intensity, staining, bm_feat_cols):
-    user = {
-        f"biomarker_{marker}":1.0,
-        f"intensity_{intensity}":1.0,
-        f"staining_{staining}":1.0
-    }
-    vec = [user.get(col,0.0) for col in bm_feat_cols]
-    return torch.tensor(vec, dtype=torch.float32).unsqueeze(0)
-
-def predict_dino(model, img, bio_vec):
-    img_t = transform_dino(img).unsqueeze(0)
-    with torch.no_grad():
-        logits = model(img_t, bio_vec)
-        probs = torch.softmax(logits, dim=1).cpu().numpy()[0]
-        idx = int(np.argmax(probs))
-    return idx, probs
-
-# -----------------------------------------------------------------------------
-# 3) STREAMLIT CONFIG & UTILS
+# 2) STREAMLIT CONFIG & UTILS
 # -----------------------------------------------------------------------------
 
 st.set_page_config(
@@ -117,7 +66,7 @@ def radar_fallback(data):
         return None
 
 # -----------------------------------------------------------------------------
-# 4) UI COMPONENTS
+# 3) UI COMPONENTS
 # -----------------------------------------------------------------------------
 
 def create_upload_section():
@@ -128,8 +77,10 @@ def create_upload_section():
     f=st.file_uploader("", type=['jpg','jpeg','png'])
     if f:
         try:
+            # Image.open only reads the header; the preview is a cached, reduced
+            # WebP decode, so the full-resolution pixels never reach the browser
             img=Image.open(f); st.success("Image loaded")
-            st.image(img, use_column_width=True)
+            st.image(get_thumbnail(f.getvalue(), 1600), use_column_width=True)
             st.info(f"Filename: {f.name} • Size: {img.size[0]}×{img.size[1]} px")
             return f,img
         except: st.error("Invalid image"); return None,None
@@ -154,43 +105,83 @@ def create_biomarker_section():
 
 def create_prediction_section(uploaded_file, image, biomarker_data):
     st.markdown("### 🎯 Run Prediction")
+    tiled=st.checkbox("🧩 Tiled whole-image analysis", help="Analyse the full-resolution image as overlapping patches instead of one 224×224 resize")
+    if tiled:
+        c1,c2,c3=st.columns(3)
+        tile_size=c1.selectbox("Tile size", [224,256])
+        overlap=c2.select_slider("Overlap", [0.0,0.25,0.5], value=0.25)
+        pooling=c3.radio("Pooling", ['mean','attention'], horizontal=True)
+        if image is not None:
+            from utils.tiling import count_tiles
+            st.caption(f"≈ {count_tiles(image.size[0], image.size[1], tile_size, overlap)} tiles before background filtering")
+    else:
+        methods={'Attention rollout':'rollout','Grad-CAM':'gradcam','Off':None}
+        explain=methods[st.radio("🔍 Explanation", list(methods), horizontal=True,
+                                 help="Computed in the same pass as the prediction; Grad-CAM adds a backward pass "
+                                      "and needs the fp32 model (others fall back to attention rollout)")]
+        c1,c2=st.columns(2)
+        tta=c1.checkbox("🔄 Test-time augmentation", help="Averages the 8 rotations/flips of the image, run as one batch")
+        jitter=c2.select_slider("Colour jitter copies", [0,1,2], value=0, disabled=not tta,
+                                help="Each copy adds 8 stain-jittered views to the same batch")
+    jm=get_job_manager(); job=jm.get(st.session_state.get('prediction_job'))
     if st.button("🚀 Analyze Sample", type="primary"):
         if not uploaded_file: st.error("Upload an image first!"); return
         if not biomarker_data: st.error("Configure a biomarker!"); return
-
-        # Animated loading
-        try: st.markdown(create_loading_animation(), unsafe_allow_html=True)
-        except: st.info("Analyzing…")
-        p=st.progress(0); t=st.empty()
-        for i in range(100):
-            p.progress(i+1)
-            t.text(["🔍","🧬","🤖","📊"][i//25]+" …")
-            time.sleep(0.01)
-        p.empty(); t.empty()
-
-        # Real inference
-        mk=next(iter(biomarker_data))
-        iv=biomarker_data[mk]['intensity']; sv=biomarker_data[mk]['staining']
-        vec=process_biomarker_input(mk, iv, sv, bm_feat_cols)
-        idx,probs=predict_dino(model, image, vec)
-        sub=idx_to_subtype[idx]; conf=probs[idx]
-
-        st.success(f"🧬 Predicted Subtype: **{sub}**")
-        st.info(f"Confidence: **{conf:.1%}**")
-
-        dfp=pd.DataFrame({
-            'Subtype':[idx_to_subtype[i] for i in range(len(probs))],
-            'Prob':[f"{p:.1%}" for p in probs]
-        })
-        st.table(dfp)
-
-        # Radar
-        try: fig=create_biomarker_radar(biomarker_data)
-        except: fig=radar_fallback(biomarker_data)
-        if fig: st.plotly_chart(fig, use_container_width=True)
+        if job and not job.done: st.warning("An analysis is already running"); return
+        opts={'tile_size':tile_size,'overlap':overlap,'pooling':pooling} if tiled else None
+        # Runs on the shared job pool; the session only keeps the id, so reruns
+        # and page switches neither block on nor repeat the work
+        tta_opts={'views':8,'jitter':jitter,'mode':'prob'} if not tiled and tta else None
+        jid=jm.submit(predict_job, image, biomarker_data, content_hash(uploaded_file.getvalue()), opts,
+                      None if tiled else explain, tta_opts, filename=uploaded_file.name, kind='prediction')
+        st.session_state['prediction_job']=jid; job=jm.get(jid)
+    if job is None: return
+    if not job.done: poll_prediction_job(job.id)
+    elif job.status=='failed': st.error(f"Prediction failed: {job.error}")
+    else: show_prediction(job.result)
+
+def predict_job(job, *args, **kwargs):
+    # Runs on a job thread, so importing torch/the model never blocks the page
+    return get_inference().run_prediction(job, *args, **kwargs)
+
+@st.fragment(run_every=0.5)
+def poll_prediction_job(job_id):
+    job=get_job_manager().get(job_id)
+    if job is None: st.warning("Prediction job expired"); return
+    if job.done:
+        # Leave the fragment: a full rerun draws the result outside of it
+        st.rerun()
+    try: st.markdown(create_loading_animation(), unsafe_allow_html=True)
+    except: st.info("Analyzing…")
+    st.progress(job.progress, text=f"{job.stage} • {job.elapsed_s:.1f}s")
+
+def show_prediction(res):
+    # Saved to the history by the job; the session keeps just its id
+    remember_results(st.session_state, res)
+    idx_to_subtype=list(res['predictions']); probs=list(res['predictions'].values())
+    sub=res['subtype']; conf=res['confidence']; ts=res['tile_stats']
+    if res.get('cached'): st.caption("♻️ Same slide, biomarkers and model as an earlier analysis: served from the prediction cache")
+    if ts: st.caption(f"🧩 {ts['tiles']} tiles • {ts['tiles_per_sec']:.1f} tiles/s • peak RSS {ts['peak_rss_mb']:.0f} MB")
+    tt=res.get('tta')
+    if tt: st.caption(f"🔄 {tt['views']} views • {tt['agreement']:.0%} agree on the top class • disagreement {tt['disagreement']:.3f}")
+
+    st.success(f"🧬 Predicted Subtype: **{sub}**")
+    st.info(f"Confidence: **{conf:.1%}** • {res['seconds']:.2f}s")
+
+    dfp=pd.DataFrame({
+        'Subtype':idx_to_subtype,
+        'Prob':[f"{p:.1%}" for p in probs]
+    })
+    st.table(dfp)
+
+    # Radar
+    try: fig=create_biomarker_radar(res['biomarkers'])
+    except: fig=radar_fallback(res['biomarkers'])
+    if fig: st.plotly_chart(fig, use_container_width=True)
+    if st.button("📊 View full results"): st.switch_page("pages/2_Results.py")
 
 # -----------------------------------------------------------------------------
-# 5) MAIN APP
+# 4) MAIN APP
 # -----------------------------------------------------------------------------
 
 def main():
@@ -200,12 +191,11 @@ def main():
     st.markdown(create_morphing_shapes(), unsafe_allow_html=True)
     st.sidebar.title("🔗 Quick Nav")
     for name,page in [("Home","app.py"),("Upload","app.py"),("Results","pages/2_Results.py"),
-                     ("Model","pages/3_Model_Info.py"),("About","pages/4_About.py")]:
+                     ("Model","pages/3_Model_Info.py"),("About","pages/4_About.py"),("History","pages/5_History.py")]:
         if st.sidebar.button(name): st.switch_page(page)
     st.sidebar.markdown("---")
     st.sidebar.info("Upload histopathology image & biomarker data")
-    st.sidebar.success("AI Model: Online")
-    st.sidebar.warning("GPU: Available")
+    with st.sidebar: status_panel()
 
     st.title("🔬 Breast Cancer AI Analysis")
     st.markdown("---")
@@ -218,6 +208,7 @@ def main():
 
     st.markdown("---")
     st.markdown("<center>🏥 For research use only</center>", unsafe_allow_html=True)
+    start_inference_preload()
 
 if __name__=="__main__":
     main()
@@ -1,15 +1,14 @@
 import streamlit as st
-import plotly.graph_objects as go
-import plotly.express as px
 import numpy as np
 import time
-from PIL import Image
-import base64
-import io
 from utils.animations import (animate_result_card, create_confetti_animation, create_navigation_bar,
                             create_particles, create_morphing_shapes, create_holographic_display,
                             create_advanced_loading_animation)
-from utils.visualizations import create_confidence_chart, create_gradcam_overlay, create_biomarker_heatmap
+from utils.visualizations import create_confidence_chart, create_biomarker_heatmap, create_whatif_heatmap
+from utils.preload import inference_ready
+from utils.jobs import get_job_manager
+from utils.history import load_results, remember_results
+from utils.reports import SUBTYPE_NOTES, get_report_cache, get_report_jobs, report_job, report_key
 
 st.set_page_config(
     page_title="Results - Breast Cancer AI",
@@ -22,8 +21,32 @@ def load_css():
     with open("assets/styles.css") as f:
         st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
-def create_prediction_overview():
-    if 'prediction_results' not in st.session_state:
+def collect_prediction_job():
+    # A job started on the Upload page keeps running after navigating here;
+    # returns it while still running, otherwise picks up its result once.
+    # The finished job stays in the JobManager for a while, so the session
+    # forgets it: later reruns must not replace an analysis opened from History.
+    job = get_job_manager().get(st.session_state.get('prediction_job'))
+    if job is None:
+        return None
+    if not job.done:
+        return job
+    st.session_state.pop('prediction_job', None)
+    if job.status == 'done':
+        remember_results(st.session_state, job.result)
+    else:
+        st.error(f"Prediction failed: {job.error}")
+    return None
+
+@st.fragment(run_every=0.5)
+def poll_prediction_job(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    st.progress(job.progress, text=f"⏳ Analysis in progress: {job.stage} ({job.elapsed_s:.1f}s)")
+
+def create_prediction_overview(results):
+    if results is None:
         st.markdown("""
         <div style="text-align: center; padding: 2rem; background: linear-gradient(135deg, #f8fafc, #e2e8f0); border-radius: 12px; margin: 1rem 0;">
         <h3 style="color: #e53e3e; margin-bottom: 1rem;">⚠️ No prediction results found</h3>
@@ -34,8 +57,6 @@ def create_prediction_overview():
             st.switch_page("pages/1_Upload_Predict.py")
         return False
     
-    results = st.session_state['prediction_results']
-    
     st.markdown(create_confetti_animation(), unsafe_allow_html=True)
     
     st.markdown("### 🎯 Prediction Results")
@@ -95,14 +116,20 @@ def create_prediction_overview():
     
     return True
 
-def create_detailed_predictions():
-    results = st.session_state['prediction_results']
+def create_detailed_predictions(results):
     predictions = results['predictions']
     
     st.markdown("### 📊 Detailed Subtype Probabilities")
     
     fig = create_confidence_chart(predictions)
     st.plotly_chart(fig, use_container_width=True)
+    tta = results.get('tta')
+    if tta:
+        # Per-view distance from the averaged distribution: one outlier view
+        # is noise, broad disagreement means the call is orientation-sensitive
+        st.caption(f"Averaged over {tta['views']} augmented views ({tta['mode']}) • "
+                   f"{tta['agreement']:.0%} agree on the top class • "
+                   f"disagreement {tta['disagreement']:.3f} (worst view {max(tta['per_view']):.3f})")
     
     col1, col2 = st.columns(2)
     
@@ -129,26 +156,17 @@ def create_detailed_predictions():
         
         top_subtype = max(predictions.items(), key=lambda x: x[1])
         
-        interpretations = {
-            'IDC': "Most common breast cancer type. Generally responds well to standard treatments.",
-            'TNBC': "Aggressive subtype lacking hormone receptors. May require intensive chemotherapy.",
-            'MBC': "Rare and aggressive. Often requires specialized treatment protocols.",
-            'ILC': "Grows in single-file pattern. May require additional imaging for staging."
-        }
-        
         st.markdown(f"""
         <div class="interpretation-card">
         <h5>🔬 {top_subtype[0]} - Clinical Notes</h5>
-        <p>{interpretations[top_subtype[0]]}</p>
+        <p>{SUBTYPE_NOTES[top_subtype[0]]}</p>
         <div class="confidence-indicator">
         Confidence Level: <strong>{top_subtype[1]:.1%}</strong>
         </div>
         </div>
         """, unsafe_allow_html=True)
 
-def create_gradcam_visualization():
-    results = st.session_state['prediction_results']
-    image = results['image']
+def create_gradcam_visualization(results):
     
     st.markdown("### 🔍 Grad-CAM Visualization")
     st.markdown("Visual explanation of model attention regions during classification")
@@ -157,12 +175,23 @@ def create_gradcam_visualization():
     
     with col1:
         st.markdown("#### Original Image")
-        st.image(image, caption="Input Histopathological Image", use_column_width=True)
+        # Display-size WebP saved with the analysis; the upload itself is not kept
+        st.image(results['preview'], caption="Input Histopathological Image", use_column_width=True)
     
     with col2:
         st.markdown("#### Attention Heatmap")
-        gradcam_image = create_gradcam_overlay(image)
-        st.image(gradcam_image, caption="Grad-CAM Attention Map", use_column_width=True)
+        explanation = results.get('explanation')
+        if explanation is None:
+            st.info("No explanation was computed for this analysis (tiled, ONNX, or turned off)")
+        else:
+            # Rendered at column width by the prediction job and stored with it
+            label = "Attention rollout" if explanation['method'] == 'rollout' else "Grad-CAM"
+            st.image(explanation['overlay'], caption=f"{label} map", use_column_width=True)
+            if (explanation.get('requested') or explanation['method']) != explanation['method']:
+                st.warning(f"Grad-CAM was requested, but the served model ({results.get('model_version')}) "
+                           "is not fp32, so attention rollout is shown instead")
+            if explanation['seconds']:
+                st.caption(f"Computed with the prediction in {explanation['seconds'] * 1000:.0f} ms")
     
     st.markdown("""
     <div class="gradcam-explanation">
@@ -175,8 +204,7 @@ def create_gradcam_visualization():
     </div>
     """, unsafe_allow_html=True)
 
-def create_biomarker_analysis():
-    results = st.session_state['prediction_results']
+def create_biomarker_analysis(results):
     biomarkers = results['biomarkers']
     
     st.markdown("### 🧬 Biomarker Analysis")
@@ -192,7 +220,7 @@ def create_biomarker_analysis():
         st.markdown("#### 🔬 Biomarker Insights")
         
         for marker, data in biomarkers.items():
-            intensity_score = {'Weak': 1, 'Moderate': 2, 'Strong': 3}[data['intensity']]
+            intensity_score = {'Weak': 1, 'Moderate': 2, 'Strong': 3}.get(data['intensity'].strip(), 0)
             
             st.markdown(f"""
             <div class="biomarker-insight">
@@ -205,7 +233,76 @@ def create_biomarker_analysis():
             </div>
             """, unsafe_allow_html=True)
 
-def create_report_generation():
+def create_similar_cases(results):
+    similar = results.get('similar')
+    
+    st.markdown("### 🔎 Similar Previous Cases")
+    st.markdown("Earlier analyses whose image embeddings are closest to this one (cosine similarity)")
+    
+    if similar is None:
+        st.info("The case index is turned off (BCR_INDEX_DIR) or was unavailable for this analysis")
+        return
+    if not similar:
+        st.info("No previous cases yet: this analysis is the first one in the index")
+        return
+    
+    rows = []
+    for case in similar:
+        markers = case.get('biomarkers') or {}
+        rows.append({
+            'Similarity': case['similarity'],
+            'Diagnosis': case['subtype'],
+            'Confidence': f"{case['confidence']:.1%}" if case['confidence'] is not None else "–",
+            'Biomarkers': ", ".join(f"{m}: {d['intensity'].strip()}/{d['staining'].strip()}" for m, d in markers.items()),
+            'Analysed': time.strftime("%Y-%m-%d %H:%M", time.localtime(case['created'])),
+            'Mode': case['kind'],
+        })
+    st.dataframe(rows, use_container_width=True, hide_index=True, column_config={
+        'Similarity': st.column_config.ProgressColumn("Similarity", format="%.3f", min_value=0.0, max_value=1.0),
+    })
+    
+    agree = sum(case['subtype'] == results['subtype'] for case in similar)
+    st.caption(f"{agree} of {len(similar)} similar cases were diagnosed {results['subtype']}")
+
+def create_whatif_panel(results):
+    
+    st.markdown("### 🧪 What-if Biomarker Sweep")
+    st.markdown("Subtype probabilities for the same image under every biomarker, intensity and staining")
+    
+    if not inference_ready():
+        st.info("The model is still loading; the sweep becomes available once it is ready")
+        return
+    
+    # Only reached after a prediction, so torch and the model are loaded already
+    from utils import inference
+    from utils.whatif import feature_values
+    
+    rt = inference.get_runtime()
+    values = feature_values(rt.bm_feat_cols)
+    
+    col1, col2, col3 = st.columns(3)
+    markers = col1.multiselect("Biomarkers", values['biomarker'], default=values['biomarker'])
+    intensities = col2.multiselect("Intensities", values['intensity'], default=values['intensity'])
+    stainings = col3.multiselect("Stainings", values['staining'], default=values['staining'])
+    if not (markers and intensities and stainings):
+        st.warning("Select at least one value in each group")
+        return
+    
+    # The embedding saved with the analysis and one batched head call
+    start = time.perf_counter()
+    table = inference.predict_whatif(rt.model, None, rt.bm_feat_cols, rt.idx_to_subtype,
+                                     markers, intensities, stainings, embedding=results['embedding'])
+    elapsed = time.perf_counter() - start
+    
+    col1, col2 = st.columns(2)
+    subtype = col1.selectbox("Subtype", list(table.columns), index=list(table.columns).index(results['subtype']))
+    staining = col2.selectbox("Staining", stainings, format_func=lambda v: repr(v) if v != v.strip() else v)
+    st.plotly_chart(create_whatif_heatmap(table, subtype, staining), use_container_width=True)
+    st.caption(f"{len(table)} combinations in {elapsed * 1000:.0f} ms • cell text is the top subtype • "
+               "* marks categories spelled with a trailing space in the training data")
+    st.download_button("⬇️ Download sweep (CSV)", table.to_csv().encode(), "whatif_sweep.csv", "text/csv")
+
+def create_report_generation(results):
     st.markdown("### 📄 Generate Report")
     
     col1, col2, col3 = st.columns([1, 2, 1])
@@ -228,19 +325,43 @@ def create_report_generation():
             include_recommendations = st.checkbox("Include clinical recommendations", value=True)
             include_confidence = st.checkbox("Include confidence metrics", value=True)
         
-        if st.button("📄 Generate PDF Report", type="primary", use_container_width=True):
-            progress = st.progress(0)
-            for i in range(100):
-                progress.progress(i + 1)
-                time.sleep(0.02)
-            
-            st.success("✅ Report generated successfully!")
-            st.download_button(
-                label="📥 Download Report",
-                data="Sample PDF content would be here",
-                file_name="breast_cancer_analysis_report.pdf",
-                mime="application/pdf"
-            )
+        options = {'gradcam': include_gradcam, 'biomarkers': include_biomarkers,
+                   'recommendations': include_recommendations, 'confidence': include_confidence}
+        key = report_key(results, options)
+        # Rendered on the report pool; the session keeps the job id and the
+        # finished PDF is cached by analysis id, so it is drawn only once
+        data = get_report_cache().get(key) if key is not None else None
+        job = get_report_jobs().get(st.session_state.get('report_job'))
+        if job is not None and job.done and st.session_state.get('report_key') == key:
+            if job.status == 'failed':
+                st.error(f"Report generation failed: {job.error}")
+            else:
+                data = data or job.result
+        
+        if data is None:
+            running = job is not None and not job.done and st.session_state.get('report_key') == key
+            if st.button("📄 Generate PDF Report", type="primary", use_container_width=True, disabled=running):
+                st.session_state['report_job'] = get_report_jobs().submit(report_job, results, options, kind='report')
+                st.session_state['report_key'] = key
+                st.rerun()
+            if running:
+                poll_report_job(job.id)
+            return
+        
+        st.success(f"✅ Report ready ({len(data) / 1024:.0f} KB)")
+        st.download_button(
+            label="📥 Download Report",
+            data=data,
+            file_name=f"breast_cancer_analysis_{results.get('history_id') or 'report'}.pdf",
+            mime="application/pdf"
+        )
+
+@st.fragment(run_every=0.5)
+def poll_report_job(job_id):
+    job = get_report_jobs().get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    st.progress(job.progress, text=f"{job.stage} • {job.elapsed_s:.1f}s")
 
 def main():
     load_css()
@@ -401,6 +522,9 @@ def main():
     if st.sidebar.button("ℹ️ About Project", use_container_width=True):
         st.switch_page("pages/4_About.py")
     
+    if st.sidebar.button("🗂️ History", use_container_width=True):
+        st.switch_page("pages/5_History.py")
+    
     st.sidebar.markdown("---")
     st.sidebar.markdown("### 📊 Result Options")
     st.sidebar.selectbox("View Mode", ["Detailed", "Summary", "Technical"], index=0)
@@ -409,11 +533,15 @@ def main():
     
     st.sidebar.markdown("---")
     st.sidebar.markdown("### 🎯 Analysis Summary") 
-    if 'prediction_results' in st.session_state:
-        results = st.session_state['prediction_results']
+    running_job = collect_prediction_job()
+    results = load_results(st.session_state)
+    if results is not None:
         top_prediction = max(results['predictions'].items(), key=lambda x: x[1])
         st.sidebar.metric("Top Prediction", top_prediction[0])
         st.sidebar.metric("Confidence", f"{top_prediction[1]:.1%}")
+        if results.get('history_id') is not None:
+            st.sidebar.caption(f"Analysis #{results['history_id']} • {results.get('filename') or 'upload'} • "
+                               f"model {results.get('model_version')}")
     else:
         st.sidebar.info("No analysis available")
     
@@ -428,25 +556,38 @@ def main():
     
     st.markdown(create_holographic_display(), unsafe_allow_html=True)
     
-    if not create_prediction_overview():
+    if running_job is not None:
+        poll_prediction_job(running_job.id)
+        if results is None:
+            return
+    
+    if not create_prediction_overview(results):
         st.markdown('</div>', unsafe_allow_html=True)
         return
     
     st.markdown("---")
     
-    create_detailed_predictions()
+    create_detailed_predictions(results)
+    
+    st.markdown("---")
+    
+    create_gradcam_visualization(results)
+    
+    st.markdown("---")
+    
+    create_similar_cases(results)
     
     st.markdown("---")
     
-    create_gradcam_visualization()
+    create_biomarker_analysis(results)
     
     st.markdown("---")
     
-    create_biomarker_analysis()
+    create_whatif_panel(results)
     
     st.markdown("---")
     
-    create_report_generation()
+    create_report_generation(results)
     
     st.markdown('</div>', unsafe_allow_html=True)
 
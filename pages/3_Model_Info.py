@@ -1,6 +1,5 @@
 import streamlit as st
 import plotly.graph_objects as go
-import plotly.express as px
 import pandas as pd
 import numpy as np
 from utils.animations import (create_model_animation, animate_architecture_diagram, create_navigation_bar,
@@ -1,6 +1,4 @@
 import streamlit as st
-import plotly.graph_objects as go
-import plotly.express as px
 from utils.animations import (create_team_animation, create_timeline_animation, create_navigation_bar,
                             create_particles, create_morphing_shapes, create_holographic_display,
                             create_pulsating_orb, create_advanced_loading_animation)
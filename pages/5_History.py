@@ -0,0 +1,157 @@
+import streamlit as st
+from datetime import datetime
+from utils.animations import create_particles, create_morphing_shapes
+from utils.history import PAGE_SIZE, get_history, remember_results
+from utils.reports import bulk_report_job, get_report_jobs
+
+st.set_page_config(
+    page_title="History - Breast Cancer AI",
+    page_icon="🗂️",
+    layout="wide",
+    initial_sidebar_state="collapsed"
+)
+
+def load_css():
+    with open("assets/styles.css") as f:
+        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_thumbnail(analysis_id):
+    # Rows never change once saved, so a thumbnail is fetched from the store
+    # once per id, and only for rows on the visible page
+    return get_history().thumbnail(analysis_id)
+
+def history_cursor(subtype):
+    # Keyset cursors of the pages visited so far: cursors[-1] is the `before`
+    # id of the current page (None for the newest). Reset when the filter changes.
+    if 'history_cursors' not in st.session_state or st.session_state.get('history_filter') != subtype:
+        st.session_state['history_filter'] = subtype
+        st.session_state['history_cursors'] = [None]
+    return st.session_state['history_cursors']
+
+def open_analysis(analysis_id):
+    # A finished prediction job left in the session would be collected again
+    # by the Results page and replace the analysis opened here
+    st.session_state.pop('prediction_job', None)
+    remember_results(st.session_state, {'history_id': analysis_id})
+    st.switch_page("pages/2_Results.py")
+
+def create_history_row(store, row):
+    col1, col2, col3, col4 = st.columns([1, 3, 2, 1])
+
+    with col1:
+        thumb = load_thumbnail(row['id'])
+        if thumb:
+            st.image(thumb, use_container_width=True)
+        else:
+            st.markdown("🖼️")
+
+    with col2:
+        st.markdown(f"**#{row['id']} • {row['subtype']}** — {row['confidence']:.1%}")
+        markers = ", ".join(f"{m} {d['intensity']}/{d['staining']}" for m, d in (row['biomarkers'] or {}).items())
+        st.caption(f"{row['filename'] or 'upload'} • {markers or 'no biomarkers'}")
+
+    with col3:
+        st.caption(datetime.fromtimestamp(row['created']).strftime("%Y-%m-%d %H:%M"))
+        st.caption(f"{row['mode']} • {row['seconds'] or 0:.1f}s • {row['model_version'] or 'unknown model'}")
+
+    with col4:
+        if st.button("Open", key=f"open_{row['id']}", use_container_width=True):
+            open_analysis(row['id'])
+        if st.button("Delete", key=f"delete_{row['id']}", use_container_width=True):
+            store.delete(row['id'])
+            if st.session_state.get('analysis_id') == row['id']:
+                st.session_state.pop('analysis_id')
+            st.rerun()
+
+@st.fragment(run_every=0.5)
+def poll_report_job(job_id):
+    job = get_report_jobs().get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    st.progress(job.progress, text=f"{job.stage} • {job.elapsed_s:.1f}s")
+
+def create_bulk_report(rows):
+    # One PDF for every analysis on the current page, rendered on the report pool
+    job = get_report_jobs().get(st.session_state.get('history_report_job'))
+    if st.button(f"📄 Report for these {len(rows)} analyses", disabled=job is not None and not job.done):
+        ids = [row['id'] for row in rows]
+        st.session_state['history_report_job'] = get_report_jobs().submit(bulk_report_job, ids, None,
+                                                                          kind='bulk_report')
+        st.rerun()
+    if job is None:
+        return
+    if not job.done:
+        poll_report_job(job.id)
+    elif job.status == 'failed':
+        st.error(f"Report generation failed: {job.error}")
+    else:
+        st.download_button("📥 Download bulk report", data=job.result, file_name="breast_cancer_analyses.pdf",
+                           mime="application/pdf")
+
+def create_history_list(store):
+    subtypes = store.subtypes()
+    subtype = st.selectbox("Subtype", ["All"] + subtypes, index=0)
+    subtype = None if subtype == "All" else subtype
+    cursors = history_cursor(subtype)
+
+    # One extra row tells whether there is a next page without a COUNT per page
+    rows = store.page(before=cursors[-1], limit=PAGE_SIZE + 1, subtype=subtype)
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+
+    total = store.count(subtype)
+    first = (len(cursors) - 1) * PAGE_SIZE
+    st.caption(f"{total} analyses" + (f" • showing {first + 1}–{first + len(rows)}" if rows else ""))
+
+    if not rows:
+        st.info("No analyses saved yet. Results from the Upload page are listed here.")
+    else:
+        create_bulk_report(rows)
+
+    for row in rows:
+        create_history_row(store, row)
+        st.markdown("---")
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("← Newer", disabled=len(cursors) == 1, use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Page {len(cursors)}")
+    with col3:
+        if st.button("Older →", disabled=not has_next, use_container_width=True):
+            cursors.append(rows[-1]['id'])
+            st.rerun()
+
+def main():
+    load_css()
+
+    st.markdown(create_particles(), unsafe_allow_html=True)
+    st.markdown(create_morphing_shapes(), unsafe_allow_html=True)
+
+    st.sidebar.title("🗂️ Analysis History")
+    st.sidebar.markdown("---")
+    st.sidebar.markdown("### 🔗 Quick Navigation")
+
+    if st.sidebar.button("🏠 Home", use_container_width=True):
+        st.switch_page("app.py")
+
+    if st.sidebar.button("📤 Upload & Predict", use_container_width=True):
+        st.switch_page("pages/1_Upload_Predict.py")
+
+    if st.sidebar.button("📊 View Results", use_container_width=True):
+        st.switch_page("pages/2_Results.py")
+
+    st.title("🗂️ Analysis History")
+
+    store = get_history()
+    if store is None:
+        st.warning("The history store is disabled (BCR_HISTORY_DB is empty) or could not be opened.")
+        return
+
+    create_history_list(store)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+import torch
+
+from utils.batching import MicroBatchScheduler
+
+
+def test_each_caller_gets_its_own_rows_back():
+    seen = []
+
+    def fn(x, y):
+        seen.append(x.shape[0])
+        return x * 10 + y, x.sum(dim=1, keepdim=True)
+
+    # A long wait so the requests submitted below land in the same batch
+    scheduler = MicroBatchScheduler(fn, max_batch_size=8, max_wait_ms=200)
+    try:
+        inputs = [torch.full((1 + i % 2, 3), float(i)) for i in range(6)]
+        futures = [scheduler.submit(x, torch.ones(x.shape[0], 3)) for x in inputs]
+        for x, fut in zip(inputs, futures):
+            out, total = fut.result(timeout=5)
+            assert torch.equal(out, x * 10 + 1)
+            assert torch.equal(total, x.sum(dim=1, keepdim=True))
+        assert sum(seen) == sum(x.shape[0] for x in inputs)
+        assert scheduler.stats()['batches'] < len(inputs)
+    finally:
+        scheduler.close()
+
+
+def test_batches_respect_max_batch_size():
+    sizes = []
+
+    def fn(x):
+        sizes.append(x.shape[0])
+        return x + 1
+
+    scheduler = MicroBatchScheduler(fn, max_batch_size=3, max_wait_ms=100)
+    try:
+        futures = [scheduler.submit(torch.tensor([[float(i)]])) for i in range(7)]
+        assert [f.result(timeout=5).item() for f in futures] == [i + 1.0 for i in range(7)]
+        assert max(sizes) <= 3 and sum(sizes) == 7
+    finally:
+        scheduler.close()
+
+
+def test_concurrent_threads_are_not_mixed_up():
+    scheduler = MicroBatchScheduler(lambda x: x * 2, max_batch_size=4, max_wait_ms=5, workers=2)
+    errors = []
+
+    def caller(i):
+        for j in range(20):
+            value = float(i * 100 + j)
+            if scheduler(torch.tensor([[value]]), timeout=5).item() != value * 2:
+                errors.append((i, j))
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(6)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        assert scheduler.stats()['requests'] == 120
+    finally:
+        scheduler.close()
+
+
+def test_a_failing_batch_fails_every_caller_in_it():
+    def fn(x):
+        raise RuntimeError("backbone exploded")
+
+    scheduler = MicroBatchScheduler(fn, max_batch_size=4, max_wait_ms=100)
+    try:
+        futures = [scheduler.submit(torch.zeros(1, 2)) for _ in range(3)]
+        for fut in futures:
+            with pytest.raises(RuntimeError, match="exploded"):
+                fut.result(timeout=5)
+    finally:
+        scheduler.close()
@@ -0,0 +1,83 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import torch
+
+from utils.bio_encoder import FEATURE_GROUPS, BioProjection, BiomarkerEncoder, feature_values
+from utils.inference import process_biomarker_input
+from utils.model import FusionHead
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+with open(os.path.join(ROOT, "bm_feat_cols.pkl"), "rb") as f:
+    BM_FEAT_COLS = list(pickle.load(f))
+ENCODER = BiomarkerEncoder(BM_FEAT_COLS)
+VALUES = feature_values(BM_FEAT_COLS)
+
+
+def _linear(seed=0):
+    torch.manual_seed(seed)
+    return torch.nn.Linear(len(BM_FEAT_COLS), 128)
+
+
+def _random_frame(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({g: rng.choice(VALUES[g], n) for g in FEATURE_GROUPS})
+
+
+def test_ids_round_trip_to_the_dense_one_hot():
+    df = _random_frame(50)
+    ids = ENCODER.encode_frame(df)
+    dense = torch.cat([process_biomarker_input(m, i, s, BM_FEAT_COLS) for m, i, s in df.itertuples(index=False)])
+    assert torch.equal(ENCODER.to_dense(ids), dense)
+    for row, (m, i, s) in enumerate(df.itertuples(index=False)):
+        assert ENCODER.ids(m, i, s) == ids[row].tolist()
+
+
+def test_projection_matches_bio_proj():
+    linear = _linear()
+    projection = BioProjection.from_linear(linear)
+    df = _random_frame(200, seed=1)
+    ids = ENCODER.encode_frame(df)
+    with torch.no_grad():
+        expected = linear(ENCODER.to_dense(ids))
+    torch.testing.assert_close(projection(ids), expected, atol=1e-5, rtol=1e-5)
+
+
+def test_unknown_values_contribute_nothing():
+    linear = _linear()
+    projection = BioProjection.from_linear(linear)
+    ids = ENCODER.encode("ER", "Strong", "Positive")
+    assert ids[0, 0].item() == ENCODER.pad and ids[0, 2].item() == ENCODER.pad
+    assert ENCODER.unknown("ER", "Strong", "Positive") == ["biomarker 'ER'", "staining 'Positive'"]
+    assert ENCODER.unknown("ESR1", "Strong", "High") == []
+    with torch.no_grad():
+        expected = linear(process_biomarker_input("ER", "Strong", "Positive", BM_FEAT_COLS))
+    torch.testing.assert_close(projection(ids), expected, atol=1e-5, rtol=1e-5)
+
+
+def test_panel_is_one_multi_hot_row():
+    panel = {'ESR1': {'intensity': 'Strong', 'staining': 'High'},
+             'TP53': {'intensity': 'Weak', 'staining': 'High'}}
+    ids = ENCODER.encode_panel(panel)
+    dense = ENCODER.to_dense(ids)
+    assert dense.shape == (1, len(BM_FEAT_COLS))
+    # Shared categories are counted once
+    assert dense.sum().item() == 5
+    assert dense.max().item() == 1
+    linear = _linear()
+    with torch.no_grad():
+        torch.testing.assert_close(BioProjection.from_linear(linear)(ids), linear(dense), atol=1e-5, rtol=1e-5)
+
+
+def test_head_on_ids_matches_head_on_dense_rows():
+    torch.manual_seed(2)
+    head = FusionHead(4, len(BM_FEAT_COLS)).eval()
+    table = BioProjection.from_linear(head.bio_proj)
+    ids = ENCODER.encode_frame(_random_frame(16, seed=3))
+    x_img = torch.randn(16, 384)
+    with torch.no_grad():
+        torch.testing.assert_close(head.fuse(x_img, table(ids)), head(x_img, ENCODER.to_dense(ids)),
+                                   atol=1e-5, rtol=1e-5)
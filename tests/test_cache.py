@@ -0,0 +1,82 @@
+import numpy as np
+import torch
+from PIL import Image
+
+from utils.cache import BoundedLRUCache, content_hash
+from utils.inference import predict_dino
+
+
+def test_lru_evicts_least_recently_used_entry():
+    cache = BoundedLRUCache(max_entries=2)
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    assert cache.get("a") == b"1"  # b is now the oldest
+    cache.put("c", b"3")
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.stats()['evictions'] == 1
+
+
+def test_byte_budget_counts_tensor_payloads():
+    # 384 fp32 values, the size of one ViT-small embedding
+    cache = BoundedLRUCache(max_entries=100, max_bytes=3 * 384 * 4)
+    for i in range(4):
+        assert cache.put(i, torch.zeros(1, 384))
+    assert len(cache) == 3 and 0 not in cache
+    assert cache.stats()['bytes'] == 3 * 384 * 4
+    # Replacing a key does not count it twice
+    cache.put(3, torch.zeros(1, 384))
+    assert cache.stats()['bytes'] == 3 * 384 * 4
+    assert not cache.put("big", torch.zeros(4, 384))
+
+
+def test_hit_and_miss_counters():
+    cache = BoundedLRUCache()
+    cache.put("k", b"v")
+    cache.get("k")
+    cache.get("k")
+    assert cache.get("missing", "default") == "default"
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    assert stats['hit_rate'] == 2 / 3
+
+
+class CountingModel:
+    # forward_with_embedding/forward_head of DinoMLPFusion, minus the ViT
+    def __init__(self):
+        torch.manual_seed(0)
+        self.head = torch.nn.Linear(384 + 4, 4)
+        self.backbone_calls = 0
+        self.head_calls = 0
+
+    def forward_head(self, x_img, bio):
+        self.head_calls += 1
+        return self.head(torch.cat([x_img, bio], dim=1))
+
+    def forward_with_embedding(self, img, bio):
+        self.backbone_calls += 1
+        x_img = img.mean(dim=(2, 3)).repeat(1, 128)
+        return x_img, self.forward_head(x_img, bio)
+
+
+def test_cached_embedding_skips_the_backbone():
+    model, cache = CountingModel(), BoundedLRUCache()
+    img = Image.fromarray(np.random.default_rng(0).integers(0, 256, (64, 64, 3), dtype=np.uint8))
+    key = content_hash(img.tobytes())
+    bio = torch.zeros(1, 4)
+
+    idx, probs = predict_dino(model, img, bio, image_key=key, cache=cache)
+    assert (model.backbone_calls, model.head_calls) == (1, 1)
+    assert key in cache
+
+    # Another panel on the same upload: head only, same embedding
+    other = torch.tensor([[1.0, 0.0, 0.0, 1.0]])
+    predict_dino(model, img, other, image_key=key, cache=cache)
+    idx2, probs2 = predict_dino(model, img, bio, image_key=key, cache=cache)
+    assert model.backbone_calls == 1 and model.head_calls == 3
+    assert idx2 == idx
+    np.testing.assert_allclose(probs2, probs, rtol=1e-6)
+
+    # No key, no caching
+    predict_dino(model, img, bio, cache=cache)
+    assert model.backbone_calls == 2
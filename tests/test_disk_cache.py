@@ -0,0 +1,86 @@
+import itertools
+import types
+
+import numpy as np
+import pytest
+
+from utils import disk_cache
+from utils.disk_cache import DiskCache, prediction_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # One tick per call, so access order never ties
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(disk_cache, "time", types.SimpleNamespace(time=lambda: float(next(ticks))))
+    monkeypatch.setattr(disk_cache, "TOUCH_AFTER_S", 0)
+
+
+def _cache(tmp_path, max_bytes=10_000):
+    return DiskCache(str(tmp_path / "cache.sqlite"), max_bytes=max_bytes)
+
+
+def test_round_trip_and_stats(tmp_path):
+    cache = _cache(tmp_path)
+    value = {'subtype': 'IDC', 'embedding': np.arange(4, dtype=np.float32)}
+    assert cache.put("k", value, "m1")
+    got = cache.get("k")
+    assert got['subtype'] == 'IDC'
+    np.testing.assert_array_equal(got['embedding'], value['embedding'])
+    assert cache.get("missing") is None
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (1, 1, 1)
+
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    cache = _cache(tmp_path)
+    for i in range(3):
+        cache.put(f"k{i}", b"x" * 3000)
+    cache.get("k0")  # k1 is now the oldest
+    cache.put("k3", b"x" * 3000)
+    assert cache.get("k1") is None
+    assert all(cache.get(k) is not None for k in ("k0", "k2", "k3"))
+    assert cache.stats()['evictions'] == 1
+
+    cache.put("k4", b"x" * 6000)
+    assert len(cache) == 2
+    assert cache.stats()['bytes'] <= cache.max_bytes
+    assert cache.get("k3") is not None and cache.get("k4") is not None
+
+
+def test_rejects_values_larger_than_the_cache(tmp_path):
+    cache = _cache(tmp_path, max_bytes=1000)
+    assert not cache.put("big", b"x" * 2000)
+    assert len(cache) == 0
+
+
+def test_retain_drops_other_models(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put("a", 1, "digest-old")
+    cache.put("b", 2, "digest-new")
+    cache.put("c", 3, "digest-new")
+    assert cache.retain("digest-new") == 1
+    assert cache.get("a") is None
+    assert cache.get("b") == 2 and cache.get("c") == 3
+    assert cache.retain("digest-new") == 0
+
+
+def test_entries_are_shared_between_connections(tmp_path):
+    first, second = _cache(tmp_path), _cache(tmp_path)
+    first.put("k", "value")
+    assert second.get("k") == "value"
+
+
+def test_prediction_key_covers_every_input():
+    bio = np.zeros(8, dtype=np.float32)
+    base = prediction_key("img", bio, "torch-fp32-abc", tiled=None)
+    assert base == prediction_key("img", bio.copy(), "torch-fp32-abc", tiled=None)
+    other_bio = bio.copy()
+    other_bio[2] = 1
+    variants = [
+        prediction_key("img2", bio, "torch-fp32-abc", tiled=None),
+        prediction_key("img", other_bio, "torch-fp32-abc", tiled=None),
+        prediction_key("img", bio, "torch-int8-abc", tiled=None),
+        prediction_key("img", bio, "torch-fp32-abc", tiled={'tile_size': 224}),
+    ]
+    assert len({base, *variants}) == 5
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from utils.history import HistoryStore, load_results, remember_results
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / "history.sqlite"))
+
+
+def _result(subtype="IDC", **extra):
+    return {
+        'subtype': subtype,
+        'confidence': 0.8,
+        'predictions': {'IDC': 0.8, 'ILC': 0.1, 'MBC': 0.05, 'TNBC': 0.05},
+        'biomarkers': {'ESR1': {'intensity': 'Strong', 'staining': 'High'}},
+        **extra,
+    }
+
+
+def test_save_get_round_trip(store):
+    grid = np.linspace(0, 1, 49, dtype=np.float32).reshape(7, 7)
+    embedding = np.arange(384, dtype=np.float32)
+    result = _result(image_key='abc', image_size=(640, 480), model_version='torch-fp32-123', seconds=1.5,
+                     tta={'views': 4, 'mode': 'flips'}, similar=[{'image_hash': 'def', 'similarity': 0.9}],
+                     explanation={'method': 'gradcam', 'seconds': 0.2, 'map': grid, 'overlay': b'webp-overlay'},
+                     preview=b'webp-preview', embedding=embedding)
+    analysis_id = store.save(result, thumbnail=b'thumb', filename='slide.png')
+
+    got = store.get(analysis_id)
+    assert got['history_id'] == analysis_id
+    for key in ('subtype', 'confidence', 'biomarkers', 'model_version', 'seconds', 'tta', 'similar', 'preview'):
+        assert got[key] == result[key]
+    assert got['predictions'] == result['predictions']
+    assert got['image_key'] == 'abc'
+    assert got['image_size'] == (640, 480)
+    assert got['filename'] == 'slide.png'
+    assert got['explanation']['method'] == 'gradcam'
+    assert got['explanation']['overlay'] == b'webp-overlay'
+    # The map is stored as float16
+    np.testing.assert_allclose(got['explanation']['map'], grid, atol=1e-3)
+    np.testing.assert_array_equal(got['embedding'], embedding)
+    assert store.thumbnail(analysis_id) == b'thumb'
+
+
+def test_minimal_result_round_trip(store):
+    got = store.get(store.save(_result()))
+    assert got['explanation'] is None and got['embedding'] is None and got['preview'] is None
+    assert store.get(12345) is None
+
+
+def test_page_walks_newest_first(store):
+    ids = [store.save(_result('IDC' if i % 2 else 'ILC')) for i in range(7)]
+
+    first = store.page(limit=3)
+    assert [r['id'] for r in first] == ids[::-1][:3]
+    second = store.page(before=first[-1]['id'], limit=3)
+    assert [r['id'] for r in second] == ids[::-1][3:6]
+    last = store.page(before=second[-1]['id'], limit=3)
+    assert [r['id'] for r in last] == ids[:1]
+    assert store.page(before=ids[0]) == []
+
+    idc = store.page(before=ids[5], subtype='IDC')
+    assert [r['id'] for r in idc] == [ids[3], ids[1]]
+    assert store.count() == 7 and store.count('IDC') == 3
+    assert store.subtypes() == ['IDC', 'ILC']
+
+
+def test_delete_drops_artifacts(store):
+    analysis_id = store.save(_result(), thumbnail=b'thumb')
+    store.delete(analysis_id)
+    assert store.get(analysis_id) is None
+    assert store.thumbnail(analysis_id) is None
+    assert store.rows([analysis_id]) == []
+
+
+def test_session_keeps_only_the_id_of_stored_results():
+    session = {}
+    remember_results(session, {'history_id': 3})
+    assert session == {'analysis_id': 3}
+    unsaved = _result(history_id=None)
+    remember_results(session, unsaved)
+    assert session == {'prediction_results': unsaved}
+    assert load_results(session) is unsaved
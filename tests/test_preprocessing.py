@@ -0,0 +1,80 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils import preprocessing
+from utils.preprocessing import IMAGE_SIZE, preprocess, preprocess_batch
+
+transforms = pytest.importorskip("torchvision.transforms")
+
+# The chain the checkpoint was trained with
+REFERENCE = transforms.Compose([
+    transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+])
+
+
+def _slide(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    # Smooth stain-like gradients plus noise, so resizing has real work to do
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([(x * 255 // width), (y * 255 // height), ((x + y) * 127 // (width + height))], axis=2)
+    noise = rng.integers(-30, 30, (height, width, 3))
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+@pytest.mark.parametrize("size", [(224, 224), (640, 480), (1500, 1100), (150, 300)])
+def test_matches_torchvision_chain(size):
+    img = _slide(*size)
+    out = preprocess(img, resample="pil")
+    assert out.shape == (3, IMAGE_SIZE, IMAGE_SIZE)
+    assert (out - REFERENCE(img)).abs().max().item() < 1e-5
+
+
+def test_numpy_fallback_matches_numba(monkeypatch):
+    img = _slide(500, 400)
+    fused = preprocess(img, resample="pil")
+    monkeypatch.setattr(preprocessing, "_kernel", preprocessing._normalize_numpy)
+    assert (preprocess(img, resample="pil") - fused).abs().max().item() < 1e-5
+
+
+def test_cv2_resampler_stays_close():
+    img = _slide(2048, 1536)
+    drift = (preprocess(img, resample="cv2") - REFERENCE(img)).abs().mean().item()
+    assert drift < 0.25
+
+
+def test_encoded_bytes_and_batches():
+    img = _slide(320, 320)
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    single = preprocess(buf.getvalue(), resample="pil")
+    assert (single - REFERENCE(img)).abs().max().item() < 1e-5
+    batch = preprocess_batch([img, _slide(300, 200, seed=1)])
+    assert batch.shape == (2, 3, IMAGE_SIZE, IMAGE_SIZE)
+    assert (batch[0] - single).abs().max().item() < 1e-5
+
+
+def test_transparency_becomes_white_background():
+    rgba = np.zeros((64, 64, 4), dtype=np.uint8)
+    rgba[:32, :, :3] = 60
+    rgba[:32, :, 3] = 255  # top half opaque tissue, bottom half transparent
+    out = preprocess(Image.fromarray(rgba, "RGBA"))
+    white = REFERENCE(Image.new("RGB", (64, 64), (255, 255, 255)))
+    assert (out[:, -10:] - white[:, -10:]).abs().max().item() < 1e-5
+    assert out[:, :10].mean() < white[:, :10].mean()
+
+
+def test_sixteen_bit_grayscale_is_stretched_to_rgb():
+    arr = (np.arange(64 * 64, dtype=np.uint16).reshape(64, 64) * 4)
+    img = Image.fromarray(arr)
+    assert img.mode.startswith("I;16")
+    out = preprocess(img)
+    assert out.shape == (3, IMAGE_SIZE, IMAGE_SIZE)
+    # Gray: the three channels differ only by the per-channel normalisation
+    raw = out.numpy() * preprocessing.STD[:, None, None] + preprocessing.MEAN[:, None, None]
+    np.testing.assert_allclose(raw[0], raw[1], atol=1e-5)
+    assert raw.max() > 0.9
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils.retrieval import SCALES_FILE, VECTORS_FILE, CaseIndex
+
+DIM = 16
+
+
+@pytest.fixture
+def index(tmp_path):
+    return CaseIndex(str(tmp_path / "index"), dim=DIM)
+
+
+def _vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+
+
+def test_search_returns_nearest_first(index):
+    vectors = _vectors(5)
+    for i, v in enumerate(vectors):
+        index.add(v, f"h{i}", subtype="IDC", confidence=0.5 + i / 10)
+    assert len(index) == 5
+
+    hits = index.search(vectors[3] + 0.01, k=3)
+    assert [h["image_hash"] for h in hits][0] == "h3"
+    assert hits[0]["similarity"] == pytest.approx(1.0, abs=0.02)
+    assert hits[0]["subtype"] == "IDC" and hits[0]["confidence"] == pytest.approx(0.8)
+    assert [h["similarity"] for h in hits] == sorted((h["similarity"] for h in hits), reverse=True)
+
+
+def test_search_excludes_the_query_image(index):
+    vectors = _vectors(4)
+    index.add_many(vectors, [{"image_hash": f"h{i}"} for i in range(4)])
+    hits = index.search(vectors[0], k=2, exclude="h0")
+    assert len(hits) == 2
+    assert "h0" not in [h["image_hash"] for h in hits]
+
+
+def test_readding_a_hash_updates_it_in_place(index):
+    v = _vectors(1)[0]
+    first = index.add(v, "h0", subtype="IDC")
+    again = index.add(v, "h0", subtype="ILC")
+    assert first == again == 0
+    assert len(index) == 1
+    assert index.search(v, k=1)[0]["subtype"] == "ILC"
+    # Same image analysed tiled is a separate case
+    assert index.add(v, "h0", kind="tiled") == 1
+
+
+def test_stale_tail_is_truncated_on_next_add(index):
+    vectors = _vectors(2)
+    index.add(vectors[0], "h0")
+    # A crashed append: vector bytes on disk without their metadata row
+    with open(os.path.join(index.path, VECTORS_FILE), "ab") as f:
+        f.write(b"\x7f" * (DIM + 5))
+    with open(os.path.join(index.path, SCALES_FILE), "ab") as f:
+        f.write(b"\x00" * 6)
+
+    assert index.add(vectors[1], "h1") == 1
+    assert os.path.getsize(os.path.join(index.path, VECTORS_FILE)) == 2 * DIM
+    assert os.path.getsize(os.path.join(index.path, SCALES_FILE)) == 2 * 4
+    hit = index.search(vectors[1], k=1)[0]
+    assert hit["image_hash"] == "h1"
+    assert hit["similarity"] == pytest.approx(1.0, abs=0.02)
+
+
+def test_ivf_search_matches_full_scan(index):
+    vectors = _vectors(200, seed=1)
+    index.add_many(vectors, [{"image_hash": f"h{i}"} for i in range(200)])
+    index.build_ivf(nlist=8)
+    # Rows added after the build are scanned separately
+    index.add(vectors[7] * 2, "late")
+    query = vectors[7]
+    exact = {h["image_hash"] for h in index.search(query, k=2, nprobe=0)}
+    assert exact == {"h7", "late"}
+    # Probing every list scores every row
+    assert {h["image_hash"] for h in index.search(query, k=2, nprobe=8)} == exact
@@ -0,0 +1,135 @@
+import os
+
+import numpy as np
+import torch
+
+from utils.bio_encoder import BioProjection
+from utils.model import CHECKPOINT_PATH, FusionHead, load_torch_model, transform_dino
+from utils.quantization import (PRECISIONS, load_calibration_images, quantize_backbone_dynamic,
+                                quantize_onnx_static)
+
+ONNX_PATH = "dino_model.onnx"
+
+
+class TorchBackend:
+    # Eager PyTorch; exposes the same embed/forward_head surface as DinoMLPFusion
+    name = "torch"
+
+    def __init__(self, model, precision="fp32"):
+        self.model = model
+        self.precision = precision
+        self.bio_dim = model.bio_proj.in_features
+        self.bio_table = BioProjection.from_linear(model.bio_proj)
+
+    def embed(self, img):
+        return self.model.embed(img)
+
+    def forward_head(self, x_img, bio):
+        return self.model.forward_head(x_img, bio)
+
+    def forward_head_ids(self, x_img, ids):
+        # ids from BiomarkerEncoder: a gather-and-add instead of the one-hot matmul
+        return self.model.fuse(x_img, self.bio_table(ids))
+
+    def forward_with_embedding(self, img, bio):
+        return self.model.forward_with_embedding(img, bio)
+
+    def __call__(self, img, bio):
+        return self.model(img, bio)
+
+
+class OnnxBackend:
+    # onnxruntime session over the exported fusion graph. The head is also kept
+    # as a tiny torch module so cached embeddings never go back through ORT.
+    name = "onnx"
+
+    def __init__(self, onnx_path, head, intra_op_threads=None, precision="fp32"):
+        import onnxruntime as ort
+
+        self.precision = precision
+        self.onnx_path = onnx_path
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            opts.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(onnx_path, opts, providers=["CPUExecutionProvider"])
+        self.head = head
+        self.bio_dim = head.bio_proj.in_features
+        self.bio_table = BioProjection.from_linear(head.bio_proj)
+
+    def _run(self, img, bio):
+        emb, logits = self.session.run(["embedding", "logits"], {
+            "image": np.ascontiguousarray(img.detach().cpu().numpy(), dtype=np.float32),
+            "bio": np.ascontiguousarray(bio.detach().cpu().numpy(), dtype=np.float32),
+        })
+        return torch.from_numpy(emb), torch.from_numpy(logits)
+
+    def embed(self, img):
+        return self._run(img, torch.zeros(img.shape[0], self.bio_dim))[0]
+
+    def forward_head(self, x_img, bio):
+        with torch.no_grad():
+            return self.head(x_img, bio)
+
+    def forward_head_ids(self, x_img, ids):
+        with torch.no_grad():
+            return self.head.fuse(x_img, self.bio_table(ids))
+
+    def forward_with_embedding(self, img, bio):
+        return self._run(img, bio)
+
+    def __call__(self, img, bio):
+        return self._run(img, bio)[1]
+
+
+def _stale(target, source):
+    return not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source)
+
+
+def make_backend(backend, num_classes, bio_dim, checkpoint=CHECKPOINT_PATH, onnx_path=None,
+                 precision="fp32", calibration_dir=None, bundle_dir=None):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision!r}")
+    if backend not in ("torch", "onnx"):
+        raise ValueError(f"Unknown inference backend: {backend!r}")
+    if bundle_dir:
+        from utils.bundle import WEIGHTS_FILE, load_bundle_model, mmap_safetensors
+
+        source = os.path.join(bundle_dir, WEIGHTS_FILE)
+        load_model = lambda: load_bundle_model(bundle_dir)
+        load_state = lambda: mmap_safetensors(source)
+    else:
+        source = checkpoint
+        load_model = lambda: load_torch_model(num_classes, bio_dim, checkpoint)
+        load_state = lambda: torch.load(checkpoint, map_location="cpu")
+
+    if backend == "torch" and precision != "int8-static":
+        model = load_model()
+        if precision == "int8":
+            model = quantize_backbone_dynamic(model)
+        return TorchBackend(model, precision)
+
+    # Everything else runs on onnxruntime, including static INT8 requested
+    # with the torch backend: eager PyTorch has no static path for HF ViT
+    from utils.onnx_export import export_onnx
+
+    onnx_path = onnx_path or ONNX_PATH
+    if _stale(onnx_path, source):
+        export_onnx(load_model(), onnx_path)
+    if precision == "int8":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        q_path = onnx_path.replace(".onnx", ".int8.onnx")
+        if _stale(q_path, onnx_path):
+            quantize_dynamic(onnx_path, q_path, weight_type=QuantType.QInt8)
+        onnx_path = q_path
+    elif precision == "int8-static":
+        if not calibration_dir:
+            raise ValueError("int8-static needs a calibration image directory")
+        q_path = onnx_path.replace(".onnx", ".int8-static.onnx")
+        if _stale(q_path, onnx_path):
+            images = load_calibration_images(calibration_dir, transform_dino)
+            quantize_onnx_static(onnx_path, q_path, images, bio_dim)
+        onnx_path = q_path
+    head = FusionHead.from_state_dict(load_state(), num_classes, bio_dim)
+    return OnnxBackend(onnx_path, head, precision=precision)
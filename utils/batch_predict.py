@@ -0,0 +1,239 @@
+import argparse
+import csv
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from utils.cache import content_hash
+from utils.metrics import current_rss_mb
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+CHECKPOINT = "_checkpoint.json"
+
+
+def iter_manifest(path, defaults):
+    # Streams rows so memory does not grow with the manifest; biomarker columns
+    # missing from a row (or the whole file) fall back to the CLI defaults
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            image = row.get("image_path") or row.get("path")
+            if not image:
+                raise SystemExit(f"{path}: every row needs an image_path column")
+            yield {
+                "image_path": image if os.path.isabs(image) else os.path.join(base, image),
+                "biomarker": row.get("biomarker") or defaults["biomarker"],
+                "intensity": row.get("intensity") or defaults["intensity"],
+                "staining": row.get("staining") or defaults["staining"],
+            }
+
+
+def iter_directory(root, defaults):
+    # os.walk with sorted names gives the same order on every run, which is
+    # what makes resuming by row count safe
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTS):
+                yield {"image_path": os.path.join(dirpath, name), **defaults}
+
+
+def _load(record, encoder=None):
+    from utils.preprocessing import preprocess
+
+    start = time.perf_counter()
+    # A manifest row with values the checkpoint has no column for is an error
+    # row like an unreadable image, rather than a prediction without its
+    # biomarkers or an abort hours into the run
+    unknown = encoder.unknown(record["biomarker"], record["intensity"], record["staining"]) if encoder else []
+    if unknown:
+        return record, None, None, 0.0, f"unknown biomarker values: {', '.join(unknown)}"
+    try:
+        with open(record["image_path"], "rb") as f:
+            data = f.read()
+        tensor = preprocess(data)
+        return record, tensor, content_hash(data), (time.perf_counter() - start) * 1000, None
+    except Exception as e:
+        return record, None, None, (time.perf_counter() - start) * 1000, f"{type(e).__name__}: {e}"
+
+
+def prefetch(records, workers, depth, encoder=None):
+    # At most depth decodes are in flight or waiting, whatever the input size
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as pool:
+        pending = deque()
+        for record in records:
+            pending.append(pool.submit(_load, record, encoder))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class PartWriter:
+    # Rows are flushed every chunk_rows into numbered part files; the checkpoint
+    # is rewritten (atomically) only after a part is fully on disk, so a crash
+    # loses at most one chunk and never leaves a half-written part behind
+    def __init__(self, out_dir, fmt, chunk_rows, source):
+        self.out_dir, self.fmt, self.chunk_rows = out_dir, fmt, chunk_rows
+        os.makedirs(out_dir, exist_ok=True)
+        self.state = {"source": source, "format": fmt, "rows_done": 0, "parts": []}
+        path = os.path.join(out_dir, CHECKPOINT)
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved["source"] != source or saved["format"] != fmt:
+                raise SystemExit(f"{out_dir} holds results for {saved['source']} ({saved['format']}); "
+                                 "use another --out or --no-resume")
+            self.state = saved
+        self._drop_orphans()
+        self.rows = []
+
+    @property
+    def rows_done(self):
+        return self.state["rows_done"]
+
+    def _drop_orphans(self):
+        keep = set(self.state["parts"])
+        for name in os.listdir(self.out_dir):
+            if name.startswith("part-") and name not in keep:
+                os.remove(os.path.join(self.out_dir, name))
+
+    def add(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        name = f"part-{len(self.state['parts']):05d}.{self.fmt}"
+        path = os.path.join(self.out_dir, name)
+        df = pd.DataFrame(self.rows)
+        if self.fmt == "parquet":
+            df.to_parquet(path + ".tmp", index=False)
+        else:
+            df.to_csv(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+        self.state["parts"].append(name)
+        self.state["rows_done"] += len(self.rows)
+        self.rows = []
+        tmp = os.path.join(self.out_dir, CHECKPOINT + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, os.path.join(self.out_dir, CHECKPOINT))
+
+
+def predict_records(rt, loaded, batch_size):
+    import torch
+    from utils.inference import predict_batch
+
+    classes = [rt.idx_to_subtype[i] for i in range(len(rt.idx_to_subtype))]
+    for batch in batched(loaded, batch_size):
+        ok = [b for b in batch if b[1] is not None]
+        infer_ms = 0.0
+        probs = []
+        if ok:
+            images = torch.stack([t for _, t, _, _, _ in ok])
+            bio = rt.bio_encoder.encode_frame(pd.DataFrame([r for r, _, _, _, _ in ok]))
+            start = time.perf_counter()
+            # No embedding cache: archives are scanned once and it would only grow
+            probs = predict_batch(rt.model, images, bio, governor=rt.governor)
+            infer_ms = (time.perf_counter() - start) * 1000
+        probs = iter(probs)
+        rows = []
+        for record, tensor, digest, decode_ms, error in batch:
+            row = {**record, "image_hash": digest, "predicted_subtype": None, "confidence": None}
+            row.update({f"prob_{c}": None for c in classes})
+            if tensor is not None:
+                p = next(probs)
+                idx = int(p.argmax())
+                row.update(predicted_subtype=classes[idx], confidence=float(p[idx]))
+                row.update({f"prob_{c}": float(v) for c, v in zip(classes, p)})
+            row.update(decode_ms=round(decode_ms, 2), batch_inference_ms=round(infer_ms, 2),
+                       batch_size=len(ok), error=error)
+            rows.append(row)
+        yield rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-score a directory or CSV manifest of images")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--manifest", help="CSV with image_path[,biomarker,intensity,staining]")
+    src.add_argument("--dir", help="walk this directory for images")
+    parser.add_argument("--out", required=True, help="output directory for part files")
+    parser.add_argument("--format", default="parquet", choices=["parquet", "csv"])
+    parser.add_argument("--biomarker", default="ESR1")
+    parser.add_argument("--intensity", default="Strong")
+    parser.add_argument("--staining", default="High")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1),
+                        help="decode threads")
+    parser.add_argument("--prefetch", type=int, default=4, help="batches decoded ahead")
+    parser.add_argument("--chunk-rows", type=int, default=2048, help="rows per part file")
+    parser.add_argument("--no-resume", action="store_true", help="discard an existing checkpoint")
+    args = parser.parse_args()
+
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet needs pyarrow (pip install pyarrow) or use --format csv")
+    from utils.bio_encoder import BiomarkerEncoder
+    from utils.model import load_mappings
+
+    encoder = BiomarkerEncoder(load_mappings()[1])
+    unknown = encoder.unknown(args.biomarker, args.intensity, args.staining)
+    if unknown:
+        parser.error(f"unknown biomarker values: {', '.join(unknown)}")
+    if args.no_resume and os.path.exists(os.path.join(args.out, CHECKPOINT)):
+        os.remove(os.path.join(args.out, CHECKPOINT))
+
+    defaults = {"biomarker": args.biomarker, "intensity": args.intensity, "staining": args.staining}
+    source = os.path.abspath(args.manifest or args.dir)
+    records = iter_manifest(args.manifest, defaults) if args.manifest else iter_directory(args.dir, defaults)
+    writer = PartWriter(args.out, args.format, args.chunk_rows, source)
+    skip = writer.rows_done
+    if skip:
+        print(f"Resuming after {skip} rows ({len(writer.state['parts'])} part files)")
+    records = (r for i, r in enumerate(records) if i >= skip)
+
+    from utils.inference import get_runtime
+
+    rt = get_runtime()
+    loaded = prefetch(records, args.workers, args.batch_size * args.prefetch, encoder)
+    done, errors, peak_rss = 0, 0, current_rss_mb()
+    start = last = time.perf_counter()
+    try:
+        for rows in predict_records(rt, loaded, args.batch_size):
+            writer.add(rows)
+            done += len(rows)
+            errors += sum(r["error"] is not None for r in rows)
+            peak_rss = max(peak_rss, current_rss_mb())
+            if time.perf_counter() - last > 10:
+                last = time.perf_counter()
+                print(f"  {skip + done} rows, {done / (last - start):.1f} images/s, "
+                      f"rss {peak_rss:.0f} MB")
+    finally:
+        writer.flush()
+    elapsed = time.perf_counter() - start
+    print(f"Scored {done} images in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f} images/s), "
+          f"{errors} errors, peak RSS {peak_rss:.0f} MB -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
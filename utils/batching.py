@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+import torch
+
+
+class MicroBatchScheduler:
+    # Collects single-sample requests from any thread into one batched call.
+    # fn receives every positional argument concatenated along dim 0 and must
+    # return a tensor (or tuple of tensors) with the same leading dimension.
+    # With a governor, every batch runs inside one of its slots, so batches
+    # and other governed work share the same concurrency/thread budget.
+    def __init__(self, fn, max_batch_size=8, max_wait_ms=10, name="micro-batcher",
+                 workers=1, governor=None):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.governor = governor
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.last_batch_size = 0
+        self._workers = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, *tensors):
+        fut = Future()
+        self._queue.put((tensors, fut))
+        return fut
+
+    def __call__(self, *tensors, timeout=None):
+        return self.submit(*tensors).result(timeout=timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'batches': self.batches,
+            'requests': self.requests,
+            'avg_batch_size': self.requests / self.batches if self.batches else 0.0,
+            'last_batch_size': self.last_batch_size,
+        }
+
+    def close(self):
+        self._stop.set()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            self._stop.set()
+            self._queue.put(None)
+            return []
+        items = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._stop.set()
+                self._queue.put(None)  # wake the next worker so it exits too
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while not self._stop.is_set():
+            items = self._collect()
+            items = [it for it in items if it[1].set_running_or_notify_cancel()]
+            if not items:
+                continue
+            sizes = [args[0].shape[0] for args, _ in items]
+            try:
+                batched = [torch.cat(parts, dim=0) for parts in zip(*(args for args, _ in items))]
+                # grad mode is thread-local, so it has to be disabled here too
+                with self.governor.slot() if self.governor else nullcontext(), torch.no_grad():
+                    out = self.fn(*batched)
+            except Exception as e:
+                for _, fut in items:
+                    fut.set_exception(e)
+                continue
+            with self._stats_lock:
+                self.batches += 1
+                self.requests += len(items)
+                self.last_batch_size = len(items)
+            if isinstance(out, tuple):
+                splits = list(zip(*(o.split(sizes, dim=0) for o in out)))
+            else:
+                splits = out.split(sizes, dim=0)
+            for part, (_, fut) in zip(splits, items):
+                fut.set_result(part)
@@ -0,0 +1,135 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+
+# bm_feat_cols is a one-hot over "<group>_<value>" columns, one hot value per group
+FEATURE_GROUPS = ("biomarker", "intensity", "staining")
+
+
+def feature_values(bm_feat_cols):
+    # {'biomarker': [...], 'intensity': [...], 'staining': [...]} in column
+    # order; values keep their spelling, trailing spaces included, since the
+    # training data used those as separate categories
+    groups = {g: [] for g in FEATURE_GROUPS}
+    for col in bm_feat_cols:
+        group, _, value = col.partition("_")
+        if group in groups:
+            groups[group].append(value)
+    return groups
+
+
+class BiomarkerEncoder:
+    # Biomarker inputs as column ids into bm_feat_cols instead of dense
+    # one-hot rows. Values the checkpoint has no column for map to `pad`
+    # and contribute nothing, exactly like the zero they get in the dense
+    # vector from process_biomarker_input.
+    def __init__(self, bm_feat_cols):
+        self.columns = list(bm_feat_cols)
+        self.vocab = {col: i for i, col in enumerate(self.columns)}
+        self.pad = len(self.columns)
+
+    def ids(self, marker, intensity, staining):
+        return [self.vocab.get(f"{g}_{v}", self.pad) for g, v in zip(FEATURE_GROUPS, (marker, intensity, staining))]
+
+    def unknown(self, marker, intensity, staining):
+        # The "<group> '<value>'" inputs that would silently become `pad`;
+        # for callers that must reject them instead
+        return [f"{g} {v!r}" for g, v in zip(FEATURE_GROUPS, (marker, intensity, staining))
+                if f"{g}_{v}" not in self.vocab]
+
+    def encode(self, marker, intensity, staining):
+        return torch.tensor([self.ids(marker, intensity, staining)], dtype=torch.int64)
+
+    def encode_panel(self, biomarker_data):
+        # A multi-marker panel ({marker: {'intensity', 'staining'}}, as the
+        # Upload page builds it) is one multi-hot row: every category is
+        # counted once, whichever markers share it
+        ids = sorted({i for m, d in biomarker_data.items()
+                      for i in self.ids(m, d['intensity'], d['staining'])} - {self.pad})
+        width = len(FEATURE_GROUPS) * max(1, len(biomarker_data))
+        return torch.tensor([ids + [self.pad] * (width - len(ids))], dtype=torch.int64)
+
+    def encode_frame(self, df, biomarker="biomarker", intensity="intensity", staining="staining"):
+        # Whole DataFrame -> (N, 3) ids: one vectorised dict lookup per column
+        # instead of a Python one-hot per row
+        cols = [(f"{g}_" + df[c].astype(str)).map(self.vocab).fillna(self.pad).to_numpy(np.int64)
+                for g, c in zip(FEATURE_GROUPS, (biomarker, intensity, staining))]
+        return torch.from_numpy(np.stack(cols, axis=1))
+
+    def to_dense(self, ids):
+        # Back to the (N, len(bm_feat_cols)) float rows the ONNX graph and
+        # forward_with_embedding take
+        out = torch.zeros(ids.shape[0], self.pad + 1)
+        out.scatter_(1, ids, 1.0)
+        return out[:, :self.pad]
+
+
+class BioProjection:
+    # bio_proj(one_hot) is a sum of the weight columns picked by the ids plus
+    # the bias; this keeps those columns as a (D + 1, out) table and sums them
+    # with an EmbeddingBag. The last row is all zeros, so padding ids add
+    # nothing without the slower padding_idx path.
+    def __init__(self, weight, bias):
+        weight = weight.detach().float()
+        self.table = torch.cat([weight.t(), weight.new_zeros(1, weight.shape[0])]).contiguous()
+        self.bias = bias.detach().float().clone() if bias is not None else None
+
+    @classmethod
+    def from_linear(cls, linear):
+        return cls(linear.weight, linear.bias)
+
+    def __call__(self, ids):
+        out = F.embedding_bag(ids, self.table, mode="sum")
+        return out + self.bias if self.bias is not None else out
+
+
+def main():
+    from utils.inference import process_biomarker_input
+    from utils.model import CHECKPOINT_PATH, load_mappings
+
+    parser = argparse.ArgumentParser(description="Compare dense one-hot encoding with id-based projection")
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    _, bm_feat_cols, _ = load_mappings()
+    if os.path.exists(CHECKPOINT_PATH):
+        state = torch.load(CHECKPOINT_PATH, map_location="cpu")
+        linear = torch.nn.Linear(len(bm_feat_cols), state["bio_proj.weight"].shape[0])
+        linear.load_state_dict({"weight": state["bio_proj.weight"], "bias": state["bio_proj.bias"]})
+    else:
+        linear = torch.nn.Linear(len(bm_feat_cols), 128)
+    values = feature_values(bm_feat_cols)
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({g: rng.choice(values[g], args.rows) for g in FEATURE_GROUPS})
+    encoder, projection = BiomarkerEncoder(bm_feat_cols), BioProjection.from_linear(linear)
+
+    with torch.no_grad():
+        start = time.perf_counter()
+        dense = torch.cat([process_biomarker_input(m, i, s, bm_feat_cols) for m, i, s in df.itertuples(index=False)])
+        encode_dense = time.perf_counter() - start
+        start = time.perf_counter()
+        ref = linear(dense)
+        proj_dense = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ids = encoder.encode_frame(df)
+        encode_ids = time.perf_counter() - start
+        start = time.perf_counter()
+        out = projection(ids)
+        proj_ids = time.perf_counter() - start
+
+    print(f"{args.rows} rows, {len(bm_feat_cols)} columns -> {linear.out_features}")
+    print(f"  {'':<10} {'encode':>10} {'project':>10}")
+    print(f"  {'dense':<10} {encode_dense * 1000:>8.1f}ms {proj_dense * 1000:>8.1f}ms")
+    print(f"  {'ids':<10} {encode_ids * 1000:>8.1f}ms {proj_ids * 1000:>8.1f}ms")
+    print(f"  max |diff| {(out - ref).abs().max().item():.2e}, "
+          f"round trip {'ok' if torch.equal(encoder.to_dense(ids), dense) else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
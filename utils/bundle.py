@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import struct
+
+import torch
+
+from utils.model import CHECKPOINT_PATH, DinoMLPFusion, load_mappings, load_torch_model
+
+BUNDLE_DIR = "model_bundle"
+CONFIG_FILE = "config.json"
+WEIGHTS_FILE = "model.safetensors"
+METADATA_FILE = "metadata.json"
+FORMAT_VERSION = 1
+
+_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+
+def is_bundle(path):
+    return bool(path) and all(os.path.exists(os.path.join(path, f))
+                              for f in (CONFIG_FILE, WEIGHTS_FILE, METADATA_FILE))
+
+
+def convert(checkpoint=CHECKPOINT_PATH, out_dir=BUNDLE_DIR):
+    # One-off, online step: pulls the backbone config from the hub and folds it,
+    # the fused checkpoint and the label/feature metadata into one directory
+    from safetensors.torch import save_file
+
+    lbl_map, bm_feat_cols, _ = load_mappings()
+    model = load_torch_model(len(lbl_map), len(bm_feat_cols), checkpoint)
+    os.makedirs(out_dir, exist_ok=True)
+    state = {k: v.detach().contiguous() for k, v in model.state_dict().items()}
+    save_file(state, os.path.join(out_dir, WEIGHTS_FILE), metadata={"format": "pt"})
+    config = {
+        "format_version": FORMAT_VERSION,
+        "num_classes": len(lbl_map),
+        "bio_dim": len(bm_feat_cols),
+        "backbone": model.backbone.config.to_dict(),
+    }
+    with open(os.path.join(out_dir, CONFIG_FILE), "w") as f:
+        json.dump(config, f, indent=2)
+    with open(os.path.join(out_dir, METADATA_FILE), "w") as f:
+        json.dump({"lbl_map": lbl_map, "bm_feat_cols": list(bm_feat_cols)}, f, indent=2)
+    return out_dir
+
+
+def mmap_safetensors(path):
+    # Tensors are views into one MAP_PRIVATE mapping of the file, so every
+    # process serving the same bundle shares the page cache instead of holding
+    # its own unpickled copy; nothing is read until a page is touched.
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+    header.pop("__metadata__", None)
+    data_start = 8 + header_len
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    tensors = {}
+    for name, info in header.items():
+        dtype = _DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        itemsize = torch.empty(0, dtype=dtype).element_size()
+        offset = data_start + begin
+        if offset % itemsize:
+            raise ValueError(f"{name} is not aligned for zero-copy loading")
+        t = torch.empty(0, dtype=dtype)
+        t.set_(storage, offset // itemsize, info["shape"])
+        tensors[name] = t
+    return tensors
+
+
+def _build_backbone(backbone_config, attn_implementation):
+    from transformers import AutoConfig, AutoModel
+
+    config = AutoConfig.for_model(**backbone_config)
+    if attn_implementation:
+        try:
+            return AutoModel.from_config(config, attn_implementation=attn_implementation)
+        except (ValueError, ImportError, TypeError):
+            pass
+    return AutoModel.from_config(config)
+
+
+def load_bundle_mappings(bundle_dir=BUNDLE_DIR):
+    with open(os.path.join(bundle_dir, METADATA_FILE)) as f:
+        meta = json.load(f)
+    lbl_map = meta["lbl_map"]
+    return lbl_map, meta["bm_feat_cols"], {v: k for k, v in lbl_map.items()}
+
+
+def load_bundle_model(bundle_dir=BUNDLE_DIR, attn_implementation="sdpa"):
+    # Fully offline: the backbone is built from the stored config, never the hub
+    with open(os.path.join(bundle_dir, CONFIG_FILE)) as f:
+        config = json.load(f)
+    if config.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format: {config.get('format_version')}")
+    state = mmap_safetensors(os.path.join(bundle_dir, WEIGHTS_FILE))
+    # Build on the meta device so no random init is allocated, then adopt the
+    # mmapped tensors as parameters with assign=True (no copy)
+    with torch.device("meta"):
+        backbone = _build_backbone(config["backbone"], attn_implementation)
+        model = DinoMLPFusion(config["num_classes"], config["bio_dim"], backbone=backbone)
+    model.load_state_dict(state, assign=True)
+    if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+        # A non-persistent buffer had no stored value; rebuild it on CPU
+        model = DinoMLPFusion(config["num_classes"], config["bio_dim"],
+                              backbone=_build_backbone(config["backbone"], attn_implementation))
+        model.load_state_dict(state, assign=True)
+    for p in model.backbone.parameters(): p.requires_grad = False
+    return model.eval()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an offline safetensors model bundle")
+    sub = parser.add_subparsers(dest="command", required=True)
+    conv = sub.add_parser("convert", help="convert dino_model.pth + hub backbone into a bundle")
+    conv.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    conv.add_argument("--out", default=BUNDLE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        out = convert(args.checkpoint, args.out)
+        size = os.path.getsize(os.path.join(out, WEIGHTS_FILE)) / 2**20
+        print(f"Wrote {out}/ ({size:.1f} MB of weights)")
+
+
+if __name__ == "__main__":
+    main()
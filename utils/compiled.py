@@ -0,0 +1,104 @@
+import logging
+import time
+
+import torch
+import torch.nn as nn
+
+from utils.preprocessing import IMAGE_SIZE
+
+log = logging.getLogger(__name__)
+
+COMPILE_MODES = ("eager", "compile", "script")
+
+
+class _Pooled(nn.Module):
+    # TorchScript cannot return HF ModelOutput objects
+    def __init__(self, backbone):
+        super().__init__()
+        self.backbone = backbone
+
+    def forward(self, img):
+        return self.backbone(img).pooler_output
+
+
+class TracedBackbone(nn.Module):
+    # HF ViT reads the batch size into Python ints, so a trace is only valid for
+    # the batch size it was recorded at. Keep one trace per served size and
+    # fall back to the eager module for anything else.
+    def __init__(self, backbone, batch_sizes):
+        super().__init__()
+        self.eager = backbone
+        self.traced = {}
+        pooled = _Pooled(backbone).eval()
+        for n in batch_sizes:
+            example = torch.zeros(n, 3, IMAGE_SIZE, IMAGE_SIZE)
+            with torch.no_grad():
+                self.traced[n] = torch.jit.freeze(torch.jit.trace(pooled, example, check_trace=False))
+
+    def forward(self, img):
+        fn = self.traced.get(img.shape[0])
+        if fn is None:
+            return self.eager(img).pooler_output
+        return fn(img)
+
+
+class _PooledOutput:
+    def __init__(self, pooler_output):
+        self.pooler_output = pooler_output
+
+
+class _CompiledBackbone(nn.Module):
+    # Keeps the `.pooler_output` contract of the HF model for DinoMLPFusion.embed;
+    # `eager` stays reachable for code that needs hooks on the real modules
+    def __init__(self, fn, eager):
+        super().__init__()
+        self.fn = fn
+        self.eager = eager
+
+    def forward(self, img):
+        return _PooledOutput(self.fn(img))
+
+
+def compile_backbone(model, mode, batch_sizes=(1,)):
+    if mode == "compile":
+        fn = torch.compile(_Pooled(model.backbone).eval(), dynamic=None)
+    elif mode == "script":
+        fn = TracedBackbone(model.backbone, batch_sizes)
+    else:
+        return model
+    model.backbone = _CompiledBackbone(fn, model.backbone)
+    return model
+
+
+def warmup(backend, batch_sizes=(1,)):
+    # Pays first-call costs (compilation, allocator growth, oneDNN kernel
+    # selection) at load time instead of on the first user request
+    bio_dim = backend.bio_dim
+    timings = {}
+    with torch.no_grad():
+        for n in batch_sizes:
+            start = time.perf_counter()
+            backend.forward_with_embedding(torch.zeros(n, 3, IMAGE_SIZE, IMAGE_SIZE), torch.zeros(n, bio_dim))
+            timings[n] = time.perf_counter() - start
+    return timings
+
+
+def compile_with_fallback(backend, mode, batch_sizes=(1,)):
+    # Compiles, then warms up at every served batch size; any failure in either
+    # step restores the eager backbone so a broken toolchain never takes us down
+    if mode not in COMPILE_MODES:
+        raise ValueError(f"Unknown compile mode: {mode!r}")
+    model = getattr(backend, "model", None)
+    if mode != "eager" and model is not None:
+        eager = model.backbone
+        try:
+            compile_backbone(model, mode, batch_sizes)
+            backend.warmup_s = warmup(backend, batch_sizes)
+            backend.compile_mode = mode
+            return backend
+        except Exception as e:
+            log.warning("Falling back to eager inference, %s failed: %s", mode, e)
+            model.backbone = eager
+    backend.warmup_s = warmup(backend, batch_sizes)
+    backend.compile_mode = "eager"
+    return backend
@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Finished predictions keyed by (upload bytes, biomarker vector, model
+# fingerprint, options), shared by every process on the host through one
+# SQLite file. BCR_DISK_CACHE="" turns it off.
+DISK_CACHE_PATH = os.environ.get("BCR_DISK_CACHE", "prediction_cache.sqlite")
+DISK_CACHE_MB = int(os.environ.get("BCR_DISK_CACHE_MB", 512))
+# Reads only write their access time back when it is this stale, so a hot
+# entry does not take the write lock on every hit
+TOUCH_AFTER_S = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+"""
+
+
+def prediction_key(image_hash, bio, model_version, **options):
+    # image_hash is content_hash of the raw upload; bio the encoded biomarker
+    # row (dense vector or ids) exactly as it goes into the model. Options are
+    # whatever else changes the output (tiling, explanation, TTA, ...).
+    h = hashlib.blake2b(digest_size=16)
+    h.update(image_hash.encode())
+    bio = np.ascontiguousarray(bio.cpu().numpy() if hasattr(bio, "cpu") else bio)
+    h.update(str((bio.dtype.str, bio.shape)).encode())
+    h.update(bio.tobytes())
+    h.update(model_version.encode())
+    h.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class DiskCache:
+    # LRU bounded by the total size of the pickled values. WAL lets readers in
+    # other processes carry on while one writer inserts and evicts under
+    # BEGIN IMMEDIATE. Values are pickled: the file is as trusted as the
+    # checkpoint next to it, never something uploaded.
+    def __init__(self, path=DISK_CACHE_PATH, max_bytes=DISK_CACHE_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value, accessed FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            now = time.time()
+            if now - row[1] > TOUCH_AFTER_S:
+                self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return pickle.loads(row[0])
+
+    def put(self, key, value, model=""):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return False
+        now = time.time()
+        with self._lock:
+            db = self._db
+            db.execute("BEGIN IMMEDIATE")  # one writer across processes
+            try:
+                db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                           (key, model, blob, len(blob), now, now))
+                evicted = self._evict()
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            self.evictions += evicted
+        return True
+
+    def _evict(self):
+        # Least recently used first until the total fits; runs inside put's
+        # transaction so concurrent writers never both evict the same bytes
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            doomed.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._db.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        return len(doomed)
+
+    def retain(self, model):
+        # Drops entries tagged with any other model fingerprint (the checkpoint
+        # digest, for the runtime): their keys can never match again
+        with self._lock:
+            dropped = self._db.execute("DELETE FROM entries WHERE model != ?", (model,)).rowcount
+        if dropped:
+            log.info("Prediction cache: dropped %d entries from other model versions", dropped)
+        return dropped
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("VACUUM")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_disk_cache():
+    # None when disabled or when the database cannot be opened
+    global _cache
+    if _cache is None and DISK_CACHE_PATH:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = DiskCache(DISK_CACHE_PATH)
+                except sqlite3.Error as e:
+                    log.warning("Prediction cache unavailable: %s", e)
+                    return None
+    return _cache
+
+
+def _bench_worker(path, max_bytes, worker, n, value):
+    cache = DiskCache(path, max_bytes)
+    times = []
+    for i in range(n):
+        key = f"k{(worker * 7919 + i) % (n * 2)}"
+        start = time.perf_counter()
+        if cache.get(key) is None:
+            cache.put(key, value, "bench")
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prediction cache maintenance and benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="size of the cache in BCR_DISK_CACHE")
+    sub.add_parser("clear", help="remove every entry")
+    bench = sub.add_parser("bench", help="get/put latency with several processes sharing one cache")
+    bench.add_argument("--processes", type=int, default=4)
+    bench.add_argument("--ops", type=int, default=500)
+    bench.add_argument("--value-kb", type=int, default=160, help="about a result with preview and overlay")
+    bench.add_argument("--max-mb", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.cmd == "stats":
+        print(json.dumps(DiskCache().stats(), indent=2))
+        return
+    if args.cmd == "clear":
+        DiskCache().clear()
+        return
+
+    tmp = tempfile.mkdtemp(prefix="prediction_cache_")
+    try:
+        path = os.path.join(tmp, "cache.sqlite")
+        max_bytes = args.max_mb * 1024 * 1024
+        DiskCache(path, max_bytes)
+        value = {'probs': np.random.default_rng(0).random(4), 'preview': os.urandom(args.value_kb * 1024)}
+        start = time.perf_counter()
+        with multiprocessing.get_context("spawn").Pool(args.processes) as pool:
+            times = pool.starmap(_bench_worker, [(path, max_bytes, w, args.ops, value)
+                                                 for w in range(args.processes)])
+        wall = time.perf_counter() - start
+        times = np.concatenate(times) * 1000
+        stats = DiskCache(path, max_bytes).stats()
+        print(f"{args.processes} processes x {args.ops} get-or-put of {args.value_kb}KB in {wall:.1f}s")
+        print(f"  p50 {np.percentile(times, 50):.2f}ms  p95 {np.percentile(times, 95):.2f}ms  "
+              f"p99 {np.percentile(times, 99):.2f}ms")
+        print(f"  {stats['entries']} entries, {stats['bytes'] / 2**20:.1f}MB of {args.max_mb}MB")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import math
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+METHODS = ("rollout", "gradcam")
+
+
+def supports_explanations(backend):
+    # Needs the torch backbone modules to hook; the ONNX session has none
+    model = getattr(backend, "model", None)
+    return model is not None and hasattr(model, "backbone")
+
+
+def _eager_vit(model):
+    # Hooks only fire on the real HF modules, not inside a trace/compiled graph
+    return getattr(model.backbone, "eager", model.backbone)
+
+
+def _blocks(vit):
+    # transformers 5 flattened ViT to layers[i].attention.q_proj; 4.x nests it
+    # as encoder.layer[i].attention.attention.query
+    if hasattr(vit, "layers"):
+        return [(b.layernorm_before, b.attention.q_proj, b.attention.k_proj) for b in vit.layers]
+    return [(b.layernorm_before, b.attention.attention.query, b.attention.attention.key)
+            for b in vit.encoder.layer]
+
+
+def _to_grid(token_scores):
+    # (B, T) scores over all tokens -> (B, side, side) over the patch tokens;
+    # whatever precedes the square patch grid (CLS, registers) is dropped
+    n = token_scores.shape[1]
+    side = math.isqrt(n - 1)
+    grid = token_scores[:, n - side * side:].reshape(-1, side, side).float()
+    lo = grid.amin(dim=(1, 2), keepdim=True)
+    hi = grid.amax(dim=(1, 2), keepdim=True)
+    return ((grid - lo) / (hi - lo).clamp_min(1e-8)).cpu().numpy()
+
+
+@contextmanager
+def _rollout_hooks(vit):
+    # SDPA never materialises attention weights, so each block's attention is
+    # recomputed from its q/k projections and folded into the running product
+    # straight away; only one (B, T, T) matrix is alive at any time.
+    heads = vit.config.num_attention_heads
+    state = {"rollout": None}
+
+    def hook(q_proj, k_proj):
+        def fn(module, args, out):
+            b, t, d = out.shape
+            q = q_proj(out).view(b, t, heads, -1).transpose(1, 2)
+            k = k_proj(out).view(b, t, heads, -1).transpose(1, 2)
+            attn = torch.softmax(q @ k.transpose(-2, -1) * q.shape[-1] ** -0.5, dim=-1).mean(dim=1)
+            # Residual connection: half identity, rows renormalised
+            attn = 0.5 * attn + 0.5 * torch.eye(t, dtype=attn.dtype)
+            attn = attn / attn.sum(dim=-1, keepdim=True)
+            prev = state["rollout"]
+            state["rollout"] = attn if prev is None else attn @ prev
+        return fn
+
+    handles = [norm.register_forward_hook(hook(q, k)) for norm, q, k in _blocks(vit)]
+    try:
+        yield state
+    finally:
+        for h in handles:
+            h.remove()
+
+
+def _rollout(model, img, bio):
+    vit = _eager_vit(model)
+    with torch.no_grad(), _rollout_hooks(vit) as state:
+        x_img = vit(img).pooler_output
+        logits = model.forward_head(x_img, bio)
+    return x_img, logits, _to_grid(state["rollout"][:, 0])
+
+
+def _gradcam(model, img, bio, target=None):
+    # Grad-CAM on the residual stream entering the last block: token
+    # activations weighted by the mean gradient of the fused logit
+    vit = _eager_vit(model)
+    acts = {}
+    norm = _blocks(vit)[-1][0]
+    handle = norm.register_forward_pre_hook(lambda module, args: acts.update(x=args[0]))
+    try:
+        with torch.enable_grad():
+            x_img = vit(img.detach().requires_grad_(True)).pooler_output
+            logits = model.forward_head(x_img, bio)
+            if target is None:
+                target = logits.argmax(dim=1)
+            score = logits.gather(1, target.view(-1, 1)).sum()
+            grad, = torch.autograd.grad(score, acts["x"])
+    finally:
+        handle.remove()
+    act = acts["x"].detach()
+    cam = torch.relu((act * grad.mean(dim=1, keepdim=True)).sum(dim=-1))
+    return x_img.detach(), logits.detach(), _to_grid(cam)
+
+
+def explain_forward(backend, img, bio, method="rollout", target=None):
+    # One backbone pass that yields the embedding, the fused logits and a
+    # (B, side, side) map in [0, 1]; Grad-CAM adds a backward through the last
+    # block, which dynamic-int8 Linear layers do not support.
+    if method not in METHODS:
+        raise ValueError(f"Unknown explanation method: {method!r}")
+    model = backend.model
+    if method == "gradcam":
+        if getattr(backend, "precision", "fp32") != "fp32":
+            raise ValueError("Grad-CAM needs an fp32 backbone")
+        return _gradcam(model, img, bio, target)
+    return _rollout(model, img, bio)
+
+
+def upsample(grid, size):
+    # Bilinear in float ('F' mode) so the map is resized once, without banding
+    from PIL import Image
+
+    return np.asarray(Image.fromarray(grid.astype(np.float32), mode="F").resize(size, Image.BILINEAR))
+
+
+def main():
+    from utils.inference import get_runtime, process_biomarker_input
+    from utils.model import transform_dino
+    from utils.quantization import load_calibration_images
+
+    parser = argparse.ArgumentParser(description="Measure explanation overhead against a plain forward")
+    parser.add_argument("--images", required=True, help="directory of local slide images")
+    parser.add_argument("--limit", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    rt = get_runtime()
+    if not supports_explanations(rt.model):
+        raise SystemExit(f"The {rt.model.name} backend has no torch backbone to explain")
+    images = torch.from_numpy(np.stack(load_calibration_images(args.images, transform_dino, args.limit)))
+    bio = process_biomarker_input("ESR1", "Strong", "High", rt.bm_feat_cols)
+
+    def timed(fn):
+        best = float("inf")
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            for i in range(images.shape[0]):
+                fn(images[i:i + 1])
+            best = min(best, time.perf_counter() - start)
+        return best / images.shape[0] * 1000
+
+    base = timed(lambda x: rt.model.forward_with_embedding(x, bio))
+    print(f"{os.cpu_count()} cores, {images.shape[0]} images, best of {args.repeats}")
+    print(f"  {'plain forward':<16} {base:8.1f} ms/image")
+    for method in METHODS:
+        if method == "gradcam" and rt.model.precision != "fp32":
+            continue
+        ms = timed(lambda x: explain_forward(rt.model, x, bio, method))
+        print(f"  {method:<16} {ms:8.1f} ms/image  (+{(ms / base - 1) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
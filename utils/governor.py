@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+from utils.metrics import get_metrics
+
+POLICIES = ("latency", "throughput")
+
+
+class InferenceGovernor:
+    # Bounds how many inferences run at once and how many intra-op threads each
+    # gets, so N sessions never oversubscribe the cores N-fold.
+    #   latency:    one inference at a time, using the whole core budget
+    #   throughput: one inference per core, single-threaded each
+    # torch.set_num_threads (and MKL's count) is process-wide, and new threads
+    # start from that value, so it is never saved and restored around a slot:
+    # concurrent slots would race and leave the wrong count behind. Every slot
+    # gets the same per-worker budget instead, set once in the process and
+    # once more in each thread that takes a slot (OpenMP keeps a per-thread
+    # copy of the count).
+    def __init__(self, core_budget=None, policy="latency", max_concurrent=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown governor policy: {policy!r}")
+        self.core_budget = max(1, core_budget or os.cpu_count() or 1)
+        self.policy = policy
+        if policy == "latency":
+            self.max_concurrent = max_concurrent or 1
+        else:
+            self.max_concurrent = max_concurrent or self.core_budget
+        self.threads_per_worker = max(1, self.core_budget // self.max_concurrent)
+        self._sem = threading.BoundedSemaphore(self.max_concurrent)
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=512)
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self._configured = threading.local()
+        torch.set_num_threads(self.threads_per_worker)
+        try:
+            # Only settable before the first inter-op parallel work in the process
+            torch.set_num_interop_threads(1 if policy == "throughput" else min(2, self.core_budget))
+        except RuntimeError:
+            pass
+
+    @contextmanager
+    def slot(self):
+        start = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        self._sem.acquire()
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+            self._waits.append(waited)
+        get_metrics().observe("governor_wait", waited)
+        if not getattr(self._configured, "done", False):
+            torch.set_num_threads(self.threads_per_worker)
+            self._configured.done = True
+        try:
+            yield waited
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+            self._sem.release()
+
+    def stats(self):
+        with self._lock:
+            waits = np.array(self._waits) * 1000 if self._waits else np.zeros(1)
+            return {
+                'policy': self.policy,
+                'core_budget': self.core_budget,
+                'max_concurrent': self.max_concurrent,
+                'threads_per_worker': self.threads_per_worker,
+                'active': self.active,
+                'queue_depth': self.waiting,
+                'completed': self.completed,
+                'wait_ms_avg': float(waits.mean()),
+                'wait_ms_p95': float(np.percentile(waits, 95)),
+            }
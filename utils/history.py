@@ -0,0 +1,241 @@
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Every finished analysis is stored here; the session only keeps its id.
+# BCR_HISTORY_DB="" turns the store off (results then live in the session).
+HISTORY_DB = os.environ.get("BCR_HISTORY_DB", "history.sqlite")
+PAGE_SIZE = 20
+
+# Listing columns only; the blobs sit in their own table so paging through
+# thousands of rows never reads an image
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    image_hash TEXT,
+    filename TEXT,
+    width INTEGER,
+    height INTEGER,
+    subtype TEXT,
+    confidence REAL,
+    probabilities TEXT,
+    biomarkers TEXT,
+    model_version TEXT,
+    mode TEXT,
+    seconds REAL,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS analyses_subtype ON analyses (subtype, id);
+CREATE TABLE IF NOT EXISTS artifacts (
+    analysis_id INTEGER PRIMARY KEY REFERENCES analyses (id) ON DELETE CASCADE,
+    thumbnail BLOB,
+    preview BLOB,
+    overlay BLOB,
+    explanation_map BLOB,
+    embedding BLOB
+);
+"""
+
+LIST_COLUMNS = ("id", "created", "image_hash", "filename", "width", "height", "subtype", "confidence",
+                "probabilities", "biomarkers", "model_version", "mode", "seconds")
+
+
+def _mode(result):
+    if result.get('tiled'):
+        return 'tiled'
+    return 'tta' if result.get('tta') else 'single'
+
+
+def _row(values, columns=LIST_COLUMNS):
+    row = dict(zip(columns, values))
+    for key in ("probabilities", "biomarkers"):
+        row[key] = json.loads(row[key]) if row[key] else None
+    return row
+
+
+class HistoryStore:
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+    def save(self, result, thumbnail=None, filename=None):
+        # result is what run_prediction returns; the preview/overlay WebPs, the
+        # explanation grid and the embedding go to artifacts, the rest to columns
+        explanation = result.get('explanation') or None
+        grid = explanation.get('map') if explanation else None
+        embedding = result.get('embedding')
+        width, height = result.get('image_size') or (None, None)
+        details = {
+            'tiled': result.get('tiled'),
+            'tile_stats': result.get('tile_stats'),
+            'tta': result.get('tta'),
+            'similar': result.get('similar'),
+            'explanation': ({k: explanation.get(k) for k in ('method', 'requested', 'seconds')}
+                            if explanation else None),
+        }
+        with self._lock:
+            db = self._db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                cur = db.execute(
+                    "INSERT INTO analyses (created, image_hash, filename, width, height, subtype, confidence,"
+                    " probabilities, biomarkers, model_version, mode, seconds, details)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), result.get('image_key'), filename, width, height, result['subtype'],
+                     result['confidence'], json.dumps(result['predictions']), json.dumps(result['biomarkers']),
+                     result.get('model_version'), _mode(result), result.get('seconds'), json.dumps(details)))
+                analysis_id = cur.lastrowid
+                db.execute("INSERT INTO artifacts VALUES (?, ?, ?, ?, ?, ?)", (
+                    analysis_id, thumbnail, result.get('preview'),
+                    explanation.get('overlay') if explanation else None,
+                    np.asarray(grid, dtype=np.float16).tobytes() if grid is not None else None,
+                    np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return analysis_id
+
+    def get(self, analysis_id):
+        # The stored analysis in the shape run_prediction returns it, so the
+        # Results page renders a past case exactly like a fresh one
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(LIST_COLUMNS)}, details FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+            blobs = self._db.execute(
+                "SELECT preview, overlay, explanation_map, embedding FROM artifacts WHERE analysis_id = ?",
+                (analysis_id,)).fetchone()
+        if row is None:
+            return None
+        meta = _row(row[:-1])
+        details = json.loads(row[-1]) if row[-1] else {}
+        preview, overlay, grid, embedding = blobs or (None,) * 4
+        explanation = details.get('explanation')
+        if explanation is not None:
+            grid = np.frombuffer(grid, dtype=np.float16).astype(np.float32) if grid else None
+            if grid is not None:
+                side = math.isqrt(grid.size)
+                grid = grid.reshape(side, side)
+            explanation = {**explanation, 'map': grid, 'overlay': overlay}
+        return {
+            'history_id': meta['id'],
+            'created': meta['created'],
+            'predictions': meta['probabilities'],
+            'subtype': meta['subtype'],
+            'confidence': meta['confidence'],
+            'image_key': meta['image_hash'],
+            'image_size': (meta['width'], meta['height']),
+            'filename': meta['filename'],
+            'biomarkers': meta['biomarkers'],
+            'model_version': meta['model_version'],
+            'seconds': meta['seconds'],
+            'tiled': details.get('tiled'),
+            'tile_stats': details.get('tile_stats'),
+            'tta': details.get('tta'),
+            'similar': details.get('similar'),
+            'explanation': explanation,
+            'preview': preview,
+            'embedding': np.frombuffer(embedding, dtype=np.float32) if embedding else None,
+        }
+
+    def page(self, before=None, limit=PAGE_SIZE, subtype=None):
+        # Keyset pagination, newest first: pass the last id of the previous
+        # page as `before`. Cost depends on the page size, not on how deep
+        # into the history the page is (OFFSET would scan everything skipped).
+        where, args = [], []
+        if before is not None:
+            where.append("id < ?")
+            args.append(before)
+        if subtype:
+            where.append("subtype = ?")
+            args.append(subtype)
+        sql = f"SELECT {', '.join(LIST_COLUMNS)} FROM analyses"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY id DESC LIMIT ?", args + [limit]).fetchall()
+        return [_row(r) for r in rows]
+
+    def rows(self, ids):
+        # Listing columns of the given analyses, in the order asked for
+        marks = ", ".join("?" * len(ids))
+        with self._lock:
+            found = self._db.execute(f"SELECT {', '.join(LIST_COLUMNS)} FROM analyses WHERE id IN ({marks})",
+                                     list(ids)).fetchall()
+        by_id = {r[0]: _row(r) for r in found}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def count(self, subtype=None):
+        sql, args = "SELECT COUNT(*) FROM analyses", ()
+        if subtype:
+            sql, args = sql + " WHERE subtype = ?", (subtype,)
+        with self._lock:
+            return self._db.execute(sql, args).fetchone()[0]
+
+    def subtypes(self):
+        with self._lock:
+            return [r[0] for r in self._db.execute("SELECT DISTINCT subtype FROM analyses ORDER BY subtype")]
+
+    def thumbnail(self, analysis_id):
+        # One row's blob at a time: the history list asks only for visible rows
+        with self._lock:
+            row = self._db.execute("SELECT thumbnail FROM artifacts WHERE analysis_id = ?",
+                                   (analysis_id,)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, analysis_id):
+        with self._lock:
+            self._db.execute("DELETE FROM analyses WHERE id = ?", (analysis_id,))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history():
+    # None when disabled or when the database cannot be opened
+    global _store
+    if _store is None and HISTORY_DB:
+        with _store_lock:
+            if _store is None:
+                try:
+                    _store = HistoryStore(HISTORY_DB)
+                except sqlite3.Error as e:
+                    log.warning("History store unavailable: %s", e)
+                    return None
+    return _store
+
+
+def remember_results(session, result):
+    # What a page keeps in st.session_state for a finished analysis: only the
+    # history id when the result was stored, the whole result otherwise
+    if result.get('history_id') is not None:
+        session['analysis_id'] = result['history_id']
+        session.pop('prediction_results', None)
+    else:
+        session['prediction_results'] = result
+        session.pop('analysis_id', None)
+
+
+def load_results(session):
+    # The current analysis for the Results page, or None
+    analysis_id = session.get('analysis_id')
+    store = get_history() if analysis_id is not None else None
+    if store is not None:
+        result = store.get(analysis_id)
+        if result is not None:
+            return result
+    return session.get('prediction_results')
@@ -0,0 +1,93 @@
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+
+PAGES = ["app.py", "pages/1_Upload_Predict.py", "pages/2_Results.py",
+         "pages/3_Model_Info.py", "pages/4_About.py"]
+
+
+def top_level_imports(path):
+    # Only module-level imports run before first paint; anything imported
+    # inside a function is lazy by construction and not counted here
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    stmts = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            stmts.append("import " + ", ".join(a.name for a in node.names))
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            stmts.append(f"from {node.module} import " + ", ".join(a.name for a in node.names))
+    return stmts
+
+
+def profile_imports(stmts, cwd="."):
+    # python -X importtime writes "self [us] | cumulative [us] | name" to stderr
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "\n".join(stmts)],
+                          cwd=cwd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def interpreter_startup(cwd="."):
+    # Modules every interpreter loads before running -c (site, encodings, ...)
+    return {name for name, _, _, _ in profile_imports(["pass"], cwd)}
+
+
+def summarize(rows, exclude=()):
+    rows = [r for r in rows if r[0] not in exclude]
+    # Depth-0 entries are what the script imported directly;
+    # per package we add up self time of every submodule it pulled in
+    direct = {name: cum / 1000 for name, depth, _, cum in rows if depth == 0}
+    packages = {}
+    for name, _, self_us, _ in rows:
+        root = name.split(".")[0]
+        packages[root] = packages.get(root, 0.0) + self_us / 1000
+    total = sum(direct.values())
+    return {"total_ms": total, "direct_ms": direct, "package_self_ms": packages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-page import-time breakdown")
+    parser.add_argument("pages", nargs="*", default=PAGES)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="write the full report to this file")
+    parser.add_argument("--budget-ms", type=float,
+                        help="exit non-zero if any page exceeds this many ms of imports")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    startup = interpreter_startup(root)
+    report, over = {}, []
+    for page in args.pages:
+        rows = profile_imports(top_level_imports(os.path.join(root, page)), cwd=root)
+        summary = summarize(rows, exclude=startup)
+        report[page] = summary
+        print(f"\n{page}: {summary['total_ms']:.0f} ms")
+        top = sorted(summary["package_self_ms"].items(), key=lambda kv: -kv[1])[:args.top]
+        for name, ms in top:
+            print(f"  {name:<28} {ms:8.1f} ms")
+        if args.budget_ms and summary["total_ms"] > args.budget_ms:
+            over.append(page)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if over:
+        print(f"\nOver the {args.budget_ms:.0f} ms budget: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+import torch
+from PIL import Image
+
+from utils.batching import MicroBatchScheduler
+from utils.bio_encoder import BiomarkerEncoder
+from utils.bundle import WEIGHTS_FILE, is_bundle
+from utils.cache import BoundedLRUCache, content_hash, file_hash
+from utils.disk_cache import get_disk_cache, prediction_key
+from utils.explain import explain_forward, supports_explanations
+from utils.governor import InferenceGovernor
+from utils.history import get_history
+from utils.metrics import get_metrics, timed
+from utils.model import CHECKPOINT_PATH, load_model_and_mappings, transform_dino
+from utils.preprocess_pool import PreprocessPool
+from utils.preprocessing import preprocess_batch
+from utils.retrieval import get_case_index
+from utils.thumbnails import cache_stats as thumbnail_stats, get_thumbnail, to_webp
+from utils.tiling import aggregate, embed_tiles, iter_tile_batches, tile_grid
+from utils.tta import DIHEDRAL_VIEWS, tta_embed, tta_head
+from utils.visualizations import create_gradcam_overlay
+from utils.whatif import sweep
+
+log = logging.getLogger(__name__)
+
+# Everything that needs torch/transformers lives here so that pages only pay
+# for it once a prediction is requested (or utils.preload warms it up).
+
+# Select with BCR_BACKEND=torch|onnx; the ONNX graph is exported on first use.
+# BCR_PRECISION=int8 quantises the backbone Linear layers dynamically;
+# int8-static calibrates on the slides in BCR_CALIBRATION_DIR (ONNX only).
+INFERENCE_BACKEND = os.environ.get("BCR_BACKEND", "torch")
+INFERENCE_PRECISION = os.environ.get("BCR_PRECISION", "fp32")
+CALIBRATION_DIR = os.environ.get("BCR_CALIBRATION_DIR")
+# BCR_COMPILE=compile|script compiles the backbone (torch.compile / per-batch-size
+# TorchScript traces); either way the model is warmed up at the served batch sizes
+COMPILE_MODE = os.environ.get("BCR_COMPILE", "eager")
+# An offline bundle (python -m utils.bundle convert) is used whenever present
+BUNDLE_DIR = os.environ.get("BCR_BUNDLE", "model_bundle")
+
+# Requests from all sessions are merged into one backbone forward of up to
+# MAX_BATCH_SIZE images; a lone request waits at most MAX_WAIT_MS for company.
+MAX_BATCH_SIZE = 8
+MAX_WAIT_MS = 10
+
+# BCR_GOVERNOR_POLICY=latency runs one inference at a time on all of
+# BCR_CORE_BUDGET cores; throughput runs one single-threaded inference per core
+CORE_BUDGET = int(os.environ.get("BCR_CORE_BUDGET", 0)) or os.cpu_count() or 1
+GOVERNOR_POLICY = os.environ.get("BCR_GOVERNOR_POLICY", "latency")
+
+# Whole-slide scans run to 20k×20k; PIL's default bomb guard stops at ~179MP
+Image.MAX_IMAGE_PIXELS = 25000 * 25000
+TILE_BATCH_SIZE = 32
+# Previous cases shown next to a prediction (utils.retrieval, BCR_INDEX_DIR)
+SIMILAR_CASES = 5
+
+
+class InferenceRuntime:
+    # One per process, shared by every Streamlit session (and the CLI tools)
+    def __init__(self):
+        self.model, self.bm_feat_cols, self.idx_to_subtype = load_model_and_mappings(
+            backend=INFERENCE_BACKEND, precision=INFERENCE_PRECISION,
+            calibration_dir=CALIBRATION_DIR, compile_mode=COMPILE_MODE,
+            warmup_batch_sizes=(1, MAX_BATCH_SIZE), bundle_dir=BUNDLE_DIR)
+        self.bio_encoder = BiomarkerEncoder(self.bm_feat_cols)
+        self.checkpoint_digest = checkpoint_digest()
+        self.model_version = model_version(self.model, self.checkpoint_digest)
+        # ViT-small pooler_output is 384 fp32 values (~1.5KB), so 32MB holds ~20k images
+        self.embedding_cache = BoundedLRUCache(max_entries=4096, max_bytes=32 * 1024 * 1024)
+        # Whole predictions on disk, shared with the other processes on the host
+        # and kept across restarts; entries of a previous checkpoint are dropped.
+        # Only the checkpoint counts here: processes serving the same weights
+        # with another backend or precision share the file and keep their entries.
+        self.disk_cache = get_disk_cache()
+        if self.disk_cache is not None:
+            self.disk_cache.retain(self.checkpoint_digest)
+        self.governor = InferenceGovernor(CORE_BUDGET, GOVERNOR_POLICY)
+        self.scheduler = MicroBatchScheduler(self.model.forward_with_embedding,
+                                             max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                                             workers=self.governor.max_concurrent,
+                                             governor=self.governor)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        get_metrics().add_collector(self.collect)
+
+    def collect(self):
+        # Metrics collector: cache counters and queue depths at scrape time
+        caches = [("embedding", self.embedding_cache.stats()), ("thumbnail", thumbnail_stats())]
+        if self.disk_cache is not None:
+            caches.append(("prediction", self.disk_cache.stats()))
+        for name, cs in caches:
+            labels = {'cache': name}
+            yield ("cache_hits_total", "counter", "Cache lookups that hit", labels, cs['hits'])
+            yield ("cache_misses_total", "counter", "Cache lookups that missed", labels, cs['misses'])
+            yield ("cache_evictions_total", "counter", "Entries evicted to stay under the size cap", labels,
+                   cs['evictions'])
+            yield ("cache_entries", "gauge", "Entries currently cached", labels, cs['entries'])
+            yield ("cache_bytes", "gauge", "Bytes currently cached", labels, cs['bytes'])
+        ss, gs = self.scheduler.stats(), self.governor.stats()
+        yield ("batcher_queue_depth", "gauge", "Requests waiting for the micro-batcher", {}, ss['queue_depth'])
+        yield ("batcher_batches_total", "counter", "Backbone batches run by the micro-batcher", {}, ss['batches'])
+        yield ("batcher_requests_total", "counter", "Requests served by the micro-batcher", {}, ss['requests'])
+        yield ("governor_active", "gauge", "Inferences holding a governor slot", {}, gs['active'])
+        yield ("governor_queue_depth", "gauge", "Inferences waiting for a governor slot", {}, gs['queue_depth'])
+        yield ("model_info", "gauge", "Served model", {'version': self.model_version}, 1)
+
+    def preprocess_pool(self):
+        # Tile crop/resize/normalise runs in worker processes that write into a
+        # shared-memory ring; on small boxes the spawn overhead is not worth it.
+        if (os.cpu_count() or 1) <= 2:
+            return None
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = PreprocessPool(batch_size=TILE_BATCH_SIZE)
+        return self._pool
+
+
+def checkpoint_digest():
+    # Hash of the weights file actually served
+    weights = os.path.join(BUNDLE_DIR, WEIGHTS_FILE) if is_bundle(BUNDLE_DIR) else CHECKPOINT_PATH
+    return file_hash(weights)[:12] if os.path.exists(weights) else "unknown"
+
+
+def model_version(model, digest=None):
+    # Backend, precision and the checkpoint digest, so stored results can be
+    # told apart after a retrain or a precision change
+    return f"{model.name}-{model.precision}-{digest or checkpoint_digest()}"
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime():
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = InferenceRuntime()
+    return _runtime
+
+
+def is_ready():
+    return _runtime is not None
+
+
+def tile_batches(img, tile_size, overlap, skip_background=True, pool=None):
+    if pool is not None:
+        return pool.iter_tile_batches(img, tile_size, overlap, skip_background)
+    return iter_tile_batches(img, transform_dino, tile_size, overlap, TILE_BATCH_SIZE, skip_background)
+
+
+def process_biomarker_input(marker, intensity, staining, bm_feat_cols):
+    user = {
+        f"biomarker_{marker}":1.0,
+        f"intensity_{intensity}":1.0,
+        f"staining_{staining}":1.0
+    }
+    vec = [user.get(col,0.0) for col in bm_feat_cols]
+    return torch.tensor(vec, dtype=torch.float32).unsqueeze(0)
+
+
+def predict_dino(model, img, bio_vec, image_key=None, cache=None, scheduler=None):
+    # image_key is a content hash of the upload; without one nothing is cached
+    x_img = cache.get(image_key) if cache is not None and image_key is not None else None
+    with torch.no_grad():
+        if x_img is not None:
+            with timed("head"):
+                logits = model.forward_head(x_img, bio_vec)
+        else:
+            with timed("preprocess"):
+                img_t = transform_dino(img).unsqueeze(0)
+            # backbone and head are one fused call here (batched with other
+            # sessions), so "backbone" includes the head and the batching wait
+            with timed("backbone"):
+                if scheduler is not None:
+                    x_img, logits = scheduler(img_t, bio_vec)
+                else:
+                    x_img, logits = model.forward_with_embedding(img_t, bio_vec)
+            if cache is not None and image_key is not None:
+                cache.put(image_key, x_img)
+        probs = torch.softmax(logits, dim=1).cpu().numpy()[0]
+        idx = int(np.argmax(probs))
+    return idx, probs
+
+
+def _with_progress(batches, img, tile_size, overlap, progress):
+    # Tiles come out in grid order, so the last box of a batch tells how far
+    # through the slide we are even when background tiles were dropped
+    position = {box: i + 1 for i, box in enumerate(tile_grid(img.size[0], img.size[1], tile_size, overlap))}
+    for tiles, boxes in batches:
+        yield tiles, boxes
+        progress(position[tuple(boxes[-1])] / len(position))
+
+
+def tiled_embedding(model, img, tile_size=224, overlap=0.25, pooling='mean',
+                    image_key=None, cache=None, pool=None, governor=None, progress=None):
+    # The pooled slide embedding and the tiling stats, cached per upload+settings
+    key = f"{image_key}:tiles:{tile_size}:{overlap}:{pooling}" if image_key else None
+    entry = cache.get(key) if cache is not None and key is not None else None
+    if entry is None:
+        def batches(skip_background=True):
+            it = tile_batches(img, tile_size, overlap, skip_background, pool)
+            return _with_progress(it, img, tile_size, overlap, progress) if progress else it
+
+        with governor.slot() if governor else nullcontext(), timed("tiles"):
+            emb, _, stats = embed_tiles(model.embed, batches())
+            if stats['tiles'] == 0:
+                # Nothing passed the tissue filter (e.g. a very pale stain): use every tile
+                emb, _, stats = embed_tiles(model.embed, batches(False))
+        entry = (aggregate(emb, pooling), stats)
+        if cache is not None and key is not None:
+            cache.put(key, entry)
+    return entry
+
+
+def predict_tiled(model, img, bio_vec, tile_size=224, overlap=0.25, pooling='mean',
+                  image_key=None, cache=None, pool=None, governor=None, progress=None):
+    x_img, stats = tiled_embedding(model, img, tile_size, overlap, pooling, image_key, cache,
+                                   pool, governor, progress)
+    with torch.no_grad(), timed("head"):
+        logits = model.forward_head(x_img, bio_vec)
+        probs = torch.softmax(logits, dim=1).cpu().numpy()[0]
+    return int(np.argmax(probs)), probs, stats
+
+
+def forward_head(model, x_img, bio):
+    # bio is either dense one-hot rows (float) or BiomarkerEncoder ids (int64)
+    if bio.dtype == torch.int64:
+        return model.forward_head_ids(x_img, bio)
+    return model.forward_head(x_img, bio)
+
+
+def predict_batch(model, images, bio, image_keys=None, cache=None, governor=None):
+    # images is a list of PIL images or an already normalised (N, 3, 224, 224)
+    # tensor, bio dense rows or encoder ids; cached embeddings skip the
+    # backbone, the rest share one forward
+    n = bio.shape[0]
+    keys = image_keys or [None] * n
+    x_img = [cache.get(k) if cache is not None and k is not None else None for k in keys]
+    missing = [i for i in range(n) if x_img[i] is None]
+    with torch.no_grad():
+        if missing:
+            if torch.is_tensor(images):
+                img_t = images[missing]
+            else:
+                with timed("preprocess"):
+                    img_t = preprocess_batch([images[i] for i in missing])
+            with governor.slot() if governor else nullcontext(), timed("backbone"):
+                emb = model.embed(img_t)
+            for j, i in enumerate(missing):
+                x_img[i] = emb[j:j + 1]
+                if cache is not None and keys[i] is not None:
+                    cache.put(keys[i], x_img[i])
+        with timed("head"):
+            logits = forward_head(model, torch.cat(x_img), bio)
+        return torch.softmax(logits, dim=1).cpu().numpy()
+
+
+def predict_explained(model, img, bio_vec, method='rollout', image_key=None, cache=None, governor=None):
+    # The explanation comes out of the same backbone pass as the embedding, and
+    # both are cached; Grad-CAM depends on the fused logits, so on bio_vec too
+    key = None
+    if image_key:
+        key = f"{image_key}:explain:{method}"
+        if method == 'gradcam':
+            key += ":" + content_hash(bio_vec.numpy().tobytes())
+    entry = cache.get(key) if cache is not None and key is not None else None
+    seconds = 0.0
+    if entry is None:
+        with timed("preprocess"):
+            img_t = transform_dino(img).unsqueeze(0)
+        start = time.perf_counter()
+        with governor.slot() if governor else nullcontext():
+            x_img, _, maps = explain_forward(model, img_t, bio_vec, method)
+        seconds = time.perf_counter() - start
+        get_metrics().observe("explain", seconds)
+        entry = (x_img, maps[0])
+        if cache is not None and key is not None:
+            cache.put(key, entry)
+            cache.put(image_key, x_img)
+    x_img, grid = entry
+    with torch.no_grad(), timed("head"):
+        probs = torch.softmax(model.forward_head(x_img, bio_vec), dim=1).cpu().numpy()[0]
+    return int(np.argmax(probs)), probs, {'method': method, 'map': grid, 'seconds': seconds}
+
+
+def predict_tta(model, img, bio_vec, views=DIHEDRAL_VIEWS, jitter=0, mode='prob',
+                image_key=None, cache=None, governor=None):
+    # Opt-in test-time augmentation for predict_dino: every view shares one
+    # backbone batch. The (V, 384) view embeddings are cached per upload, and
+    # view 0 is the identity, so it also fills the plain embedding cache.
+    key = f"{image_key}:tta:{views}:{jitter}" if image_key else None
+    emb = cache.get(key) if cache is not None and key is not None else None
+    seconds = 0.0
+    if emb is None:
+        with timed("preprocess"):
+            img_t = transform_dino(img).unsqueeze(0)
+        start = time.perf_counter()
+        with governor.slot() if governor else nullcontext():
+            emb = tta_embed(model, img_t, views, jitter)
+        seconds = time.perf_counter() - start
+        get_metrics().observe("tta_backbone", seconds)
+        if cache is not None and key is not None:
+            cache.put(key, emb)
+            cache.put(image_key, emb[:1])
+    with timed("head"):
+        probs, stats = tta_head(model, emb, bio_vec, mode)
+    stats['seconds'] = seconds
+    return int(np.argmax(probs)), probs, stats
+
+
+def image_embedding(model, img, image_key=None, cache=None, governor=None, tiled=None):
+    # The embedding a prediction was made from: the pooled tiles when `tiled`
+    # holds the tiling options, otherwise the single 224x224 view
+    if tiled:
+        return tiled_embedding(model, img, tiled['tile_size'], tiled['overlap'], tiled['pooling'],
+                               image_key, cache, governor=governor)[0]
+    x_img = cache.get(image_key) if cache is not None and image_key is not None else None
+    if x_img is None:
+        with timed("preprocess"):
+            img_t = transform_dino(img).unsqueeze(0)
+        with governor.slot() if governor else nullcontext(), timed("backbone"):
+            x_img = model.embed(img_t)
+        if cache is not None and image_key is not None:
+            cache.put(image_key, x_img)
+    return x_img
+
+
+def predict_whatif(model, img, bm_feat_cols, idx_to_subtype, markers=None, intensities=None,
+                   stainings=None, image_key=None, cache=None, governor=None, tiled=None, embedding=None):
+    # Subtype probabilities for every biomarker x intensity x staining (or the
+    # given subsets) from one embedding: at most one backbone pass, usually a
+    # cache hit, then a single batched head call. A stored analysis passes
+    # its saved embedding and no image at all.
+    if embedding is not None:
+        x_img = torch.as_tensor(np.asarray(embedding, dtype=np.float32)).view(1, -1)
+    else:
+        x_img = image_embedding(model, img, image_key, cache, governor, tiled)
+    with timed("whatif"):
+        return sweep(model, x_img, bm_feat_cols, idx_to_subtype, markers, intensities, stainings)
+
+
+def find_similar_cases(vec, record, image_key=None, tiled=None):
+    # Looks the embedding up in the case index, then adds it with this
+    # prediction's diagnosis (searching first, so an upload never finds
+    # itself). The index is a nice-to-have: its failures are logged, not raised.
+    index = get_case_index()
+    if index is None or image_key is None:
+        return None
+    try:
+        with timed("similar_cases"):
+            similar = index.search(vec, SIMILAR_CASES, exclude=image_key)
+            index.add(vec, image_key, kind='tiled' if tiled else 'single', **record)
+    except (OSError, sqlite3.Error) as e:
+        log.warning("Case index lookup failed: %s", e)
+        return None
+    return similar
+
+
+def save_history(result, image, filename=None):
+    # Returns the history id, or None when the store is off or failing; the
+    # caller then keeps the whole result in the session instead
+    store = get_history()
+    if store is None:
+        return None
+    try:
+        with timed("history_save"):
+            return store.save(result, get_thumbnail(image, 256, result['image_key']), filename)
+    except sqlite3.Error as e:
+        log.warning("Could not save the analysis to the history: %s", e)
+        return None
+
+
+def load_cached_prediction(key):
+    # Like the case index, the disk cache only saves work: errors are logged
+    cache = get_runtime().disk_cache
+    if cache is None or key is None:
+        return None
+    try:
+        with timed("disk_cache_get"):
+            return cache.get(key)
+    except (sqlite3.Error, pickle.UnpicklingError, EOFError) as e:
+        log.warning("Prediction cache lookup failed: %s", e)
+        return None
+
+
+def store_cached_prediction(key, outputs):
+    rt = get_runtime()
+    if rt.disk_cache is None or key is None:
+        return
+    try:
+        # Keys already include the full model_version; the row is tagged with
+        # the checkpoint alone, which is what retain() invalidates on
+        rt.disk_cache.put(key, outputs, rt.checkpoint_digest)
+    except sqlite3.Error as e:
+        log.warning("Could not write to the prediction cache: %s", e)
+
+
+def compute_prediction(job, image, vec, image_key=None, tiled=None, explain=None, tta=None):
+    # Everything in a result that depends only on the upload, the biomarker
+    # vector, the model and the options, i.e. what the disk cache holds
+    rt = get_runtime()
+    # Image.open on the page only read the header; decoding here keeps it out
+    # of the preprocess timings below
+    with timed("decode"):
+        image.load()
+    tile_stats = explanation = tta_stats = None
+    if tiled:
+        job.update(0.15, "Embedding tiles")
+        idx, probs, tile_stats = predict_tiled(rt.model, image, vec, tiled['tile_size'], tiled['overlap'],
+                                               tiled['pooling'], image_key=image_key, cache=rt.embedding_cache,
+                                               pool=rt.preprocess_pool(), governor=rt.governor,
+                                               progress=lambda f: job.update(0.15 + 0.8 * f))
+    elif explain and supports_explanations(rt.model):
+        # Grad-CAM needs gradients through the fp32 head; other precisions get
+        # rollout, and the explanation records what was asked for so the
+        # pages can say so
+        method = 'rollout' if explain == 'gradcam' and rt.model.precision != 'fp32' else explain
+        job.update(0.2, "Running model with explanation")
+        idx, probs, explanation = predict_explained(rt.model, image, vec, method, image_key,
+                                                    rt.embedding_cache, rt.governor)
+        explanation['requested'] = explain
+    if tta and not tiled:
+        # tta is {'views', 'jitter', 'mode'}; its averaged probabilities
+        # replace the single-view ones, the explanation (if any) is kept
+        job.update(0.5 if explanation else 0.2, "Running test-time augmentation")
+        idx, probs, tta_stats = predict_tta(rt.model, image, vec, image_key=image_key,
+                                            cache=rt.embedding_cache, governor=rt.governor, **tta)
+    elif not tiled and explanation is None:
+        job.update(0.2, "Running model")
+        idx, probs = predict_dino(rt.model, image, vec, image_key=image_key,
+                                  cache=rt.embedding_cache, scheduler=rt.scheduler)
+    embedding = image_embedding(rt.model, image, image_key, rt.embedding_cache, rt.governor, tiled)[0].numpy()
+    job.update(0.85, "Rendering previews")
+    with timed("render"):
+        if explanation is not None:
+            explanation['overlay'] = to_webp(create_gradcam_overlay(image, explanation['map'], max_side=768))
+        preview = get_thumbnail(image, 768, image_key)
+    return {
+        'predictions': {rt.idx_to_subtype[i]: float(p) for i, p in enumerate(probs)},
+        'subtype': rt.idx_to_subtype[idx],
+        'confidence': float(probs[idx]),
+        'embedding': embedding,
+        'preview': preview,
+        'tile_stats': tile_stats,
+        'explanation': explanation,
+        'tta': tta_stats,
+    }
+
+
+def run_prediction(job, image, biomarker_data, image_key=None, tiled=None, explain=None, tta=None,
+                   filename=None):
+    # Body of the Upload page's background job. The result holds display-size
+    # WebPs and the embedding instead of the upload itself, and is saved to the
+    # history, so the Results page never needs the image or the model again.
+    job.update(0.05, "Loading model")
+    rt = get_runtime()
+    job.update(0.1, "Encoding biomarkers")
+    # Every marker of the panel, not just the first; the dense row is what
+    # the micro-batcher and the ONNX graph take
+    vec = rt.bio_encoder.to_dense(rt.bio_encoder.encode_panel(biomarker_data))
+    # A re-submitted slide (same bytes, same panel, same checkpoint) is served
+    # from the disk cache, whichever process or restart computed it
+    key = prediction_key(image_key, vec, rt.model_version, kind='run_prediction', tiled=tiled,
+                         explain=explain, tta=tta) if image_key else None
+    outputs = load_cached_prediction(key)
+    cached = outputs is not None
+    if not cached:
+        outputs = compute_prediction(job, image, vec, image_key, tiled, explain, tta)
+        store_cached_prediction(key, outputs)
+    job.update(0.9, "Finding similar cases")
+    similar = find_similar_cases(outputs['embedding'], {'subtype': outputs['subtype'],
+                                                        'confidence': outputs['confidence'],
+                                                        'probabilities': outputs['predictions'],
+                                                        'biomarkers': biomarker_data},
+                                 image_key, tiled)
+    job.update(0.95, "Saving results")
+    result = {
+        **outputs,
+        'image_key': image_key,
+        'image_size': image.size,
+        'filename': filename,
+        'biomarkers': biomarker_data,
+        'model_version': rt.model_version,
+        'tiled': tiled,
+        'similar': similar,
+        'cached': cached,
+        'prediction_key': key,
+        'seconds': job.elapsed_s,
+    }
+    result['history_id'] = save_history(result, image, filename)
+    metrics = get_metrics()
+    metrics.observe("prediction", job.elapsed_s)
+    metrics.inc("predictions_total", help="Finished Upload page predictions",
+                mode='tiled' if tiled else 'tta' if tta else 'single', cached=str(cached).lower())
+    return result
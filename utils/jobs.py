@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.metrics import get_metrics
+
+log = logging.getLogger(__name__)
+
+ACTIVE = ("queued", "running")
+
+
+class Job:
+    # fn(job, ...) runs on the manager's pool and reports through job.update();
+    # the page only ever reads these fields, so polling never blocks on the work
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.progress = 0.0
+        self.stage = "Queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def update(self, progress=None, stage=None):
+        if progress is not None:
+            self.progress = min(1.0, max(self.progress, progress))
+        if stage is not None:
+            self.stage = stage
+
+    @property
+    def done(self):
+        return self.status not in ACTIVE
+
+    @property
+    def elapsed_s(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class JobManager:
+    # Process-wide, like the InferenceRuntime: Streamlit sessions keep only the
+    # job id, so a rerun or page switch never loses or repeats the work.
+    # Finished jobs are kept for ttl_s (and at most `retention` of them).
+    def __init__(self, max_workers=2, retention=64, ttl_s=3600, name="jobs"):
+        self.name = name
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.retention = retention
+        self.ttl_s = ttl_s
+
+    def submit(self, fn, *args, kind="job", **kwargs):
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        if job_id is None:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.started = time.time()
+        job.update(stage="Starting")
+        metrics = get_metrics()
+        metrics.observe("job_wait", job.started - job.created)
+        try:
+            job.result = fn(job, *args, **kwargs)
+        except Exception as e:
+            log.exception("Job %s (%s) failed", job.id, job.kind)
+            job.error = f"{type(e).__name__}: {e}"
+            job.stage = "Failed"
+            job.finished = time.time()
+            job.status = "failed"
+            metrics.inc("jobs_total", help="Finished background jobs", kind=job.kind, status="failed")
+            return
+        job.update(progress=1.0, stage="Done")
+        # status last: readers treat a finished status as "result is ready"
+        job.finished = time.time()
+        job.status = "done"
+        metrics.inc("jobs_total", help="Finished background jobs", kind=job.kind, status="done")
+
+    def collect(self):
+        # Metrics collector: jobs per status in this manager
+        counts = self.stats()
+        for status in ("queued", "running"):
+            yield ("jobs", "gauge", "Background jobs waiting or running", {'pool': self.name, 'status': status},
+                   counts.get(status, 0))
+
+    def _prune(self):
+        now = time.time()
+        finished = [j for j in self._jobs.values() if j.done]
+        expired = [j for j in finished if now - j.finished > self.ttl_s]
+        overflow = finished[:max(0, len(self._jobs) - self.retention)]
+        for job in expired + overflow:
+            self._jobs.pop(job.id, None)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager()
+                get_metrics().add_collector(_manager.collect)
+    return _manager
@@ -0,0 +1,276 @@
+import argparse
+import logging
+import os
+import resource
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Process-local metrics: stage latencies, counters and gauges, exported in the
+# Prometheus text format. The Streamlit process serves them on
+# 127.0.0.1:BCR_METRICS_PORT ("" disables it); utils.service on its own /metrics.
+METRICS_PORT = os.environ.get("BCR_METRICS_PORT", "9108")
+# Quantiles are over the last WINDOW calls of each stage, so they follow the
+# current load instead of averaging over the process lifetime
+WINDOW = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+PREFIX = "bcr_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the lifetime peak (KB on Linux), the best we can do here
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class StageWindow:
+    # Rolling latency window of one stage plus lifetime count/sum
+    def __init__(self, window=WINDOW):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def snapshot(self):
+        # Not thread-safe by itself: Metrics calls it under its lock
+        return list(self._samples), self.count, self.total
+
+
+def quantiles(samples):
+    if not samples:
+        return {q: 0.0 for q in QUANTILES}
+    values = np.percentile(np.asarray(samples, dtype=np.float64), [q * 100 for q in QUANTILES])
+    return dict(zip(QUANTILES, values.tolist()))
+
+
+class Metrics:
+    # Collectors are callables returning (name, kind, help, labels, value)
+    # tuples; they read live objects (caches, queues) at scrape time, so the
+    # hot paths only ever pay for observe() and inc().
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._help = {}
+        self._collectors = []
+        self.started = time.time()
+        self._cpu_sample = (time.perf_counter(), self._cpu_seconds(), 0.0)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            window = self._stages.get(stage)
+            if window is None:
+                window = self._stages[stage] = StageWindow()
+            window.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name, value=1, help="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            if help:
+                self._help[name] = help
+
+    def add_collector(self, fn):
+        with self._lock:
+            self._collectors.append(fn)
+
+    @staticmethod
+    def _cpu_seconds():
+        t = os.times()
+        return t.user + t.system
+
+    def process(self):
+        # CPU% is over the time since the previous sample (at least a second
+        # apart), 100% being one busy core
+        now, cpu = time.perf_counter(), self._cpu_seconds()
+        with self._lock:
+            last_t, last_cpu, percent = self._cpu_sample
+            if now - last_t >= 1.0:
+                percent = (cpu - last_cpu) / (now - last_t) * 100
+                self._cpu_sample = (now, cpu, percent)
+        return {
+            'rss_mb': current_rss_mb(),
+            'cpu_percent': percent,
+            'cpu_seconds': cpu,
+            'cores': os.cpu_count() or 1,
+            'threads': threading.active_count(),
+            'uptime_s': time.time() - self.started,
+        }
+
+    def stages(self):
+        # {stage: {'count', 'sum', 'p50', 'p95', 'p99'}} in seconds
+        # Copied under the lock, since observe() keeps appending from other
+        # threads; the percentiles are computed outside it
+        with self._lock:
+            snapshots = [(stage, window.snapshot()) for stage, window in self._stages.items()]
+        out = {}
+        for stage, (samples, count, total) in sorted(snapshots):
+            q = quantiles(samples)
+            out[stage] = {'count': count, 'sum': total, **{f"p{round(k * 100)}": v for k, v in q.items()}}
+        return out
+
+    def _samples(self):
+        # Every exported value as (name, kind, help, labels, value)
+        p = self.process()
+        yield ("process_resident_memory_bytes", "gauge", "Resident set size", {}, p['rss_mb'] * 2**20)
+        yield ("process_cpu_seconds_total", "counter", "User and system CPU time", {}, p['cpu_seconds'])
+        yield ("process_cpu_percent", "gauge", "CPU use since the previous sample, 100 = one core", {},
+               p['cpu_percent'])
+        yield ("process_threads", "gauge", "Live Python threads", {}, p['threads'])
+        yield ("uptime_seconds", "gauge", "Seconds since the metrics registry was created", {}, p['uptime_s'])
+        with self._lock:
+            counters = list(self._counters.items())
+            collectors = list(self._collectors)
+        for (name, labels), value in sorted(counters):
+            yield (name, "counter", self._help.get(name, ""), dict(labels), value)
+        for fn in collectors:
+            try:
+                yield from fn()
+            except Exception as e:
+                log.warning("Metrics collector %r failed: %s", fn, e)
+
+    def render_prometheus(self):
+        lines, described = [], set()
+
+        def describe(name, kind, help):
+            if name not in described:
+                described.add(name)
+                if help:
+                    lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        stages = self.stages()
+        if stages:
+            name = PREFIX + "stage_seconds"
+            describe(name, "summary", f"Pipeline stage latency; quantiles over the last {WINDOW} calls")
+            for stage, s in stages.items():
+                for q in QUANTILES:
+                    lines.append(f"{name}{_labels({'stage': stage, 'quantile': q})} {s[f'p{round(q * 100)}']:.6g}")
+                lines.append(f"{name}_sum{_labels({'stage': stage})} {s['sum']:.6g}")
+                lines.append(f"{name}_count{_labels({'stage': stage})} {s['count']}")
+        # Prometheus wants all samples of a metric together
+        grouped = {}
+        for name, kind, help, labels, value in self._samples():
+            grouped.setdefault(PREFIX + name, (kind, help, []))[2].append((labels, value))
+        for name, (kind, help, samples) in grouped.items():
+            describe(name, kind, help)
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels)} {float(value):.6g}")
+        return "\n".join(lines) + "\n"
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
+
+
+def timed(stage):
+    # with timed("backbone"): ...
+    return get_metrics().timer(stage)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        log.debug(fmt, *args)
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = get_metrics().render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server = None
+
+
+def start_metrics_server(port=METRICS_PORT, host="127.0.0.1"):
+    # Once per process, on a daemon thread. Returns the server, or None when
+    # disabled or the port is taken (e.g. by another Streamlit process).
+    global _server
+    if not port:
+        return None
+    with _metrics_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            except OSError as e:
+                log.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+                _server = False
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return _server or None
+
+
+def metrics_url():
+    return f"http://{_server.server_address[0]}:{_server.server_address[1]}/metrics" if _server else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the stage latencies a metrics endpoint reports")
+    parser.add_argument("url", nargs="?", default=f"http://127.0.0.1:{METRICS_PORT or 9108}/metrics")
+    args = parser.parse_args()
+
+    with urllib.request.urlopen(args.url, timeout=5) as resp:
+        text = resp.read().decode()
+    stages = {}
+    for line in text.splitlines():
+        if not line.startswith(PREFIX + "stage_seconds{"):
+            continue
+        labels, value = line[len(PREFIX + "stage_seconds{"):].rsplit("} ", 1)
+        fields = dict(part.split("=", 1) for part in labels.split(","))
+        stages.setdefault(fields["stage"].strip('"'), {})[fields["quantile"].strip('"')] = float(value)
+    print(f"{'stage':<18} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for stage, q in stages.items():
+        print(f"{stage:<18} " + " ".join(f"{q.get(str(k), 0) * 1000:>7.1f}ms" for k in QUANTILES))
+    for line in text.splitlines():
+        if line.startswith(PREFIX) and not line.startswith(PREFIX + "stage_seconds"):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
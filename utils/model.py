@@ -0,0 +1,108 @@
+import pickle
+
+import torch
+import torch.nn as nn
+from transformers import AutoModel
+
+from utils.preprocessing import preprocess
+
+BACKBONE_ID = "1aurent/vit_small_patch16_256.tcga_brca_dino"
+CHECKPOINT_PATH = "dino_model.pth"
+VIT_OUT_DIM = 384
+
+# Resize to 224x224 + ToTensor + ImageNet Normalize, fused into one pass over
+# a uint8 array (and tolerant of RGBA/L/CMYK/ICC uploads)
+transform_dino = preprocess
+
+
+def load_backbone(attn_implementation="sdpa"):
+    # SDPA dispatches to fused attention kernels; older transformers or
+    # models without SDPA support fall back to the default implementation
+    if attn_implementation:
+        try:
+            return AutoModel.from_pretrained(BACKBONE_ID, attn_implementation=attn_implementation)
+        except (ValueError, ImportError, TypeError):
+            pass
+    return AutoModel.from_pretrained(BACKBONE_ID)
+
+
+class DinoMLPFusion(nn.Module):
+    def __init__(self, num_classes, bio_dim, attn_implementation="sdpa", backbone=None):
+        super().__init__()
+        self.backbone = backbone if backbone is not None else load_backbone(attn_implementation)
+        for p in self.backbone.parameters(): p.requires_grad = False
+        vit_out_dim = VIT_OUT_DIM
+        self.bio_proj = nn.Linear(bio_dim, 128)
+        self.head = nn.Sequential(
+            nn.Linear(vit_out_dim + 128, 256),
+            nn.ReLU(), nn.Dropout(0.3),
+            nn.Linear(256, num_classes)
+        )
+    def embed(self, img):
+        with torch.no_grad():
+            return self.backbone(img).pooler_output
+    def forward_head(self, x_img, bio):
+        return self.fuse(x_img, self.bio_proj(bio))
+    def fuse(self, x_img, x_bio):
+        # x_bio is the projected biomarker vector, from bio_proj or a BioProjection
+        return self.head(torch.cat([x_img, x_bio], dim=1))
+    def forward_with_embedding(self, img, bio):
+        x_img = self.embed(img)
+        return x_img, self.forward_head(x_img, bio)
+    def forward(self, img, bio):
+        return self.forward_head(self.embed(img), bio)
+
+
+class FusionHead(nn.Module):
+    # bio_proj + head of DinoMLPFusion without the backbone, for backends that
+    # run the ViT elsewhere. Parameter names match the full checkpoint.
+    def __init__(self, num_classes, bio_dim):
+        super().__init__()
+        self.bio_proj = nn.Linear(bio_dim, 128)
+        self.head = nn.Sequential(
+            nn.Linear(VIT_OUT_DIM + 128, 256),
+            nn.ReLU(), nn.Dropout(0.3),
+            nn.Linear(256, num_classes)
+        )
+    def forward(self, x_img, bio):
+        return self.fuse(x_img, self.bio_proj(bio))
+    def fuse(self, x_img, x_bio):
+        return self.head(torch.cat([x_img, x_bio], dim=1))
+
+    @classmethod
+    def from_state_dict(cls, state, num_classes, bio_dim):
+        head = cls(num_classes, bio_dim)
+        head.load_state_dict({k: v for k, v in state.items() if not k.startswith("backbone.")})
+        return head.eval()
+
+
+def load_mappings(lbl_map_path="lbl_map.pkl", bm_feat_cols_path="bm_feat_cols.pkl"):
+    with open(lbl_map_path, "rb") as f: lbl_map = pickle.load(f)
+    idx_to_subtype = {v: k for k, v in lbl_map.items()}
+    with open(bm_feat_cols_path, "rb") as f: bm_feat_cols = pickle.load(f)
+    return lbl_map, bm_feat_cols, idx_to_subtype
+
+
+def load_torch_model(num_classes, bio_dim, checkpoint=CHECKPOINT_PATH, attn_implementation="sdpa"):
+    model = DinoMLPFusion(num_classes=num_classes, bio_dim=bio_dim,
+                          attn_implementation=attn_implementation)
+    model.load_state_dict(torch.load(checkpoint, map_location="cpu"))
+    return model.eval()
+
+
+def load_model_and_mappings(backend="torch", checkpoint=CHECKPOINT_PATH, onnx_path=None,
+                            precision="fp32", calibration_dir=None, compile_mode="eager",
+                            warmup_batch_sizes=(1,), bundle_dir=None):
+    from utils.backends import make_backend
+    from utils.bundle import is_bundle, load_bundle_mappings
+    from utils.compiled import compile_with_fallback
+
+    if is_bundle(bundle_dir):
+        lbl_map, bm_feat_cols, idx_to_subtype = load_bundle_mappings(bundle_dir)
+    else:
+        lbl_map, bm_feat_cols, idx_to_subtype = load_mappings()
+        bundle_dir = None
+    model = make_backend(backend, len(lbl_map), len(bm_feat_cols), checkpoint, onnx_path,
+                         precision, calibration_dir, bundle_dir)
+    model = compile_with_fallback(model, compile_mode, warmup_batch_sizes)
+    return model, bm_feat_cols, idx_to_subtype
@@ -0,0 +1,78 @@
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from utils.model import CHECKPOINT_PATH, load_mappings, load_torch_model
+from utils.preprocessing import IMAGE_SIZE
+
+
+class _ExportWrapper(nn.Module):
+    # Exposes the embedding as a second output so the ONNX backend can feed
+    # the per-image embedding cache, and skips the no_grad block in embed()
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image, bio):
+        x_img = self.model.backbone(image).pooler_output
+        return self.model.forward_head(x_img, bio), x_img
+
+
+def export_onnx(model, path, opset=17):
+    model = model.eval()
+    bio_dim = model.bio_proj.in_features
+    dummy = (torch.randn(2, 3, IMAGE_SIZE, IMAGE_SIZE), torch.zeros(2, bio_dim))
+    with torch.no_grad():
+        torch.onnx.export(
+            _ExportWrapper(model), dummy, path,
+            input_names=["image", "bio"], output_names=["logits", "embedding"],
+            dynamic_axes={"image": {0: "batch"}, "bio": {0: "batch"},
+                          "logits": {0: "batch"}, "embedding": {0: "batch"}},
+            opset_version=opset, dynamo=False,
+        )
+    return path
+
+
+def check_parity(model, backend, batch_sizes=(1, 4), atol=1e-4, seed=0):
+    # Max |eager - backend| over random images and one-hot biomarker vectors
+    gen = torch.Generator().manual_seed(seed)
+    bio_dim = model.bio_proj.in_features
+    worst = 0.0
+    for n in batch_sizes:
+        img = torch.randn(n, 3, IMAGE_SIZE, IMAGE_SIZE, generator=gen)
+        bio = torch.zeros(n, bio_dim)
+        bio[torch.arange(n), torch.randint(0, bio_dim, (n,), generator=gen)] = 1.0
+        with torch.no_grad():
+            ref = model(img, bio)
+        got = backend(img, bio)
+        worst = max(worst, float((ref - got).abs().max()))
+        if not np.array_equal(ref.argmax(1).numpy(), got.argmax(1).numpy()):
+            raise AssertionError(f"Top-1 mismatch at batch size {n}")
+    if worst > atol:
+        raise AssertionError(f"Max logit delta {worst:.2e} exceeds {atol:.0e}")
+    return worst
+
+
+def main():
+    from utils.backends import OnnxBackend
+    from utils.model import FusionHead
+
+    parser = argparse.ArgumentParser(description="Export DinoMLPFusion to ONNX and check parity")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--out", default="dino_model.onnx")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    lbl_map, bm_feat_cols, _ = load_mappings()
+    model = load_torch_model(len(lbl_map), len(bm_feat_cols), args.checkpoint)
+    export_onnx(model, args.out, args.opset)
+    head = FusionHead.from_state_dict(model.state_dict(), len(lbl_map), len(bm_feat_cols))
+    delta = check_parity(model, OnnxBackend(args.out, head), atol=args.atol)
+    print(f"Exported {args.out} (max logit delta vs eager: {delta:.2e})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+DISPLAY_MAX_SIDE = 1600
+
+# Jet colormap as a 256-entry RGB lookup table (OpenCV builds it in BGR)
+JET_LUT = cv2.applyColorMap(np.arange(256, dtype=np.uint8)[:, None], cv2.COLORMAP_JET)[:, 0, ::-1].copy()
+
+
+def display_size(size, max_side=DISPLAY_MAX_SIDE):
+    width, height = size
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def colorize(grid, size, lut=JET_LUT):
+    # grid is the low-res map in [0, 1]; only the upsampled uint8 index image
+    # and its LUT lookup are ever allocated at the target size
+    heat = cv2.resize(np.asarray(grid, dtype=np.float32), size, interpolation=cv2.INTER_LINEAR)
+    return lut[np.clip(heat * 255 + 0.5, 0, 255).astype(np.uint8)]
+
+
+def blend(base, colored, alpha=0.45):
+    # uint8 blend in 8.8 fixed point: one uint16 temporary, no float image
+    a = int(round(alpha * 256))
+    out = base.astype(np.uint16) * (256 - a)
+    out += colored.astype(np.uint16) * a
+    return (out >> 8).astype(np.uint8)
+
+
+def render_overlay(image, grid, max_side=DISPLAY_MAX_SIDE, alpha=0.45):
+    # The slide is reduced straight to display resolution (PIL shrinks by
+    # integer factors first), so cost scales with the screen, not the upload
+    size = display_size(image.size, max_side)
+    base = image if image.mode == 'RGB' else image.convert('RGB')
+    if base.size != size:
+        base = base.resize(size, Image.BILINEAR, reducing_gap=2.0)
+    return Image.fromarray(blend(np.asarray(base), colorize(grid, size), alpha))
+
+
+def render_overlay_tiled(image, grid, alpha=0.45, tile=2048, out=None):
+    # Full-resolution overlay built one tile at a time: every tile samples the
+    # grid with the same pixel-centre mapping cv2.resize uses, so seams are
+    # invisible, and only one tile of temporaries is alive. `out` may be an
+    # np.memmap to keep even the result off the heap.
+    width, height = image.size
+    grid = np.asarray(grid, dtype=np.float32)
+    gh, gw = grid.shape
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+    src = image.convert('RGB') if image.mode != 'RGB' else image
+    for y0 in range(0, height, tile):
+        y1 = min(y0 + tile, height)
+        ys = ((np.arange(y0, y1, dtype=np.float32) + 0.5) * gh / height - 0.5)
+        for x0 in range(0, width, tile):
+            x1 = min(x0 + tile, width)
+            xs = ((np.arange(x0, x1, dtype=np.float32) + 0.5) * gw / width - 0.5)
+            map_x, map_y = np.meshgrid(xs, ys)
+            heat = cv2.remap(grid, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            colored = JET_LUT[np.clip(heat * 255 + 0.5, 0, 255).astype(np.uint8)]
+            out[y0:y1, x0:x1] = blend(np.asarray(src.crop((x0, y0, x1, y1))), colored, alpha)
+    return out
+
+
+def _ellipse_overlay(original_image):
+    # The random-hotspot renderer create_gradcam_overlay used to be, kept only
+    # as the benchmark baseline
+    from PIL import ImageDraw, ImageFilter
+
+    width, height = original_image.size
+    heatmap = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(heatmap)
+    rng = np.random.RandomState(42)
+    for _ in range(rng.randint(3, 7)):
+        cx = rng.randint(width // 4, 3 * width // 4)
+        cy = rng.randint(height // 4, 3 * height // 4)
+        radius = rng.randint(20, min(width, height) // 8)
+        intensity = rng.uniform(0.3, 0.8)
+        for r in range(radius, 0, -2):
+            alpha = int(255 * intensity * (radius - r) / radius)
+            draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=(255, int(255 * (1 - intensity)), 0, alpha))
+    heatmap = heatmap.filter(ImageFilter.GaussianBlur(radius=3))
+    return Image.alpha_composite(original_image.convert('RGBA'), heatmap).convert('RGB')
+
+
+def _pil_float_overlay(image, grid, alpha=0.45):
+    # Full-resolution float upsample + Image.blend, the first real-map renderer
+    values = Image.fromarray(np.asarray(grid, dtype=np.float32), mode='F').resize(image.size, Image.BILINEAR)
+    x = np.clip(np.asarray(values), 0, 1)[..., None]
+    rgb = np.clip(1.5 - np.abs(4 * x - np.array([3, 2, 1])), 0, 1)
+    return Image.blend(image.convert('RGB'), Image.fromarray((rgb * 255).astype(np.uint8), 'RGB'), alpha)
+
+
+CASES = {
+    'ellipses': lambda img, grid: _ellipse_overlay(img),
+    'pil-float': _pil_float_overlay,
+    'display': render_overlay,
+    'tiled': render_overlay_tiled,
+}
+
+
+def _reset_peak_rss():
+    # Linux resets VmHWM on writing 5 to clear_refs; elsewhere the peak stays
+    # the process lifetime maximum, which is why every case gets a process
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_case(case, size):
+    img = Image.fromarray(np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8))
+    grid = np.random.default_rng(1).random((14, 14), dtype=np.float32)
+    _reset_peak_rss()
+    base = _peak_rss_mb()
+    start = time.perf_counter()
+    CASES[case](img, grid)
+    elapsed = time.perf_counter() - start
+    return {'case': case, 'size': size, 'seconds': elapsed, 'peak_extra_mb': _peak_rss_mb() - base}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark heatmap overlay renderers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2048, 8192])
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(_run_case(args.case, args.size)))
+        return
+    print(f"{'case':<10} {'size':>6} {'seconds':>9} {'peak +MB':>9}")
+    for size in args.sizes:
+        for case in args.cases:
+            proc = subprocess.run([sys.executable, "-m", "utils.overlay", "--case", case, "--size", str(size)],
+                                  capture_output=True, text=True, check=True)
+            r = json.loads(proc.stdout)
+            print(f"{case:<10} {size:>6} {r['seconds']:>9.3f} {r['peak_extra_mb']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
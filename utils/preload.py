@@ -0,0 +1,38 @@
+import logging
+import sys
+import threading
+
+from utils.metrics import start_metrics_server
+
+log = logging.getLogger(__name__)
+
+_thread = None
+_lock = threading.Lock()
+
+
+def _preload():
+    try:
+        from utils.inference import get_runtime
+        get_runtime()
+    except Exception as e:
+        # The next real prediction retries the load and surfaces the error there
+        log.warning("Background model preload failed: %s", e)
+
+
+def start_inference_preload():
+    # Call after the page has been drawn: imports torch/transformers and loads
+    # the model on a daemon thread so the first prediction does not pay for it.
+    # The Prometheus endpoint (utils.metrics) starts with it, once per process.
+    global _thread
+    start_metrics_server()
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_preload, name="inference-preload", daemon=True)
+            _thread.start()
+    return _thread
+
+
+def inference_ready():
+    # The module may still be mid-import on the preload thread
+    is_ready = getattr(sys.modules.get("utils.inference"), "is_ready", None)
+    return is_ready is not None and is_ready()
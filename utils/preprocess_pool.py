@@ -0,0 +1,147 @@
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from utils.preprocessing import normalize_into, resize, to_rgb
+from utils.tiling import is_background, tile_grid
+
+
+# Worker-side attachments, keyed by shared memory block name
+_attached = {}
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track flag; the parent owns and unlinks the block
+        return shared_memory.SharedMemory(name=name)
+
+
+def _view(name, shape, dtype):
+    if name not in _attached:
+        _attached[name] = _attach(name)
+    return np.ndarray(shape, dtype=dtype, buffer=_attached[name].buf)
+
+
+def _release_except(keep):
+    for name in [n for n in _attached if n not in keep]:
+        _attached.pop(name).close()
+
+
+def _fill_tiles(src_name, src_shape, ring_name, ring_shape, jobs, out_size,
+                skip_background, threshold, min_tissue):
+    _release_except({src_name, ring_name})
+    src = _view(src_name, src_shape, np.uint8)
+    ring = _view(ring_name, ring_shape, np.float32)
+    kept = []
+    for slot, (x0, y0, x1, y1) in jobs:
+        tile = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+        part = src[y0:y1, x0:x1]
+        tile[:part.shape[0], :part.shape[1]] = part
+        # The serial tiler's test, so the kept tiles do not depend on whether
+        # the pool is in use (it is off on small machines)
+        if skip_background and is_background(Image.fromarray(tile), threshold, min_tissue):
+            kept.append(False)
+            continue
+        # Same resize + fused normalise as transform_dino, written straight into the ring slot
+        normalize_into(resize(tile, out_size), ring[slot])
+        kept.append(True)
+    return kept
+
+
+class PreprocessPool:
+    # Process pool that crops, resizes and normalises tiles into a shared-memory
+    # ring of float32 slots. Each ring holds `depth` batches; a batch region is
+    # refilled only after the consumer has moved on to the next one.
+    def __init__(self, workers=None, batch_size=32, depth=3, out_size=224, chunk=4):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.batch_size = batch_size
+        self.depth = depth
+        self.out_size = out_size
+        self.chunk = chunk
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=mp.get_context('spawn'))
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _share_image(self, img):
+        img = to_rgb(img)
+        w, h = img.size
+        shm = shared_memory.SharedMemory(create=True, size=w * h * 3)
+        arr = np.ndarray((h, w, 3), dtype=np.uint8, buffer=shm.buf)
+        # Copy in horizontal bands so we never hold a second full-size array
+        for y in range(0, h, 1024):
+            arr[y:y + 1024] = np.asarray(img.crop((0, y, w, min(h, y + 1024))))
+        del arr
+        return shm, (h, w, 3)
+
+    def _submit(self, src, src_shape, ring, ring_shape, region, boxes, skip_background,
+                threshold, min_tissue):
+        base = region * self.batch_size
+        jobs = [(base + i, box) for i, box in enumerate(boxes)]
+        return [self._executor.submit(_fill_tiles, src.name, src_shape, ring.name, ring_shape,
+                                      jobs[i:i + self.chunk], self.out_size, skip_background,
+                                      threshold, min_tissue)
+                for i in range(0, len(jobs), self.chunk)]
+
+    def iter_tile_batches(self, img, tile_size=224, overlap=0.25, skip_background=True,
+                          threshold=220, min_tissue=0.1):
+        # Imported here so spawned workers never pay for loading torch
+        import torch
+
+        boxes = list(tile_grid(img.size[0], img.size[1], tile_size, overlap))
+        batches = [boxes[i:i + self.batch_size] for i in range(0, len(boxes), self.batch_size)]
+        ring_shape = (self.depth * self.batch_size, 3, self.out_size, self.out_size)
+        src, src_shape = self._share_image(img)
+        ring = shared_memory.SharedMemory(create=True, size=int(np.prod(ring_shape)) * 4)
+        ring_arr = np.ndarray(ring_shape, dtype=np.float32, buffer=ring.buf)
+        pending = {}
+        try:
+            for b in range(min(self.depth, len(batches))):
+                pending[b] = self._submit(src, src_shape, ring, ring_shape, b % self.depth,
+                                          batches[b], skip_background, threshold, min_tissue)
+            for b, batch_boxes in enumerate(batches):
+                kept = [k for fut in pending.pop(b) for k in fut.result()]
+                base = (b % self.depth) * self.batch_size
+                # Zero-copy view onto the shared ring; compacted only if tiles were dropped
+                tiles = torch.from_numpy(ring_arr[base:base + len(batch_boxes)])
+                if not all(kept):
+                    idx = [i for i, k in enumerate(kept) if k]
+                    tiles = tiles[idx] if idx else None
+                if tiles is not None:
+                    yield tiles, [box for box, k in zip(batch_boxes, kept) if k]
+                    del tiles
+                nxt = b + self.depth
+                if nxt < len(batches):
+                    pending[nxt] = self._submit(src, src_shape, ring, ring_shape, nxt % self.depth,
+                                                batches[nxt], skip_background, threshold, min_tissue)
+        finally:
+            for futs in pending.values():
+                for fut in futs:
+                    fut.cancel()
+            for futs in pending.values():
+                for fut in futs:
+                    if not fut.cancelled():
+                        try:
+                            fut.result()
+                        except Exception:
+                            pass
+            del ring_arr
+            for shm in (src, ring):
+                try:
+                    shm.close()
+                except BufferError:
+                    # a caller still holds a tensor view; the mapping goes with it
+                    pass
+                shm.unlink()
@@ -0,0 +1,207 @@
+import argparse
+import io
+import os
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageCms
+
+IMAGE_SIZE = 224
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+# (x/255 - mean)/std folded into one multiply-add per channel
+SCALE = 1.0 / (255.0 * STD)
+BIAS = -MEAN / STD
+# BCR_RESAMPLE=cv2 trades bit-parity with the training transform for speed
+RESAMPLE = os.environ.get("BCR_RESAMPLE", "pil")
+
+_SRGB = None
+
+
+def to_rgb(img):
+    # Uploads come as RGBA/LA/P (transparency), L/I;16 (grayscale scans) or
+    # CMYK, sometimes with an embedded ICC profile; the model wants sRGB
+    global _SRGB
+    icc = img.info.get("icc_profile")
+    if icc and img.mode in ("RGB", "RGBA", "CMYK"):
+        try:
+            if _SRGB is None:
+                _SRGB = ImageCms.createProfile("sRGB")
+            src = ImageCms.ImageCmsProfile(io.BytesIO(icc))
+            img = ImageCms.profileToProfile(img, src, _SRGB, outputMode="RGBA" if img.mode == "RGBA" else "RGB")
+        except (ImageCms.PyCMSError, OSError):
+            pass  # a broken profile is not worth failing the upload for
+    if img.mode == "P":
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+    if img.mode in ("RGBA", "LA", "PA"):
+        # Transparent areas become white, i.e. background glass, not black tissue
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img.convert("RGBA"), mask=img.getchannel("A"))
+        return background
+    if img.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+        arr = np.asarray(img, dtype=np.float32)
+        hi = arr.max() or 1.0
+        img = Image.fromarray((arr * (255.0 / hi)).astype(np.uint8))
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+
+def open_image(src, size=IMAGE_SIZE, resample=None):
+    # Path or bytes -> PIL image. For the cv2 resampler, JPEGs are decoded at
+    # a reduced DCT scale when that still leaves at least `size` pixels.
+    img = Image.open(src if isinstance(src, (str, os.PathLike)) else io.BytesIO(src))
+    if (resample or RESAMPLE) == "cv2" and img.format == "JPEG":
+        img.draft("RGB", (size, size))
+    return img
+
+
+def resize(img, size=IMAGE_SIZE, resample=None):
+    # RGB PIL image or uint8 array -> uint8 (size, size, 3).
+    #   pil: PIL's antialiased bilinear, bit-identical to transforms.Resize,
+    #        i.e. to what the checkpoint was trained on
+    #   cv2: integer box reduction in PIL (no full-size NumPy copy), then
+    #        cv2 INTER_AREA; faster on large uploads but not bit-identical
+    resample = resample or RESAMPLE
+    if isinstance(img, np.ndarray):
+        if img.shape[:2] == (size, size):
+            return img
+        if resample != "cv2":
+            return np.asarray(Image.fromarray(img).resize((size, size), Image.BILINEAR))
+    elif img.size == (size, size):
+        return np.asarray(img)
+    elif resample != "cv2":
+        return np.asarray(img.resize((size, size), Image.BILINEAR))
+    else:
+        factor = min(img.size) // (2 * size)
+        img = np.asarray(img.reduce(factor) if factor > 1 else img)
+    h, w = img.shape[:2]
+    interp = cv2.INTER_AREA if w > size and h > size else cv2.INTER_LINEAR
+    return cv2.resize(img, (size, size), interpolation=interp)
+
+
+def _normalize_numpy(src, out):
+    np.multiply(src.transpose(2, 0, 1), SCALE.reshape(3, 1, 1), out=out)
+    out += BIAS.reshape(3, 1, 1)
+
+
+def _make_numba_kernel():
+    from numba import njit
+
+    # Serial on purpose: a 224x224 image is ~0.1 ms of work, callers already
+    # run in parallel threads, and numba's parallel threading layers either
+    # reject concurrent callers (workqueue) or hang at exit (tbb)
+    @njit(fastmath=True, cache=True, nogil=True)
+    def kernel(src, out, scale, bias):
+        # HWC uint8 -> CHW float32 with scale+shift in a single pass
+        h, w = src.shape[0], src.shape[1]
+        for y in range(h):
+            for x in range(w):
+                for c in range(3):
+                    out[c, y, x] = src[y, x, c] * scale[c] + bias[c]
+    return kernel
+
+
+_kernel = None
+
+
+def normalize_into(src, out):
+    # numba when available (compiled once, cached on disk), NumPy otherwise.
+    # BCR_NUMBA=0 forces the NumPy path.
+    global _kernel
+    if _kernel is None:
+        _kernel = _normalize_numpy
+        if os.environ.get("BCR_NUMBA", "1") != "0":
+            try:
+                _kernel = _make_numba_kernel()
+            except ImportError:
+                pass
+    if _kernel is _normalize_numpy:
+        _normalize_numpy(src, out)
+    else:
+        _kernel(np.ascontiguousarray(src), out, SCALE, BIAS)
+    return out
+
+
+def preprocess_into(img, out, size=IMAGE_SIZE, resample=None):
+    # PIL image, path, bytes or RGB uint8 array -> normalised straight into
+    # out (3, size, size); only the size x size uint8 image is ever copied
+    if isinstance(img, (str, os.PathLike, bytes, bytearray, memoryview)):
+        img = open_image(img, size, resample)
+    if not isinstance(img, np.ndarray):
+        img = to_rgb(img)
+    return normalize_into(resize(img, size, resample), out)
+
+
+def preprocess(img, size=IMAGE_SIZE, resample=None):
+    # Drop-in for the torchvision chain: one image -> (3, size, size) tensor
+    import torch
+
+    out = np.empty((3, size, size), dtype=np.float32)
+    return torch.from_numpy(preprocess_into(img, out, size, resample))
+
+
+def preprocess_batch(images, out=None, size=IMAGE_SIZE, resample=None):
+    # Fills a preallocated (N, 3, size, size) buffer; the returned tensor
+    # shares its memory, so reusing `out` across batches never reallocates
+    import torch
+
+    if out is None:
+        out = np.empty((len(images), 3, size, size), dtype=np.float32)
+    for i, img in enumerate(images):
+        preprocess_into(img, out[i], size, resample)
+    return torch.from_numpy(out[:len(images)])
+
+
+def main():
+    import torch
+    from torchvision import transforms
+
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing against the torchvision chain")
+    parser.add_argument("--images", help="directory of local slide images (default: synthetic)")
+    parser.add_argument("--limit", type=int, default=32)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 2048], help="synthetic image sides")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    reference = transforms.Compose([
+        transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)), transforms.ToTensor(),
+        transforms.Normalize(mean=MEAN.tolist(), std=STD.tolist())])
+    if args.images:
+        names = sorted(f for f in os.listdir(args.images)
+                       if f.lower().endswith((".jpg", ".jpeg", ".png", ".tif", ".tiff")))[:args.limit]
+        sets = {"files": [Image.open(os.path.join(args.images, f)) for f in names]}
+        for imgs in sets.values():
+            for img in imgs:
+                img.load()
+    else:
+        rng = np.random.default_rng(0)
+        sets = {}
+        for side in args.sizes:
+            # Smoothed noise looks more like tissue than white noise does
+            base = rng.integers(0, 256, (side // 8, side // 8, 3), dtype=np.uint8)
+            arr = cv2.resize(base, (side, side), interpolation=cv2.INTER_CUBIC)
+            sets[f"{side}px"] = [Image.fromarray(arr)] * 8
+    sets = {k: [to_rgb(i) for i in v] for k, v in sets.items()}
+
+    def timed(fn, imgs):
+        best = float("inf")
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            fn(imgs)
+            best = min(best, time.perf_counter() - start)
+        return best / len(imgs) * 1000
+
+    preprocess_batch(sets[next(iter(sets))][:1])  # compile the numba kernel outside the timing
+    print(f"{'set':<8} {'resize':<7} {'torchvision':>12} {'fused':>9} {'speedup':>8} {'max |diff|':>11} {'mean |diff|':>12}")
+    for name, imgs in sets.items():
+        out = np.empty((len(imgs), 3, IMAGE_SIZE, IMAGE_SIZE), dtype=np.float32)
+        ref = torch.stack([reference(x) for x in imgs])
+        ref_ms = timed(lambda xs: torch.stack([reference(x) for x in xs]), imgs)
+        for resample in ("pil", "cv2"):
+            new_ms = timed(lambda xs: preprocess_batch(xs, out, resample=resample), imgs)
+            diff = (ref - preprocess_batch(imgs, out, resample=resample)).abs()
+            print(f"{name:<8} {resample:<7} {ref_ms:>10.2f}ms {new_ms:>7.2f}ms {ref_ms / new_ms:>7.1f}x "
+                  f"{diff.max().item():>11.2e} {diff.mean().item():>12.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import gc
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from utils.model import CHECKPOINT_PATH, load_mappings, transform_dino
+from utils.quantization import load_calibration_images
+from utils.metrics import current_rss_mb
+
+
+def _weights_mb(backend):
+    if hasattr(backend, "onnx_path"):
+        return os.path.getsize(backend.onnx_path) / 2**20
+    buf = io.BytesIO()
+    torch.save(backend.model.state_dict(), buf)
+    return buf.tell() / 2**20
+
+
+def _run(backend, images, bios, batch_size):
+    probs, latencies = [], []
+    with torch.no_grad():
+        for i in range(0, len(images), batch_size):
+            img = torch.from_numpy(np.stack(images[i:i + batch_size]))
+            start = time.perf_counter()
+            logits = backend(img, bios[i:i + batch_size])
+            latencies.append((time.perf_counter() - start) / img.shape[0])
+            probs.append(torch.softmax(logits, dim=1).numpy())
+    return np.concatenate(probs), np.array(latencies) * 1000
+
+
+def drift_report(ref_probs, probs, idx_to_subtype):
+    ref_top, top = ref_probs.argmax(1), probs.argmax(1)
+    labels = [idx_to_subtype[i] for i in range(ref_probs.shape[1])]
+    confusion = pd.crosstab(pd.Categorical([labels[i] for i in ref_top], labels),
+                            pd.Categorical([labels[i] for i in top], labels),
+                            rownames=["fp32"], colnames=["quantized"], dropna=False)
+    return {
+        "top1_agreement": float((ref_top == top).mean()),
+        "max_prob_delta": float(np.abs(ref_probs - probs).max()),
+        "mean_prob_delta": float(np.abs(ref_probs - probs).mean()),
+        "confusion": confusion,
+    }
+
+
+def main():
+    from utils.backends import make_backend
+
+    parser = argparse.ArgumentParser(description="Compare a quantized DinoMLPFusion against fp32")
+    parser.add_argument("--images", required=True, help="directory of local slide images")
+    parser.add_argument("--precision", default="int8", choices=["int8", "int8-static"])
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx"])
+    parser.add_argument("--calibration-dir", help="int8-static calibration images; must not be --images")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--limit", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=1)
+    args = parser.parse_args()
+
+    # Calibrating on the images being scored would make the drift look smaller
+    # than it is on unseen slides
+    if args.precision == "int8-static":
+        if not args.calibration_dir:
+            parser.error("--calibration-dir is required for int8-static")
+        if os.path.realpath(args.calibration_dir) == os.path.realpath(args.images):
+            parser.error("--calibration-dir must hold other images than --images")
+
+    lbl_map, bm_feat_cols, idx_to_subtype = load_mappings()
+    images = load_calibration_images(args.images, transform_dino, limit=args.limit)
+    # Each image gets one biomarker/intensity/staining triple so the head sees realistic inputs
+    groups = {p: [i for i, c in enumerate(bm_feat_cols) if c.startswith(p + "_")]
+              for p in ("biomarker", "intensity", "staining")}
+    rng = np.random.default_rng(0)
+    bios = torch.zeros(len(images), len(bm_feat_cols))
+    for row in range(len(images)):
+        for cols in groups.values():
+            bios[row, rng.choice(cols)] = 1.0
+
+    rows, results = [], {}
+    for precision in ("fp32", args.precision):
+        rss_before = current_rss_mb()
+        backend = make_backend(args.backend, len(lbl_map), len(bm_feat_cols), args.checkpoint,
+                               precision=precision,
+                               calibration_dir=args.calibration_dir)
+        _run(backend, images[:2], bios[:2], args.batch_size)  # warmup
+        probs, lat = _run(backend, images, bios, args.batch_size)
+        results[precision] = probs
+        rows.append({"precision": precision, "backend": getattr(backend, "name", args.backend),
+                     "weights_mb": _weights_mb(backend),
+                     "rss_delta_mb": current_rss_mb() - rss_before,
+                     "latency_ms_p50": float(np.percentile(lat, 50)),
+                     "latency_ms_p95": float(np.percentile(lat, 95))})
+        del backend
+        gc.collect()
+
+    report = drift_report(results["fp32"], results[args.precision], idx_to_subtype)
+    print(f"Images: {len(images)}")
+    print(pd.DataFrame(rows).to_string(index=False, float_format="%.2f"))
+    print(f"\nTop-1 agreement: {report['top1_agreement']:.2%}")
+    print(f"Max prob delta:  {report['max_prob_delta']:.4f}")
+    print(f"Mean prob delta: {report['mean_prob_delta']:.4f}")
+    print("\nPer-subtype confusion (rows fp32, columns quantized):")
+    print(report["confusion"].to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+PRECISIONS = ("fp32", "int8", "int8-static")
+
+
+def quantize_backbone_dynamic(model):
+    # Weights stored as int8, activations quantised per batch at runtime. Only
+    # the ViT Linear layers are touched; bio_proj/head are too small to matter.
+    from torch.ao.quantization import quantize_dynamic
+
+    model.backbone = quantize_dynamic(model.backbone, {nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+class _CalibrationReader:
+    def __init__(self, images, bio_dim, batch_size=8):
+        self._batches = iter([images[i:i + batch_size] for i in range(0, len(images), batch_size)])
+        self.bio_dim = bio_dim
+
+    def get_next(self):
+        batch = next(self._batches, None)
+        if batch is None:
+            return None
+        img = np.stack(batch).astype(np.float32)
+        return {"image": img, "bio": np.zeros((img.shape[0], self.bio_dim), dtype=np.float32)}
+
+
+def load_calibration_images(image_dir, transform, limit=64):
+    from PIL import Image
+
+    paths = sorted(p for p in os.listdir(image_dir)
+                   if p.lower().endswith((".jpg", ".jpeg", ".png", ".tif", ".tiff")))[:limit]
+    if not paths:
+        raise FileNotFoundError(f"No calibration images found in {image_dir}")
+    return [transform(Image.open(os.path.join(image_dir, p)).convert("RGB")).numpy() for p in paths]
+
+
+def quantize_onnx_static(fp32_path, out_path, calibration_images, bio_dim):
+    # Static INT8 needs activation ranges, so it is calibrated on real slides and
+    # applied to the exported ONNX graph rather than the eager HF model
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepped = out_path + ".prep.onnx"
+    quant_pre_process(fp32_path, prepped)
+    try:
+        quantize_static(prepped, out_path, _CalibrationReader(calibration_images, bio_dim),
+                        quant_format=QuantFormat.QDQ, activation_type=QuantType.QInt8,
+                        weight_type=QuantType.QInt8, per_channel=True,
+                        op_types_to_quantize=["MatMul", "Gemm"])
+    finally:
+        if os.path.exists(prepped):
+            os.remove(prepped)
+    return out_path
@@ -0,0 +1,305 @@
+import argparse
+import io
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+from utils.cache import BoundedLRUCache
+from utils.history import get_history
+from utils.jobs import JobManager
+from utils.metrics import get_metrics, timed
+
+# Reports render on their own small pool so a bulk export never holds up
+# predictions on the shared JobManager
+REPORT_WORKERS = int(os.environ.get("BCR_REPORT_WORKERS", 2))
+# A4 portrait, in inches
+PAGE_SIZE = (8.27, 11.69)
+COLORS = ['#FF6B9D', '#4ECDC4', '#45B7D1', '#96CEB4']
+OPTIONS = ("gradcam", "biomarkers", "recommendations", "confidence")
+
+SUBTYPE_NOTES = {
+    'IDC': "Most common breast cancer type. Generally responds well to standard treatments.",
+    'TNBC': "Aggressive subtype lacking hormone receptors. May require intensive chemotherapy.",
+    'MBC': "Rare and aggressive. Often requires specialized treatment protocols.",
+    'ILC': "Grows in single-file pattern. May require additional imaging for staging."
+}
+INTENSITY_SCORES = {'Weak': 1, 'Moderate': 2, 'Strong': 3}
+DISCLAIMER = ("Research prototype. Model output must be reviewed by a qualified pathologist "
+              "and is not a diagnosis.")
+
+
+def report_key(results, options):
+    # Stored analyses never change, so their id and the chosen sections
+    # identify the PDF. With the history off it is the prediction cache key,
+    # which covers the biomarkers, model and mode, not just the image.
+    rid = results.get('history_id')
+    rid = f"id{rid}" if rid is not None else results.get('prediction_key')
+    if rid is None:
+        return None
+    return f"{rid}:" + ",".join(sorted(k for k in OPTIONS if options.get(k)))
+
+
+def _figure():
+    # matplotlib is only imported once a report is rendered; plain Figures
+    # carry no pyplot state, so reports render safely in parallel threads
+    from matplotlib.figure import Figure
+
+    return Figure(figsize=PAGE_SIZE)
+
+
+def _image(data):
+    return np.asarray(Image.open(io.BytesIO(data)).convert("RGB")) if data else None
+
+
+def _header(fig, results, title):
+    created = results.get('created')
+    when = datetime.fromtimestamp(created) if created else datetime.now()
+    analysis = f"Analysis #{results['history_id']}" if results.get('history_id') is not None else "Analysis"
+    fig.text(0.08, 0.955, title, fontsize=16, weight="bold")
+    fig.text(0.08, 0.935, f"{analysis} • {results.get('filename') or 'upload'} • {when:%Y-%m-%d %H:%M}",
+             fontsize=9, color="#4a5568")
+    fig.text(0.08, 0.045, f"Model {results.get('model_version') or 'unknown'}", fontsize=7, color="#718096")
+    fig.text(0.08, 0.03, DISCLAIMER, fontsize=7, color="#718096")
+
+
+def _summary_page(results, options):
+    fig = _figure()
+    _header(fig, results, "Breast Cancer Subtype Analysis")
+    lines = [f"Predicted subtype: {results['subtype']} ({results['confidence']:.1%})"]
+    mode = "tiled whole image" if results.get('tiled') else "single view"
+    tta = results.get('tta')
+    if tta:
+        mode = (f"{tta['views']} augmented views ({tta['mode']}), {tta['agreement']:.0%} agree, "
+                f"disagreement {tta['disagreement']:.3f}")
+    lines.append(f"Inference: {mode}")
+    width, height = results.get('image_size') or (None, None)
+    if width:
+        lines.append(f"Image: {width}×{height} px")
+    for i, line in enumerate(lines):
+        fig.text(0.08, 0.89 - i * 0.025, line, fontsize=11, weight="bold" if i == 0 else "normal")
+
+    preview = _image(results.get('preview'))
+    if preview is not None:
+        ax = fig.add_axes([0.08, 0.42, 0.84, 0.38])
+        ax.imshow(preview)
+        ax.set_title("Submitted image", fontsize=10)
+        ax.axis("off")
+
+    ax = fig.add_axes([0.08, 0.2, 0.84, 0.18])
+    ax.axis("off")
+    rows = sorted(results['predictions'].items(), key=lambda x: x[1], reverse=True)
+    table = ax.table(cellText=[[s, f"{p:.1%}"] for s, p in rows], colLabels=["Subtype", "Probability"],
+                     loc="upper center", cellLoc="center")
+    table.scale(1, 1.4)
+
+    if options.get("recommendations"):
+        note = SUBTYPE_NOTES.get(results['subtype'], "")
+        fig.text(0.08, 0.15, f"{results['subtype']} - Clinical Notes", fontsize=11, weight="bold")
+        fig.text(0.08, 0.125, note, fontsize=9, wrap=True)
+    return fig
+
+
+def _confidence_page(results):
+    fig = _figure()
+    _header(fig, results, "Subtype Classification Probabilities")
+    ax = fig.add_axes([0.12, 0.5, 0.8, 0.38])
+    subtypes, probs = list(results['predictions']), list(results['predictions'].values())
+    bars = ax.bar(subtypes, probs, color=COLORS[:len(subtypes)])
+    ax.bar_label(bars, labels=[f"{p:.1%}" for p in probs], fontsize=9)
+    ax.set_ylim(0, 1)
+    ax.set_ylabel("Confidence Score")
+    ax.set_xlabel("Cancer Subtype")
+    ax.yaxis.set_major_formatter(lambda v, _: f"{v:.0%}")
+    tta = results.get('tta')
+    if tta and tta.get('per_view'):
+        ax = fig.add_axes([0.12, 0.12, 0.8, 0.25])
+        ax.bar(range(1, len(tta['per_view']) + 1), tta['per_view'], color="#45B7D1")
+        ax.set_title("Per-view distance from the averaged prediction (TTA)", fontsize=10)
+        ax.set_xlabel("View")
+        ax.set_ylabel("Total variation")
+    return fig
+
+
+def _biomarker_page(results):
+    fig = _figure()
+    _header(fig, results, "Biomarker Expression")
+    biomarkers = results.get('biomarkers') or {}
+    markers = list(biomarkers)
+    if not markers:
+        fig.text(0.08, 0.85, "No biomarkers were entered for this analysis.", fontsize=11)
+        return fig
+    scores = [INTENSITY_SCORES.get(biomarkers[m]['intensity'].strip(), 0) for m in markers]
+    ax = fig.add_axes([0.2, 0.76, 0.64, 0.08])
+    im = ax.imshow([scores], cmap="RdYlBu_r", vmin=1, vmax=3, aspect="auto")
+    ax.set_xticks(range(len(markers)), markers)
+    ax.set_yticks([0], ["Expression Level"])
+    for i, m in enumerate(markers):
+        ax.text(i, 0, biomarkers[m]['staining'], ha="center", va="center", fontsize=8)
+    cbar = fig.colorbar(im, cax=fig.add_axes([0.86, 0.76, 0.02, 0.08]), ticks=[1, 2, 3])
+    cbar.ax.set_yticklabels(['Weak', 'Moderate', 'Strong'], fontsize=8)
+
+    ax = fig.add_axes([0.08, 0.4, 0.84, 0.3])
+    ax.axis("off")
+    ax.table(cellText=[[m, biomarkers[m]['intensity'], f"{s}/3", biomarkers[m]['staining']]
+                       for m, s in zip(markers, scores)],
+             colLabels=["Biomarker", "Intensity", "Score", "Staining"], loc="upper center", cellLoc="center")
+    return fig
+
+
+def _explanation_page(results):
+    fig = _figure()
+    explanation = results.get('explanation') or {}
+    _header(fig, results, "Model Explanation")
+    overlay = _image(explanation.get('overlay'))
+    if overlay is None:
+        fig.text(0.08, 0.85, "No explanation map was computed for this analysis "
+                             "(enable it on the Upload page before predicting).", fontsize=10)
+        return fig
+    ax = fig.add_axes([0.08, 0.3, 0.84, 0.58])
+    ax.imshow(overlay)
+    ax.axis("off")
+    names = {'gradcam': "Grad-CAM", 'rollout': "Attention rollout"}
+    method = names.get(explanation.get('method'), explanation.get('method'))
+    ax.set_title(f"{method}: regions that drove the {results['subtype']} call", fontsize=10)
+    requested = explanation.get('requested') or explanation.get('method')
+    if requested != explanation.get('method'):
+        fig.text(0.08, 0.26, f"{names.get(requested, requested)} was requested; the served model is not fp32, "
+                             f"so this is {method.lower()}.", fontsize=9, color="#c05621")
+    return fig
+
+
+def _report_pages(results, options, progress):
+    # (stage, render) steps for one analysis; each yields one PDF page
+    steps = [("Summary", lambda: _summary_page(results, options))]
+    if options.get("confidence"):
+        steps.append(("Probability chart", lambda: _confidence_page(results)))
+    if options.get("biomarkers"):
+        steps.append(("Biomarker heatmap", lambda: _biomarker_page(results)))
+    if options.get("gradcam"):
+        steps.append(("Explanation overlay", lambda: _explanation_page(results)))
+    for i, (stage, render) in enumerate(steps):
+        progress(i / len(steps), stage)
+        yield render()
+
+
+def render_report(results, options=None, progress=None, pdf=None):
+    # results as load_results / run_prediction return them. Returns the PDF
+    # bytes, or appends the pages to an already open PdfPages.
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    options = {k: True for k in OPTIONS} if options is None else options
+    progress = progress or (lambda fraction, stage: None)
+    if pdf is not None:
+        for fig in _report_pages(results, options, progress):
+            pdf.savefig(fig)
+        return None
+    buf = io.BytesIO()
+    with PdfPages(buf, metadata={"Title": f"Breast cancer analysis {results.get('history_id') or ''}".strip(),
+                                 "Creator": "Breast Cancer AI"}) as pdf:
+        for fig in _report_pages(results, options, progress):
+            pdf.savefig(fig)
+        progress(1.0, "Writing PDF")
+    return buf.getvalue()
+
+
+def render_bulk(analysis_ids, options=None, progress=None):
+    # One PDF for a batch of stored analyses: an index page, then each
+    # analysis' pages. Analyses are loaded one at a time, so memory stays at
+    # a single result whatever the batch size.
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    store = get_history()
+    if store is None:
+        raise RuntimeError("bulk reports need the history store (BCR_HISTORY_DB)")
+    progress = progress or (lambda fraction, stage: None)
+    rows = store.rows(analysis_ids)
+    buf = io.BytesIO()
+    with PdfPages(buf, metadata={"Title": f"Breast cancer analyses ({len(rows)})",
+                                 "Creator": "Breast Cancer AI"}) as pdf:
+        fig = _figure()
+        fig.text(0.08, 0.955, f"Analyses in this report: {len(rows)}", fontsize=16, weight="bold")
+        fig.text(0.08, 0.03, DISCLAIMER, fontsize=7, color="#718096")
+        ax = fig.add_axes([0.08, 0.1, 0.84, 0.82])
+        ax.axis("off")
+        if rows:
+            ax.table(cellText=[[f"#{r['id']}", r['filename'] or 'upload', r['subtype'], f"{r['confidence']:.1%}",
+                                datetime.fromtimestamp(r['created']).strftime("%Y-%m-%d")] for r in rows],
+                     colLabels=["Analysis", "File", "Subtype", "Confidence", "Date"],
+                     loc="upper center", cellLoc="center")
+        pdf.savefig(fig)
+        for n, row in enumerate(rows):
+            results = store.get(row['id'])
+            if results is None:  # deleted meanwhile
+                continue
+            step = lambda f, stage: progress((n + f) / len(rows), f"Analysis {n + 1}/{len(rows)}: {stage}")
+            render_report(results, options, step, pdf)
+        progress(1.0, "Writing PDF")
+    return buf.getvalue()
+
+
+def report_job(job, results, options):
+    # JobManager body; finished PDFs are kept by report_key
+    key = report_key(results, options)
+    with timed("report"):
+        data = render_report(results, options, progress=lambda f, stage: job.update(f * 0.95, stage))
+    if key is not None:
+        get_report_cache().put(key, data)
+    return data
+
+
+def bulk_report_job(job, analysis_ids, options):
+    with timed("bulk_report"):
+        return render_bulk(analysis_ids, options, progress=lambda f, stage: job.update(f * 0.95, stage))
+
+
+_reports = None
+_cache = None
+_reports_lock = threading.Lock()
+
+
+def get_report_jobs():
+    global _reports
+    if _reports is None:
+        with _reports_lock:
+            if _reports is None:
+                _reports = JobManager(max_workers=REPORT_WORKERS, retention=16, name="reports")
+                get_metrics().add_collector(_reports.collect)
+    return _reports
+
+
+def get_report_cache():
+    # PDFs are ~0.2-1 MB; a handful per session is plenty
+    global _cache
+    if _cache is None:
+        with _reports_lock:
+            if _cache is None:
+                _cache = BoundedLRUCache(max_entries=64, max_bytes=128 * 1024 * 1024)
+    return _cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render PDF reports for stored analyses")
+    parser.add_argument("ids", nargs="*", type=int, help="analysis ids (default: the --last newest)")
+    parser.add_argument("--last", type=int, default=10)
+    parser.add_argument("--output", "-o", default="analyses_report.pdf")
+    parser.add_argument("--skip", nargs="*", default=[], choices=OPTIONS, help="sections to leave out")
+    args = parser.parse_args()
+
+    store = get_history()
+    if store is None:
+        parser.error("the history store is disabled (BCR_HISTORY_DB)")
+    ids = args.ids or [r['id'] for r in store.page(limit=args.last)]
+    options = {k: k not in args.skip for k in OPTIONS}
+    start = time.perf_counter()
+    data = render_bulk(ids, options, progress=lambda f, stage: print(f"\r{f:4.0%} {stage:<50}", end="", flush=True))
+    with open(args.output, "wb") as f:
+        f.write(data)
+    print(f"\n{len(ids)} analyses, {len(data) / 1024:.0f} KB in {time.perf_counter() - start:.1f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Every analysed image's 384-d embedding is kept so later analyses can show
+# the most similar previous cases. BCR_INDEX_DIR="" turns the index off.
+INDEX_DIR = os.environ.get("BCR_INDEX_DIR", "case_index")
+DIM = 384
+# Rows scored per step of a brute-force scan: 8192 x 384 int8 is 3MB of
+# mapped pages and a 12MB float32 temporary, whatever the index size
+CHUNK_ROWS = 8192
+# IVF partitions scored per search (python -m utils.retrieval bench: recall@5
+# is ~1.0 at 16 of ~1800 lists on 200k clustered vectors)
+NPROBE = 16
+
+VECTORS_FILE = "vectors.i8"
+SCALES_FILE = "scales.f4"
+META_FILE = "meta.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    row INTEGER PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    subtype TEXT,
+    confidence REAL,
+    probabilities TEXT,
+    biomarkers TEXT,
+    created REAL,
+    UNIQUE (image_hash, kind)
+)
+"""
+
+
+def quantize(vectors):
+    # L2-normalise, then symmetric int8 per vector: v ~= q * scale, so a
+    # cosine against a unit query is (q . query) * scale
+    v = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    v = v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+    scale = np.maximum(np.abs(v).max(axis=1), 1e-12) / 127.0
+    q = np.clip(np.rint(v / scale[:, None]), -127, 127).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+
+def _unit(vector):
+    v = np.asarray(vector, dtype=np.float32).reshape(-1)
+    return v / max(float(np.linalg.norm(v)), 1e-12)
+
+
+def _top_k(scores, rows, k):
+    if len(scores) <= k:
+        order = np.argsort(-scores)
+    else:
+        part = np.argpartition(-scores, k)[:k]
+        order = part[np.argsort(-scores[part])]
+    return scores[order], rows[order]
+
+
+class CaseIndex:
+    # Append-only: int8 codes and their scales are raw files that are only
+    # ever memory-mapped for reading, metadata lives in SQLite keyed by the
+    # vector's row number. A row's vector is written before its metadata
+    # commits, so vectors past the last metadata row are a crashed append
+    # and get truncated away by the next writer.
+    def __init__(self, path=INDEX_DIR, dim=DIM):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, META_FILE), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(SCHEMA)
+        self._mapped = (0, None, None)
+        self._ivf = None
+        self._ivf_mtime = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def __len__(self):
+        with self._lock:
+            row = self._db.execute("SELECT MAX(row) FROM cases").fetchone()[0]
+        return 0 if row is None else row + 1
+
+    def _arrays(self, n):
+        # Re-mapped only when other writers (threads or processes) have grown
+        # the index; mapping is lazy, pages are read as searches touch them
+        if self._mapped[0] != n:
+            if n == 0:
+                self._mapped = (0, np.empty((0, self.dim), np.int8), np.empty(0, np.float32))
+            else:
+                q = np.memmap(self._file(VECTORS_FILE), dtype=np.int8, mode="r", shape=(n, self.dim))
+                s = np.memmap(self._file(SCALES_FILE), dtype=np.float32, mode="r", shape=(n,))
+                self._mapped = (n, q, s)
+        return self._mapped[1], self._mapped[2]
+
+    def add_many(self, vectors, metas):
+        # metas: dicts with image_hash, kind, subtype, confidence and optional
+        # probabilities/biomarkers. An (image_hash, kind) that is already in the
+        # index only has its diagnosis updated. Returns the row of each item.
+        q, scale = quantize(vectors)
+        now = time.time()
+        rows = []
+        with self._lock:
+            db = self._db
+            db.execute("BEGIN IMMEDIATE")  # one writer across processes
+            try:
+                last = db.execute("SELECT MAX(row) FROM cases").fetchone()[0]
+                n = 0 if last is None else last + 1
+                for name, width in ((VECTORS_FILE, self.dim), (SCALES_FILE, 4)):
+                    with open(self._file(name), "ab") as f:
+                        f.truncate(n * width)
+                fresh = []
+                for i, m in enumerate(metas):
+                    values = (m.get("subtype"), m.get("confidence"), json.dumps(m.get("probabilities")),
+                              json.dumps(m.get("biomarkers")))
+                    key = (m["image_hash"], m.get("kind", "single"))
+                    found = db.execute("SELECT row FROM cases WHERE image_hash = ? AND kind = ?", key).fetchone()
+                    if found:
+                        db.execute("UPDATE cases SET subtype = ?, confidence = ?, probabilities = ?, biomarkers = ?,"
+                                   " created = ? WHERE row = ?", values + (now, found[0]))
+                        rows.append(found[0])
+                        continue
+                    db.execute("INSERT INTO cases VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (n + len(fresh),) + key + values + (now,))
+                    rows.append(n + len(fresh))
+                    fresh.append(i)
+                if fresh:
+                    with open(self._file(VECTORS_FILE), "ab") as f:
+                        f.write(q[fresh].tobytes())
+                        f.flush()
+                        os.fsync(f.fileno())
+                    with open(self._file(SCALES_FILE), "ab") as f:
+                        f.write(scale[fresh].tobytes())
+                        f.flush()
+                        os.fsync(f.fileno())
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return rows
+
+    def add(self, vector, image_hash, subtype=None, confidence=None, probabilities=None,
+            biomarkers=None, kind="single"):
+        return self.add_many(vector, [{"image_hash": image_hash, "kind": kind, "subtype": subtype,
+                                       "confidence": confidence, "probabilities": probabilities,
+                                       "biomarkers": biomarkers}])[0]
+
+    def _scan(self, q, s, v, start, stop, k):
+        best_s, best_r = np.empty(0, np.float32), np.empty(0, np.int64)
+        for lo in range(start, stop, CHUNK_ROWS):
+            hi = min(lo + CHUNK_ROWS, stop)
+            scores = (q[lo:hi].astype(np.float32) @ v) * s[lo:hi]
+            best_s, best_r = _top_k(np.concatenate([best_s, scores]),
+                                    np.concatenate([best_r, np.arange(lo, hi)]), k)
+        return best_s, best_r
+
+    def _load_ivf(self):
+        path = self._file("ivf_offsets.npy")
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime != self._ivf_mtime:
+            self._ivf_mtime = mtime
+            self._ivf = None if mtime is None else (
+                np.load(self._file("ivf_centroids.npy")),
+                np.load(self._file("ivf_order.npy"), mmap_mode="r"),
+                np.load(path))
+        return self._ivf
+
+    def search(self, vector, k=5, exclude=None, nprobe=None):
+        # Top-k cosine neighbours with their metadata, best first. With an IVF
+        # built (build_ivf) only the nprobe closest partitions are scored, plus
+        # the rows appended since it was built; nprobe=0 forces a full scan.
+        n = len(self)
+        if n == 0:
+            return []
+        v = _unit(vector)
+        q, s = self._arrays(n)
+        fetch = k + 2 if exclude else k  # a hash has at most one row per kind
+        ivf = self._load_ivf() if nprobe != 0 else None
+        if ivf is None:
+            scores, rows = self._scan(q, s, v, 0, n, fetch)
+        else:
+            centroids, order, offsets = ivf
+            covered = int(offsets[-1])
+            probe = np.argsort(-(centroids @ v))[:nprobe or NPROBE]
+            cand = np.sort(np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe]))
+            scores, rows = _top_k((q[cand].astype(np.float32) @ v) * s[cand], cand.astype(np.int64), fetch)
+            if covered < n:
+                tail_s, tail_r = self._scan(q, s, v, covered, n, fetch)
+                scores, rows = _top_k(np.concatenate([scores, tail_s]), np.concatenate([rows, tail_r]), fetch)
+        meta = self._meta(rows.tolist())
+        out = []
+        for score, row in zip(scores.tolist(), rows.tolist()):
+            m = meta.get(row)
+            if m is None or (exclude and m["image_hash"] == exclude):
+                continue
+            out.append({**m, "similarity": score})
+        return out[:k]
+
+    def _meta(self, rows):
+        if not rows:
+            return {}
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT row, image_hash, kind, subtype, confidence, probabilities, biomarkers, created"
+                f" FROM cases WHERE row IN ({','.join('?' * len(rows))})", rows)
+            found = cur.fetchall()
+        return {r[0]: {"row": r[0], "image_hash": r[1], "kind": r[2], "subtype": r[3], "confidence": r[4],
+                       "probabilities": json.loads(r[5]), "biomarkers": json.loads(r[6]), "created": r[7]}
+                for r in found}
+
+    def build_ivf(self, nlist=None, iters=10, sample=100000, seed=0):
+        # Spherical k-means on a sample, then every row assigned to its closest
+        # centroid; rows are stored grouped by list (ivf_order) with the list
+        # boundaries in ivf_offsets, whose last entry is the rows covered
+        n = len(self)
+        q, s = self._arrays(n)
+        nlist = min(nlist or max(1, int(4 * np.sqrt(n))), n)
+        rng = np.random.default_rng(seed)
+        pick = np.sort(rng.choice(n, min(n, max(sample, nlist)), replace=False))
+        x = q[pick].astype(np.float32) * s[pick, None]
+        centroids = x[rng.choice(len(x), nlist, replace=False)]
+        for _ in range(iters):
+            assign = (x @ centroids.T).argmax(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, x)
+            empty = np.bincount(assign, minlength=nlist) == 0
+            sums[empty] = x[rng.choice(len(x), int(empty.sum()))]  # reseed empty lists
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        assign = np.concatenate([(q[lo:lo + CHUNK_ROWS].astype(np.float32) @ centroids.T).argmax(axis=1)
+                                 for lo in range(0, n, CHUNK_ROWS)])
+        order = np.argsort(assign, kind="stable").astype(np.int32 if n < 2**31 else np.int64)
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+        np.save(self._file("ivf_centroids.npy"), centroids.astype(np.float32))
+        np.save(self._file("ivf_order.npy"), order)
+        # offsets last: its mtime is what tells searchers to reload
+        np.save(self._file("ivf_offsets.npy"), offsets.astype(np.int64))
+        return {"nlist": nlist, "rows": n}
+
+    def stats(self):
+        ivf = self._load_ivf()
+        size = sum(os.path.getsize(self._file(f)) for f in os.listdir(self.path))
+        return {"cases": len(self), "ivf_lists": len(ivf[0]) if ivf else 0,
+                "ivf_rows": int(ivf[2][-1]) if ivf else 0, "disk_mb": size / 2**20}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_case_index():
+    # None when disabled or when the directory cannot be used
+    global _index
+    if _index is None and INDEX_DIR:
+        with _index_lock:
+            if _index is None:
+                try:
+                    _index = CaseIndex(INDEX_DIR)
+                except (OSError, sqlite3.Error) as e:
+                    log.warning("Case index unavailable: %s", e)
+                    return None
+    return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Case index maintenance and benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="size of the index in BCR_INDEX_DIR")
+    ivf = sub.add_parser("build-ivf", help="(re)build the IVF partition of BCR_INDEX_DIR")
+    ivf.add_argument("--nlist", type=int)
+    bench = sub.add_parser("bench", help="search latency on a synthetic index")
+    bench.add_argument("--rows", type=int, default=200000)
+    bench.add_argument("--queries", type=int, default=50)
+    bench.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.cmd == "stats":
+        print(json.dumps(CaseIndex().stats(), indent=2))
+        return
+    if args.cmd == "build-ivf":
+        start = time.perf_counter()
+        info = CaseIndex().build_ivf(args.nlist)
+        print(f"{info['nlist']} lists over {info['rows']} rows in {time.perf_counter() - start:.1f}s")
+        return
+
+    tmp = tempfile.mkdtemp(prefix="case_index_")
+    try:
+        index = CaseIndex(tmp)
+        rng = np.random.default_rng(0)
+        # Clustered vectors, as embeddings of similar tissue are
+        centres = rng.standard_normal((256, DIM)).astype(np.float32)
+        start = time.perf_counter()
+        for lo in range(0, args.rows, 50000):
+            hi = min(lo + 50000, args.rows)
+            x = centres[rng.integers(0, 256, hi - lo)] + 0.5 * rng.standard_normal((hi - lo, DIM), dtype=np.float32)
+            index.add_many(x, [{"image_hash": f"h{i}", "subtype": "IDC", "confidence": 0.9} for i in range(lo, hi)])
+        print(f"{args.rows} rows appended in {time.perf_counter() - start:.1f}s, {index.stats()['disk_mb']:.0f}MB on disk")
+        queries = centres[rng.integers(0, 256, args.queries)] + 0.5 * rng.standard_normal((args.queries, DIM),
+                                                                                         dtype=np.float32)
+        exact = []
+
+        def timed(nprobe):
+            found, times = [], []
+            for v in queries:
+                start = time.perf_counter()
+                found.append({r["row"] for r in index.search(v, args.k, nprobe=nprobe)})
+                times.append(time.perf_counter() - start)
+            return found, np.percentile(np.array(times) * 1000, [50, 95])
+
+        exact, (p50, p95) = timed(0)
+        print(f"  {'brute force':<16} p50 {p50:6.2f}ms  p95 {p95:6.2f}ms")
+        start = time.perf_counter()
+        info = index.build_ivf()
+        print(f"  IVF build: {info['nlist']} lists in {time.perf_counter() - start:.1f}s")
+        for nprobe in (4, 16, 64):
+            found, (p50, p95) = timed(nprobe)
+            recall = np.mean([len(a & b) / args.k for a, b in zip(found, exact)])
+            print(f"  {f'IVF nprobe={nprobe}':<16} p50 {p50:6.2f}ms  p95 {p95:6.2f}ms  recall@{args.k} {recall:.2f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
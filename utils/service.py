@@ -0,0 +1,353 @@
+import argparse
+import base64
+import email.parser
+import email.policy
+import io
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+from utils.cache import content_hash
+from utils.disk_cache import prediction_key
+from utils.metrics import CONTENT_TYPE, get_metrics, timed
+
+log = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+MAX_BATCH_ITEMS = 64
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ServiceState:
+    # Loads the shared InferenceRuntime on a background thread so the liveness
+    # probe answers immediately and readiness flips once the model is warm
+    def __init__(self):
+        self.started = time.time()
+        self.runtime = None
+        self.error = None
+        threading.Thread(target=self._load, name="service-model-load", daemon=True).start()
+
+    def _load(self):
+        try:
+            from utils.inference import get_runtime
+            self.runtime = get_runtime()
+        except Exception as e:
+            log.exception("Model load failed")
+            self.error = str(e)
+
+    def require_runtime(self):
+        if self.runtime is None:
+            raise HTTPError(503, self.error or "model is still loading")
+        return self.runtime
+
+
+def parse_multipart(content_type, body):
+    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    if not msg.is_multipart():
+        raise HTTPError(400, "expected multipart/form-data")
+    fields, files = {}, []
+    for part in msg.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        if part.get_filename() is not None:
+            files.append((name, payload))
+        else:
+            fields[name] = payload.decode("utf-8")
+    return fields, files
+
+
+def _biomarker_args(src, index=None):
+    where = f" for item {index}" if index is not None else ""
+    if not isinstance(src, dict):
+        raise HTTPError(400, f"expected an object{where}")
+    try:
+        return str(src["biomarker"]), str(src["intensity"]), str(src["staining"])
+    except KeyError as e:
+        raise HTTPError(400, f"missing field {e.args[0]!r}{where}")
+
+
+def _parse_json(data, what):
+    try:
+        return json.loads(data)
+    except ValueError:
+        raise HTTPError(400, f"{what} is not valid JSON")
+
+
+def _image_b64(item, index):
+    if not isinstance(item, dict) or "image_b64" not in item:
+        raise HTTPError(400, f"missing field 'image_b64' for item {index}")
+    try:
+        return base64.b64decode(item["image_b64"], validate=True)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"image_b64 of item {index} is not valid base64")
+
+
+def _decode_image(data):
+    try:
+        img = Image.open(io.BytesIO(data))
+        return img.convert("RGB")
+    except Exception:
+        raise HTTPError(400, "could not decode image")
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 with Content-Length on every response keeps connections alive
+    protocol_version = "HTTP/1.1"
+    server_version = "BCRInference/1.0"
+    state = None
+
+    def log_message(self, fmt, *args):
+        log.debug("%s - " + fmt, self.address_string(), *args)
+
+    def _send_json(self, status, payload, close=False):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if close:
+            # Also sets close_connection, so the server stops reading this socket
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _content_length(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise HTTPError(400, "invalid Content-Length")
+        return length
+
+    def _read_body(self):
+        length = self._content_length()
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"body exceeds {MAX_BODY_BYTES} bytes")
+        self._body_read = True
+        return self.rfile.read(length)
+
+    def _body_pending(self):
+        # An error sent before the body was read leaves it in the socket, where
+        # it would be parsed as the next keep-alive request. With an invalid
+        # length the body's end is unknown, so that connection closes too.
+        try:
+            return not self._body_read and self._content_length() > 0
+        except HTTPError:
+            return True
+
+    def _dispatch(self, routes):
+        path = urlparse(self.path).path
+        handler = routes.get(path)
+        start = time.perf_counter()
+        status = 200
+        self._body_read = False
+        try:
+            if handler is None:
+                raise HTTPError(404, f"no route for {path}")
+            self._send_json(200, handler())
+        except HTTPError as e:
+            status = e.status
+            self._send_json(e.status, {"error": str(e)}, close=self._body_pending())
+        except Exception as e:
+            status = 500
+            log.exception("Request failed")
+            self._send_json(500, {"error": str(e)}, close=self._body_pending())
+        if handler is not None:
+            metrics = get_metrics()
+            metrics.observe(f"request:{path}", time.perf_counter() - start)
+            metrics.inc("requests_total", help="Service requests by route and status", route=path, status=status)
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/metrics":
+            self.metrics()
+            return
+        self._dispatch({"/healthz": self.liveness, "/readyz": self.readiness})
+
+    def metrics(self):
+        # Prometheus scrape endpoint: the same registry the Streamlit app exports
+        body = get_metrics().render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self._dispatch({"/v1/predict": self.predict, "/v1/predict/batch": self.predict_batch,
+                        "/v1/predict/npy": self.predict_npy})
+
+    def liveness(self):
+        return {"status": "ok", "uptime_s": round(time.time() - self.state.started, 1)}
+
+    def readiness(self):
+        rt = self.state.runtime
+        if rt is None:
+            raise HTTPError(503, self.state.error or "model is still loading")
+        return {
+            "ready": True,
+            "warm": bool(getattr(rt.model, "warmup_s", None)),
+            "backend": getattr(rt.model, "name", "torch"),
+            "precision": getattr(rt.model, "precision", "fp32"),
+            "compile_mode": getattr(rt.model, "compile_mode", "eager"),
+            "warmup_s": getattr(rt.model, "warmup_s", {}),
+        }
+
+    def _items_from_request(self):
+        # Returns [(image_bytes, (marker, intensity, staining))] from either
+        # multipart uploads or a JSON body with base64 images
+        body = self._read_body()
+        ctype = self.headers.get("Content-Type", "")
+        if ctype.startswith("multipart/form-data"):
+            fields, files = parse_multipart(ctype, body)
+            images = [data for name, data in files if name in ("image", "images")]
+            if "items" in fields:
+                per_item = _parse_json(fields["items"].encode(), "items")
+                if not isinstance(per_item, list) or len(per_item) != len(images):
+                    raise HTTPError(400, "items must have one entry per image")
+                return [(img, _biomarker_args(it, i)) for i, (img, it) in enumerate(zip(images, per_item))]
+            shared = _biomarker_args(fields)
+            return [(img, shared) for img in images]
+        if ctype.startswith("application/json"):
+            payload = _parse_json(body or b"{}", "body")
+            items = payload.get("items", [payload]) if isinstance(payload, dict) else None
+            if not isinstance(items, list):
+                raise HTTPError(400, "body must be an object or {\"items\": [...]}")
+            return [(_image_b64(it, i), _biomarker_args(it, i)) for i, it in enumerate(items)]
+        raise HTTPError(415, "send multipart/form-data or application/json")
+
+    def _cached(self, keys, bio_args):
+        # Looks every item up in the shared disk cache before anything is
+        # decoded; returns the cache keys and the results found (None = miss)
+        from utils.inference import load_cached_prediction
+
+        rt = self.state.require_runtime()
+        unknown = sorted({u for bio in set(bio_args) for u in rt.bio_encoder.unknown(*bio)})
+        if unknown:
+            raise HTTPError(400, "unknown biomarker values: " + ", ".join(unknown))
+        cache_keys = [prediction_key(key, rt.bio_encoder.ids(*bio), rt.model_version, kind="service")
+                      for key, bio in zip(keys, bio_args)]
+        return cache_keys, [load_cached_prediction(k) for k in cache_keys]
+
+    def _run(self, images, bio_args, keys, cache_keys=None):
+        import torch
+        from utils.inference import predict_batch, store_cached_prediction
+
+        rt = self.state.require_runtime()
+        bio = torch.tensor([rt.bio_encoder.ids(m, i, s) for m, i, s in bio_args], dtype=torch.int64)
+        start = time.perf_counter()
+        probs = predict_batch(rt.model, images, bio, keys, rt.embedding_cache, rt.governor)
+        infer_ms = (time.perf_counter() - start) * 1000
+        results = []
+        for p, key, cache_key in zip(probs, keys, cache_keys or [None] * len(keys)):
+            idx = int(np.argmax(p))
+            results.append({
+                "subtype": rt.idx_to_subtype[idx],
+                "confidence": float(p[idx]),
+                "probabilities": {rt.idx_to_subtype[i]: float(v) for i, v in enumerate(p)},
+                "image_hash": key,
+            })
+            store_cached_prediction(cache_key, results[-1])
+        return results, infer_ms
+
+    def _run_cached(self, load, bio_args, keys):
+        # Runs only the cache misses; load(indices) produces their model input
+        cache_keys, results = self._cached(keys, bio_args)
+        todo = [i for i, r in enumerate(results) if r is None]
+        start = time.perf_counter()
+        with timed("decode"):
+            images = load(todo) if todo else None
+        decode_ms = (time.perf_counter() - start) * 1000
+        infer_ms = 0.0
+        if todo:
+            fresh, infer_ms = self._run(images, [bio_args[i] for i in todo], [keys[i] for i in todo],
+                                        [cache_keys[i] for i in todo])
+            for i, r in zip(todo, fresh):
+                results[i] = r
+        timings = {"decode_ms": round(decode_ms, 2), "inference_ms": round(infer_ms, 2),
+                   "cache_hits": len(keys) - len(todo)}
+        return results, timings
+
+    def _predict_items(self, items):
+        if not items:
+            raise HTTPError(400, "no images in request")
+        if len(items) > MAX_BATCH_ITEMS:
+            raise HTTPError(413, f"at most {MAX_BATCH_ITEMS} images per request")
+        keys = [content_hash(data) for data, _ in items]
+        return self._run_cached(lambda todo: [_decode_image(items[i][0]) for i in todo],
+                                [b for _, b in items], keys)
+
+    def predict(self):
+        items = self._items_from_request()
+        if len(items) != 1:
+            raise HTTPError(400, "use /v1/predict/batch for more than one image")
+        results, timings = self._predict_items(items)
+        return {**results[0], "timings_ms": timings}
+
+    def predict_batch(self):
+        results, timings = self._predict_items(self._items_from_request())
+        return {"results": results, "timings_ms": timings}
+
+    def predict_npy(self):
+        # Raw tensors: an .npy array of already normalised (N, 3, 224, 224) or
+        # (3, 224, 224) float32 images; biomarker fields come from the query string
+        import torch
+        from utils.preprocessing import IMAGE_SIZE
+
+        body = self._read_body()
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        bio_args = _biomarker_args(query)
+        try:
+            arr = np.load(io.BytesIO(body), allow_pickle=False)
+        except ValueError:
+            raise HTTPError(400, "body is not a valid .npy array")
+        if arr.ndim == 3:
+            arr = arr[None]
+        if arr.ndim != 4 or arr.shape[1:] != (3, IMAGE_SIZE, IMAGE_SIZE):
+            raise HTTPError(400, f"expected (N, 3, {IMAGE_SIZE}, {IMAGE_SIZE}), got {arr.shape}")
+        if arr.shape[0] > MAX_BATCH_ITEMS:
+            raise HTTPError(413, f"at most {MAX_BATCH_ITEMS} images per request")
+        arr = np.ascontiguousarray(arr, dtype=np.float32)
+        keys = [content_hash(a.tobytes()) for a in arr]
+        results, timings = self._run_cached(lambda todo: torch.from_numpy(arr[todo]), [bio_args] * len(arr), keys)
+        timings.pop("decode_ms")
+        return {"results": results, "timings_ms": timings}
+
+
+def make_server(host="127.0.0.1", port=8600):
+    handler = type("Handler", (InferenceHandler,), {"state": ServiceState()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP inference service for DinoMLPFusion")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    server = make_server(args.host, args.port)
+    log.info("Serving on http://%s:%d (model loading in the background)", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
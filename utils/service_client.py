@@ -0,0 +1,182 @@
+import argparse
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+class ServiceClient:
+    # One persistent HTTP/1.1 connection; not thread-safe, use one per thread
+    def __init__(self, host="127.0.0.1", port=8600, timeout=60):
+        self.host, self.port, self.timeout = host, port, timeout
+        self._conn = None
+
+    def _request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._conn.request(method, path, body=body, headers=headers or {})
+                resp = self._conn.getresponse()
+                data = resp.read()
+                return resp.status, json.loads(data) if data else {}
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed an idle keep-alive connection; reconnect once
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def health(self):
+        return self._request("GET", "/healthz")
+
+    def ready(self):
+        return self._request("GET", "/readyz")
+
+    def wait_ready(self, timeout=300, interval=0.5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                status, body = self.ready()
+                if status == 200:
+                    return body
+            except OSError:
+                self.close()
+            time.sleep(interval)
+        raise TimeoutError(f"service not ready after {timeout}s")
+
+    def predict(self, images, biomarker, intensity, staining):
+        # images: list of (filename, bytes); more than one goes to the batch endpoint
+        boundary = uuid.uuid4().hex
+        buf = io.BytesIO()
+        for name, value in (("biomarker", biomarker), ("intensity", intensity), ("staining", staining)):
+            buf.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        for filename, data in images:
+            buf.write(f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+                      f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+            buf.write(data)
+            buf.write(b"\r\n")
+        buf.write(f"--{boundary}--\r\n".encode())
+        path = "/v1/predict" if len(images) == 1 else "/v1/predict/batch"
+        return self._request("POST", path, buf.getvalue(),
+                             {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+
+    def predict_npy(self, arr, biomarker, intensity, staining):
+        buf = io.BytesIO()
+        np.save(buf, np.asarray(arr, dtype=np.float32))
+        query = f"biomarker={biomarker}&intensity={intensity}&staining={staining}"
+        return self._request("POST", f"/v1/predict/npy?{query}", buf.getvalue(),
+                             {"Content-Type": "application/octet-stream"})
+
+
+def load_images(path, limit):
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTS))
+    if not files:
+        raise SystemExit(f"No images found in {path}")
+    out = []
+    for f in files[:limit]:
+        with open(f, "rb") as fh:
+            out.append((os.path.basename(f), fh.read()))
+    return out
+
+
+def load_test(args, images):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    rng = np.random.default_rng(0)
+    npy = rng.standard_normal((args.batch, 3, 224, 224), dtype=np.float32) if args.mode == "npy" else None
+
+    def worker(wid):
+        client = ServiceClient(args.host, args.port)
+        for i in range(wid, args.requests, args.concurrency):
+            start = time.perf_counter()
+            try:
+                if args.mode == "npy":
+                    status, body = client.predict_npy(npy, args.biomarker, args.intensity, args.staining)
+                else:
+                    batch = [images[(i * args.batch + j) % len(images)] for j in range(args.batch)]
+                    status, body = client.predict(batch, args.biomarker, args.intensity, args.staining)
+                err = None if status == 200 else f"{status}: {body.get('error')}"
+            except Exception as e:
+                err = repr(e)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if err:
+                    errors.append(err)
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    lat = np.array(latencies)
+    return {
+        "mode": args.mode,
+        "requests": len(latencies),
+        "images": len(latencies) * args.batch,
+        "concurrency": args.concurrency,
+        "batch": args.batch,
+        "errors": len(errors),
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(len(latencies) / wall, 2),
+        "images_per_s": round(len(latencies) * args.batch / wall, 2),
+        "p50_ms": round(float(np.percentile(lat, 50)), 2),
+        "p95_ms": round(float(np.percentile(lat, 95)), 2),
+        "p99_ms": round(float(np.percentile(lat, 99)), 2),
+        "first_errors": errors[:5],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test client for utils.service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--images", help="image file or directory (required unless --mode npy)")
+    parser.add_argument("--mode", choices=["multipart", "npy"], default="multipart")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=1, help="images per request")
+    parser.add_argument("--biomarker", default="ESR1")
+    parser.add_argument("--intensity", default="Strong")
+    parser.add_argument("--staining", default="High")
+    parser.add_argument("--wait", type=float, default=300, help="seconds to wait for /readyz")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    if args.mode == "multipart" and not args.images:
+        parser.error("--images is required for multipart mode")
+    images = load_images(args.images, max(args.batch, 64)) if args.images else []
+
+    probe = ServiceClient(args.host, args.port)
+    ready = probe.wait_ready(args.wait)
+    probe.close()
+    print(f"Service ready: {ready}")
+
+    report = load_test(args, images)
+    for key, value in report.items():
+        print(f"  {key:<16} {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
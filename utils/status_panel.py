@@ -0,0 +1,65 @@
+import sys
+
+import pandas as pd
+import streamlit as st
+
+from utils.jobs import get_job_manager
+from utils.metrics import get_metrics, metrics_url
+from utils.preload import inference_ready
+
+# Stages shown first, in pipeline order; any other timed stage follows
+STAGE_ORDER = ("decode", "preprocess", "backbone", "head", "explain", "tta_backbone", "tiles", "render",
+               "similar_cases", "history_save", "prediction")
+
+
+def _device():
+    # torch is only looked at once the preload thread has imported it
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        return f"GPU ({torch.cuda.get_device_name(0)})"
+    return "CPU only"
+
+
+@st.fragment(run_every=5)
+def status_panel():
+    # Live replacement for the old hard-coded badges; call inside `with st.sidebar:`
+    st.markdown("### 📈 System Status")
+    if inference_ready():
+        rt = sys.modules["utils.inference"].get_runtime()
+        st.success(f"✅ Model loaded: {rt.model_version}")
+    else:
+        rt = None
+        st.info("⏳ Model loading in the background…")
+
+    metrics = get_metrics()
+    p = metrics.process()
+    jobs = get_job_manager().stats()
+    col1, col2 = st.columns(2)
+    col1.metric("Memory (RSS)", f"{p['rss_mb']:.0f} MB")
+    col2.metric("CPU", f"{p['cpu_percent']:.0f}%", help=f"100% = one core; {p['cores']} cores")
+    col1.metric("Jobs running", jobs.get('running', 0))
+    col2.metric("Jobs queued", jobs.get('queued', 0))
+    st.caption(f"⚙️ {_device()} • {p['cores']} cores • {p['threads']} threads")
+
+    if rt is not None:
+        cs = rt.embedding_cache.stats()
+        st.caption(f"Embedding cache: {cs['entries']} images • {cs['hit_rate']:.0%} hit rate")
+        if rt.disk_cache is not None:
+            ds = rt.disk_cache.stats()
+            st.caption(f"Prediction cache: {ds['entries']} results • "
+                       f"{ds['bytes'] / 2**20:.0f}/{ds['max_bytes'] / 2**20:.0f} MB • {ds['hits']} hits")
+        ss, gs = rt.scheduler.stats(), rt.governor.stats()
+        st.caption(f"Batching: {ss['queue_depth']} queued • avg batch {ss['avg_batch_size']:.1f}")
+        st.caption(f"Governor ({gs['policy']}): {gs['active']}/{gs['max_concurrent']} running × "
+                   f"{gs['threads_per_worker']} threads • {gs['queue_depth']} waiting")
+
+    stages = metrics.stages()
+    if stages:
+        order = [s for s in STAGE_ORDER if s in stages] + [s for s in stages if s not in STAGE_ORDER]
+        table = pd.DataFrame([{'stage': s, 'n': stages[s]['count'],
+                               **{q: stages[s][q] * 1000 for q in ('p50', 'p95', 'p99')}} for s in order])
+        with st.expander("⏱️ Stage latency (ms)"):
+            st.dataframe(table.set_index('stage').round(1), use_container_width=True)
+    url = metrics_url()
+    if url:
+        st.caption(f"Prometheus metrics: {url}")
@@ -0,0 +1,97 @@
+import math
+import time
+
+from utils.metrics import current_rss_mb
+
+# torch is imported inside the functions that need it: the preprocess pool's
+# spawned workers import is_background from here and must stay torch-free
+
+
+def _positions(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+    pos = list(range(0, length - tile_size + 1, stride))
+    if pos[-1] != length - tile_size:
+        pos.append(length - tile_size)
+    return pos
+
+
+def tile_grid(width, height, tile_size=224, overlap=0.25):
+    stride = max(1, int(round(tile_size * (1 - overlap))))
+    for y in _positions(height, tile_size, stride):
+        for x in _positions(width, tile_size, stride):
+            yield (x, y, x + tile_size, y + tile_size)
+
+
+def count_tiles(width, height, tile_size=224, overlap=0.25):
+    stride = max(1, int(round(tile_size * (1 - overlap))))
+    return len(_positions(width, tile_size, stride)) * len(_positions(height, tile_size, stride))
+
+
+def is_background(tile, threshold=220, min_tissue=0.1):
+    # Slide background is bright and flat; judge on a 32x32 grayscale proxy.
+    # The only background test: the serial and the pooled tilers both use it.
+    small = tile.convert('L').resize((32, 32))
+    dark = sum(1 for v in small.getdata() if v < threshold)
+    return dark / 1024.0 < min_tissue
+
+
+def iter_tile_batches(img, transform, tile_size=224, overlap=0.25, batch_size=32,
+                      skip_background=True):
+    import torch
+
+    img = img.convert('RGB')
+    batch, boxes = [], []
+    for box in tile_grid(img.size[0], img.size[1], tile_size, overlap):
+        tile = img.crop(box)
+        if skip_background and is_background(tile):
+            continue
+        batch.append(transform(tile))
+        boxes.append(box)
+        if len(batch) == batch_size:
+            yield torch.stack(batch), boxes
+            batch, boxes = [], []
+    if batch:
+        yield torch.stack(batch), boxes
+
+
+def embed_tiles(embed_fn, batches):
+    # Only one batch of pixels is alive at a time; embeddings are 384 floats per tile
+    import torch
+
+    embeddings, all_boxes = [], []
+    start = time.perf_counter()
+    peak_rss = current_rss_mb()
+    for tiles, boxes in batches:
+        with torch.no_grad():
+            embeddings.append(embed_fn(tiles).cpu())
+        all_boxes.extend(boxes)
+        del tiles
+        peak_rss = max(peak_rss, current_rss_mb())
+    elapsed = time.perf_counter() - start
+    emb = torch.cat(embeddings) if embeddings else torch.empty(0)
+    stats = {
+        'tiles': len(all_boxes),
+        'seconds': elapsed,
+        'tiles_per_sec': len(all_boxes) / elapsed if elapsed > 0 else 0.0,
+        'peak_rss_mb': peak_rss,
+    }
+    return emb, all_boxes, stats
+
+
+def mean_pool(embeddings):
+    return embeddings.mean(dim=0, keepdim=True)
+
+
+def attention_pool(embeddings, temperature=1.0):
+    # Parameter-free attention: tiles that agree with the slide consensus weigh more
+    query = embeddings.mean(dim=0)
+    scores = embeddings @ query / (math.sqrt(embeddings.shape[1]) * temperature)
+    weights = scores.softmax(dim=0)
+    return (weights.unsqueeze(1) * embeddings).sum(dim=0, keepdim=True), weights
+
+
+def aggregate(embeddings, method='mean'):
+    if method == 'attention':
+        return attention_pool(embeddings)[0]
+    return mean_pool(embeddings)
@@ -0,0 +1,127 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+
+from utils.preprocessing import MEAN, STD
+
+# The 8 symmetries of the square: rotations by k*90° (k = 0..3), each with and
+# without a horizontal flip. H&E tissue has no canonical orientation.
+DIHEDRAL_VIEWS = 8
+MODES = ("prob", "logits")
+
+_MEAN = torch.from_numpy(MEAN).view(1, 3, 1, 1)
+_STD = torch.from_numpy(STD).view(1, 3, 1, 1)
+
+
+def dihedral(x, views=DIHEDRAL_VIEWS):
+    # (1, 3, H, W) normalised tensor -> (views, 3, H, W); view 0 is the
+    # identity, so its embedding is the plain prediction's embedding
+    out = []
+    for k in range(4):
+        r = torch.rot90(x, k, dims=(2, 3))
+        out += [r, r.flip(-1)]
+    return torch.cat(out[:views])
+
+
+def color_jitter(x, strength=0.08, seed=0):
+    # Stain/scanner variation in pixel space: per-image brightness and
+    # contrast plus a per-channel gain. Seeded, so a given upload always gets
+    # the same views and their embeddings can be cached.
+    g = torch.Generator().manual_seed(seed)
+    n = x.shape[0]
+    u = lambda *shape: (torch.rand(*shape, generator=g) * 2 - 1) * strength
+    px = x * _STD + _MEAN
+    mean = px.mean(dim=(1, 2, 3), keepdim=True)
+    px = (px - mean) * (1 + u(n, 1, 1, 1)) + mean + u(n, 1, 1, 1)
+    px = px * (1 + u(n, 3, 1, 1))
+    return (px.clamp(0, 1) - _MEAN) / _STD
+
+
+def tta_batch(x, views=DIHEDRAL_VIEWS, jitter=0, seed=0):
+    # views dihedral variants, then `jitter` colour-jittered copies of them
+    base = dihedral(x, views)
+    if not jitter:
+        return base
+    return torch.cat([base] + [color_jitter(base, seed=seed + i) for i in range(jitter)])
+
+
+def combine(logits, mode="prob"):
+    # Averages the (V, C) per-view logits into one distribution. Disagreement
+    # is each view's total-variation distance from that consensus (0 means the
+    # view agrees exactly, 1 means disjoint), agreement the share of views
+    # whose top class is the consensus top class.
+    if mode not in MODES:
+        raise ValueError(f"Unknown TTA mode: {mode!r}")
+    per_view = torch.softmax(logits, dim=1)
+    if mode == "logits":
+        probs = torch.softmax(logits.mean(dim=0), dim=0)
+    else:
+        probs = per_view.mean(dim=0)
+    tv = 0.5 * (per_view - probs).abs().sum(dim=1)
+    top = int(probs.argmax())
+    return probs.cpu().numpy(), {
+        'views': logits.shape[0],
+        'mode': mode,
+        'disagreement': float(tv.mean()),
+        'per_view': tv.cpu().numpy().tolist(),
+        'agreement': float((per_view.argmax(dim=1) == top).float().mean()),
+    }
+
+
+def tta_embed(model, img, views=DIHEDRAL_VIEWS, jitter=0, seed=0):
+    # All views go through the backbone as one batch: a single forward whose
+    # cost grows far slower than the number of views
+    with torch.no_grad():
+        return model.embed(tta_batch(img, views, jitter, seed))
+
+
+def tta_head(model, emb, bio, mode="prob"):
+    with torch.no_grad():
+        logits = model.forward_head(emb, bio.expand(emb.shape[0], -1))
+    return combine(logits, mode)
+
+
+def main():
+    from utils.inference import get_runtime, process_biomarker_input
+    from utils.model import transform_dino
+    from utils.preprocessing import IMAGE_SIZE
+    from utils.quantization import load_calibration_images
+
+    parser = argparse.ArgumentParser(description="Measure batched TTA latency against a single forward")
+    parser.add_argument("--images", help="directory of local slide images (default: random input)")
+    parser.add_argument("--limit", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--jitter", type=int, default=1, help="jittered copies for the last row")
+    args = parser.parse_args()
+
+    rt = get_runtime()
+    if args.images:
+        images = torch.from_numpy(np.stack(load_calibration_images(args.images, transform_dino, args.limit)))
+    else:
+        images = torch.randn(args.limit, 3, IMAGE_SIZE, IMAGE_SIZE)
+    bio = process_biomarker_input("ESR1", "Strong", "High", rt.bm_feat_cols)
+
+    def timed(views, jitter=0):
+        best = float("inf")
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            for i in range(images.shape[0]):
+                tta_head(rt.model, tta_embed(rt.model, images[i:i + 1], views, jitter), bio)
+            best = min(best, time.perf_counter() - start)
+        return best / images.shape[0] * 1000
+
+    timed(1)  # allocator/kernel warm-up outside the table
+    single = timed(1)
+    print(f"{os.cpu_count()} cores, {rt.model.name} backend, {images.shape[0]} images, best of {args.repeats}")
+    print(f"  {'views':>5} {'ms/image':>9} {'x single':>9} {'ms/view':>8}")
+    for views, jitter in [(1, 0), (2, 0), (4, 0), (8, 0), (8, args.jitter)]:
+        n = views * (1 + jitter)
+        ms = single if n == 1 else timed(views, jitter)
+        print(f"  {n:>5} {ms:>9.1f} {ms / single:>8.2f}x {ms / n:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,5 @@
 import plotly.graph_objects as go
 import plotly.express as px
-import numpy as np
-from PIL import Image, ImageDraw, ImageFilter
 import pandas as pd
 
 def create_biomarker_radar(biomarker_data):
@@ -96,39 +94,15 @@ def create_confidence_chart(predictions):
     
     return fig
 
-def create_gradcam_overlay(original_image):
-    width, height = original_image.size
+def create_gradcam_overlay(original_image, heatmap=None, alpha=0.45, max_side=1600):
+    if heatmap is None:
+        return original_image.convert('RGB')
     
-    heatmap = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(heatmap)
+    # heatmap is the model's low-res patch grid in [0, 1]; it is colormapped
+    # with a LUT at display resolution (cv2 is imported on first use only)
+    from utils.overlay import render_overlay
     
-    np.random.seed(42)
-    num_hotspots = np.random.randint(3, 7)
-    
-    for _ in range(num_hotspots):
-        center_x = np.random.randint(width // 4, 3 * width // 4)
-        center_y = np.random.randint(height // 4, 3 * height // 4)
-        radius = np.random.randint(20, min(width, height) // 8)
-        
-        intensity = np.random.uniform(0.3, 0.8)
-        
-        for r in range(radius, 0, -2):
-            alpha = int(255 * intensity * (radius - r) / radius)
-            color = (255, int(255 * (1 - intensity)), 0, alpha)
-            
-            draw.ellipse([
-                center_x - r, center_y - r,
-                center_x + r, center_y + r
-            ], fill=color)
-    
-    heatmap = heatmap.filter(ImageFilter.GaussianBlur(radius=3))
-    
-    result = Image.alpha_composite(
-        original_image.convert('RGBA'),
-        heatmap
-    )
-    
-    return result.convert('RGB')
+    return render_overlay(original_image, heatmap, max_side=max_side, alpha=alpha)
 
 def create_biomarker_heatmap(biomarker_data):
     markers = list(biomarker_data.keys())
@@ -177,6 +151,40 @@ def create_biomarker_heatmap(biomarker_data):
     
     return fig
 
+def create_whatif_heatmap(table, subtype, staining):
+    # table is the what-if sweep: (biomarker, intensity, staining) rows,
+    # one probability column per subtype
+    view = table.xs(staining, level='staining')
+    probs = view[subtype].unstack('intensity')
+    top = view.idxmax(axis=1).unstack('intensity').loc[probs.index, probs.columns]
+    
+    # Training data spells some categories with a trailing space; keep them
+    # apart on the axis instead of letting Plotly merge the two labels
+    label = lambda v: v.strip() + '*' if v != v.strip() else v
+    
+    fig = go.Figure(data=go.Heatmap(
+        z=probs.values,
+        x=[label(v) for v in probs.columns],
+        y=[label(v) for v in probs.index],
+        zmin=0,
+        zmax=1,
+        colorscale='RdYlBu_r',
+        text=top.values,
+        texttemplate='%{text}',
+        textfont={"size": 9},
+        hovertemplate='%{y} / %{x}<br>P(' + subtype + ') = %{z:.1%}<br>top: %{text}<extra></extra>',
+        colorbar=dict(title=f"P({subtype})", tickformat='.0%')
+    ))
+    
+    fig.update_layout(
+        title=f"What-if: P({subtype}) with staining {label(staining)}",
+        xaxis_title="Intensity",
+        yaxis_title="Biomarker",
+        height=max(300, 28 * len(probs.index) + 120)
+    )
+    
+    return fig
+
 def create_performance_metrics(metrics):
     categories = ['Accuracy', 'Precision', 'Recall', 'F1-Score']
     
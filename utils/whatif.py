@@ -0,0 +1,76 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from utils.bio_encoder import FEATURE_GROUPS, BiomarkerEncoder, feature_values
+
+
+def combinations(bm_feat_cols, markers=None, intensities=None, stainings=None):
+    # Every marker x intensity x staining (each defaults to all of its
+    # values) as a MultiIndex and the matching (N, 3) BiomarkerEncoder ids
+    encoder = BiomarkerEncoder(bm_feat_cols)
+    groups = feature_values(bm_feat_cols)
+    chosen = [list(sel) if sel else groups[g] for g, sel in zip(FEATURE_GROUPS, (markers, intensities, stainings))]
+    for group, values in zip(FEATURE_GROUPS, chosen):
+        unknown = [v for v in values if v not in groups[group]]
+        if unknown:
+            raise ValueError(f"Unknown {group} values: {unknown}")
+    combos = pd.MultiIndex.from_product(chosen, names=FEATURE_GROUPS)
+    return combos, encoder.encode_frame(combos.to_frame(index=False))
+
+
+def sweep(model, x_img, bm_feat_cols, idx_to_subtype, markers=None, intensities=None, stainings=None):
+    # One embedding against every bio vector: a single bio projection + head
+    # call over the whole grid, no backbone work. Rows are combinations,
+    # columns subtype probabilities.
+    combos, ids = combinations(bm_feat_cols, markers, intensities, stainings)
+    with torch.no_grad():
+        logits = model.forward_head_ids(x_img.expand(ids.shape[0], -1), ids)
+        probs = torch.softmax(logits, dim=1).cpu().numpy()
+    return pd.DataFrame(probs, index=combos, columns=[idx_to_subtype[i] for i in range(probs.shape[1])])
+
+
+def main():
+    from PIL import Image
+
+    from utils.inference import get_runtime, predict_dino, process_biomarker_input
+    from utils.model import transform_dino
+    from utils.preprocessing import IMAGE_SIZE
+
+    parser = argparse.ArgumentParser(description="Time the batched what-if sweep against per-combination forwards")
+    parser.add_argument("--image", help="local slide image (default: random pixels)")
+    parser.add_argument("--sample", type=int, default=16, help="full forwards timed to extrapolate the naive sweep")
+    args = parser.parse_args()
+
+    rt = get_runtime()
+    if args.image:
+        img = Image.open(args.image).convert("RGB")
+    else:
+        rng = np.random.default_rng(0)
+        img = Image.fromarray(rng.integers(0, 256, (IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8))
+    combos, _ = combinations(rt.bm_feat_cols)
+
+    start = time.perf_counter()
+    for marker, intensity, staining in list(combos)[:args.sample]:
+        predict_dino(rt.model, img, process_biomarker_input(marker, intensity, staining, rt.bm_feat_cols))
+    naive = (time.perf_counter() - start) / min(args.sample, len(combos))
+
+    start = time.perf_counter()
+    x_img = rt.model.embed(transform_dino(img).unsqueeze(0))
+    embed_s = time.perf_counter() - start
+    start = time.perf_counter()
+    table = sweep(rt.model, x_img, rt.bm_feat_cols, rt.idx_to_subtype)
+    head_s = time.perf_counter() - start
+
+    print(f"{os.cpu_count()} cores, {rt.model.name} backend, {len(combos)} combinations")
+    print(f"  per-combination forwards  {naive * len(combos):8.2f} s  (extrapolated from {args.sample})")
+    print(f"  one embedding + one head  {embed_s + head_s:8.3f} s  (head {head_s * 1000:.1f} ms)")
+    print(table.idxmax(axis=1).value_counts().to_string())
+
+
+if __name__ == "__main__":
+    main()